@@ -25,11 +25,16 @@ export class AppEcs extends Construct {
       enableFargateCapacityProviders: true,
     });
 
+    const memoryLimitMiB = 1024;
+    // Chroma evicts idle collections beyond this share of the task memory
+    const chromaMemoryLimitBytes =
+      Math.floor(memoryLimitMiB * 0.25) * 1024 * 1024;
+
     const taskDefinition = new ecs.FargateTaskDefinition(
       this,
       "AppTaskDefinition",
       {
-        memoryLimitMiB: 1024,
+        memoryLimitMiB: memoryLimitMiB,
         cpu: 512,
         ephemeralStorageGiB: 80,
       }
@@ -54,7 +59,17 @@ export class AppEcs extends Construct {
         streamPrefix: "image-reader",
         logRetention: 30,
       }),
-      portMappings: [{ containerPort: 8501, hostPort: 8501 }],
+      portMappings: [
+        { containerPort: 8501, hostPort: 8501 },
+        { containerPort: 8502, hostPort: 8502 },
+      ],
+      environment: {
+        CHROMA_MEMORY_LIMIT_BYTES: String(chromaMemoryLimitBytes),
+      },
+      dockerLabels: {
+        ECS_PROMETHEUS_EXPORTER_PORT: "8502",
+        ECS_PROMETHEUS_METRICS_PATH: "/metrics",
+      },
       essential: true,
     });
     containerDefinition.addMountPoints({
@@ -102,6 +117,11 @@ export class AppEcs extends Construct {
       ec2.Port.tcp(8501),
       "Streamlit"
     );
+    serviceSecurityGroup.addIngressRule(
+      ec2.Peer.ipv4(props.vpc.vpcCidrBlock),
+      ec2.Port.tcp(8502),
+      "Metrics"
+    );
 
     this.service = new ecs.FargateService(this, "AppService", {
       cluster: cluster,
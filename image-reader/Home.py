@@ -4,10 +4,13 @@ import streamlit as st
 
 from lib import utils
 from lib import constants
+from lib import streaming
 from lib.prompt_library import crawl_prompt_list, crawl_prompt
 
 st.header("Home", divider=True)
 
+utils.setup_storage()
+
 prompt_library = crawl_prompt_list()
 prompt_list = prompt_library.keys()
 
@@ -16,6 +19,9 @@ st.sidebar.subheader("Playground")
 model_id = st.sidebar.selectbox(
     label="Select model:", index=0, options=constants.MODEL_IDS
 )
+compare_with = st.sidebar.multiselect(
+    label="Compare side by side with:", options=constants.MODEL_IDS
+)
 sample = st.sidebar.selectbox(
     label="Select a sample from prompt library:",
     index=0,
@@ -39,6 +45,11 @@ with prompt_window:
         user_prompt = st.text_area(
             label="User prompt:", height=350, value=prompt["user"]
         )
+        use_cache = st.checkbox(
+            "Use cached responses",
+            value=True,
+            help="Replay the saved answer to an identical request, untick to ask the model again.",
+        )
         submitted = st.form_submit_button("Submit")
 
 with response_window:
@@ -58,15 +69,36 @@ with response_window:
     )
 
 if submitted:
-    response = ""
-    with response_window:
-        with st.spinner("Reading..."):
-            stream = utils.read_images_with_response_stream(
-                model_id, system_prompt, [], user_prompt
-            )
-            for token in stream:
-                if token == "message_start":
-                    break
-        for token in stream:
-            response += token
-            st.write(response.replace("$", "\$"))
+    model_ids = [model_id] + [other for other in compare_with if other != model_id]
+    with response_window.container():
+        if len(model_ids) > 1:
+            records = []
+            columns = st.columns(len(model_ids))
+            for column, compared_model_id in zip(columns, model_ids):
+                column.caption(compared_model_id)
+            with st.spinner("Reading..."):
+                streaming.render_side_by_side(
+                    {
+                        compared_model_id: column.container()
+                        for column, compared_model_id in zip(columns, model_ids)
+                    },
+                    utils.compare_models_with_response_stream(
+                        model_ids,
+                        system_prompt,
+                        [],
+                        user_prompt,
+                        on_finish=records.append,
+                        use_cache=use_cache,
+                    ),
+                )
+            st.table(streaming.summary_rows(records))
+        else:
+            with st.spinner("Reading..."):
+                stream = utils.read_images_with_response_stream(
+                    model_id, system_prompt, [], user_prompt, use_cache=use_cache
+                )
+                for token in stream:
+                    if token == "message_start":
+                        break
+            renderer = streaming.StreamRenderer(st.container())
+            renderer.render(streaming.coalesce(stream))
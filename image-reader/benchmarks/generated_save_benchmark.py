@@ -0,0 +1,85 @@
+"""Benchmark saving generated images to the library against a local fake bedrock
+
+Run from the image-reader directory: python -m benchmarks.generated_save_benchmark
+Compares the legacy path, which keeps BytesIO copies and embeds on save, with
+GeneratedImage objects embedded from the Titan payload at generation time.
+"""
+
+import io
+import time
+import base64
+import argparse
+import tempfile
+import tracemalloc
+
+from lib import generation
+from lib import utils
+from lib.fake_bedrock import FakeBedrockRuntime
+from benchmarks.ingest_benchmark import make_images, use_temp_storage
+
+
+def legacy_generated(payloads):
+    """Decode Titan payloads into BytesIO like the page used to"""
+    return [io.BytesIO(base64.b64decode(payload)) for payload in payloads]
+
+
+def direct_generated(payloads):
+    """Decode Titan payloads into GeneratedImage and embed them from the payload"""
+    images = []
+    for idx, payload in enumerate(payloads):
+        image = base64.b64decode(payload)
+        utils.embed_generated_image(image, payload)
+        images.append(generation.GeneratedImage(image, f"generated-{idx}.png"))
+    return images
+
+
+def measure(payloads, prepare, latency):
+    """Prepare images as at generation time, then time saving them"""
+    with tempfile.TemporaryDirectory() as root:
+        use_temp_storage(root)
+        utils.bedrock_runtime = FakeBedrockRuntime(latency=latency)
+        start = time.perf_counter()
+        images = prepare(payloads)
+        generate_seconds = time.perf_counter() - start
+        calls = utils.bedrock_runtime.calls
+        tracemalloc.start()
+        start = time.perf_counter()
+        utils.add_images_to_library(images)
+        save_seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            "generate_s": generate_seconds,
+            "save_s": save_seconds,
+            "save_peak_mb": peak / 2**20,
+            "save_calls": utils.bedrock_runtime.calls - calls,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--image-edge", type=int, default=1024)
+    parser.add_argument(
+        "--latency", type=float, default=0.3, help="fake embedding latency in seconds"
+    )
+    args = parser.parse_args()
+
+    payloads = [
+        base64.b64encode(image.getvalue()).decode("ascii")
+        for image in make_images(args.images, args.image_edge)
+    ]
+    print(
+        f"{'path':>8} {'prepare s':>10} {'save s':>8} "
+        f"{'save peak MB':>13} {'save calls':>11}"
+    )
+    for name, prepare in [("legacy", legacy_generated), ("direct", direct_generated)]:
+        stats = measure(payloads, prepare, args.latency)
+        print(
+            f"{name:>8} {stats['generate_s']:>10.2f} {stats['save_s']:>8.2f} "
+            f"{stats['save_peak_mb']:>13.1f} {stats['save_calls']:>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark image ingestion against a local fake bedrock
+
+Run from the image-reader directory: python -m benchmarks.ingest_benchmark
+"""
+
+import io
+import time
+import argparse
+import tempfile
+
+from PIL import Image
+
+from lib import constants
+from lib import utils
+from lib.fake_bedrock import FakeBedrockRuntime
+
+
+class NamedBytesIO(io.BytesIO):
+    """In-memory image with a name like streamlit UploadedFile"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def use_temp_storage(root):
+    """Point the storage constants to a temporary location"""
+    constants.DATA_LOCATION = root
+    constants.VECTOR_LOCATION = f"{root}/vector"
+    constants.FILE_LOCATION = f"{root}/file"
+    constants.THUMBNAIL_LOCATION = f"{root}/thumbnail"
+    constants.LIBRARY_INDEX_PATH = f"{root}/library.sqlite"
+    constants.ACTIVE_COLLECTIONS_PATH = f"{root}/active_collections.json"
+    constants.KEYWORD_INDEX_PATH = f"{root}/keywords.sqlite"
+    constants.CAPTION_RESULTS_PATH = f"{root}/captions.sqlite"
+    constants.NAMESPACE_LOCATION = f"{root}/namespace"
+    constants.TEMP_LOCATION = f"{root}/temp"
+    constants.CACHE_LOCATION = f"{root}/cache"
+    constants.EMBEDDING_CACHE_PATH = f"{root}/cache/embeddings.sqlite"
+    constants.RESPONSE_CACHE_PATH = f"{root}/cache/responses.sqlite"
+    constants.PROMPT_CACHE_LOCATION = f"{root}/cache/prompt_library"
+    constants.GENERATION_CACHE_LOCATION = f"{root}/cache/generation"
+    constants.METRICS_LOCATION = f"{root}/metrics"
+    constants.STREAM_METRICS_LOG_PATH = f"{root}/metrics/stream.jsonl"
+    constants.METRICS_DUMP_PATH = f"{root}/metrics/metrics.json"
+    utils.setup_storage()
+
+
+def make_images(count, edge):
+    """Make distinct noise images encoded as PNG"""
+    base = Image.effect_noise((edge, edge), 64).convert("RGB")
+    images = []
+    for i in range(count):
+        image = base.copy()
+        image.putpixel((0, 0), (i % 256, i // 256 % 256, i // 65536 % 256))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        images.append(NamedBytesIO(buffer.getvalue(), f"bench-{i}.png"))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--image-edge", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--max-tps", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    images = make_images(args.images, args.image_edge)
+    print(f"{'concurrency':>12} {'seconds':>10} {'images/sec':>12} {'throttled':>10}")
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory() as root:
+            use_temp_storage(root)
+            fake = FakeBedrockRuntime(latency=args.latency, max_tps=args.max_tps)
+            utils.bedrock_runtime = fake
+            start = time.perf_counter()
+            utils.add_images_to_library(images, max_in_flight=concurrency)
+            elapsed = time.perf_counter() - start
+        print(
+            f"{concurrency:>12} {elapsed:>10.2f} {args.images / elapsed:>12.1f} {fake.throttled:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark Claude 3 message building against the former Jinja templates
+
+Run from the image-reader directory: python -m benchmarks.message_benchmark
+"""
+
+import os
+import time
+import base64
+import argparse
+import tracemalloc
+
+import streamlit as st
+from jinja2.nativetypes import NativeEnvironment
+
+from lib import message_builder
+
+
+@st.cache_data(show_spinner=False)
+def jinja_format_content_for_claude3(base64_encoded_images, query):
+    """Former implementation, rendering every image through a Jinja template"""
+    content = []
+    template_image_id = '{"type": "text", "text": "Image {{image_id}}:"}'
+    template_image = '{"type": "image", "source": {"type": "base64","media_type": "image/jpeg","data": "{{image}}"} }'
+    if base64_encoded_images:
+        for idx, image in enumerate(base64_encoded_images):
+            if len(base64_encoded_images) > 1:
+                image_id = (
+                    NativeEnvironment()
+                    .from_string(template_image_id)
+                    .render(image_id=idx + 1)
+                )
+                content.append(image_id)
+            image_content = (
+                NativeEnvironment().from_string(template_image).render(image=image)
+            )
+            content.append(image_content)
+    content.append({"type": "text", "text": query})
+    return content
+
+
+def jinja_build(images):
+    """Encode images to base64 then build content with Jinja"""
+    encoded = [base64.b64encode(image).decode("utf-8") for image in images]
+    return jinja_format_content_for_claude3(encoded, "What are in the pictures?")
+
+
+def direct_build(images):
+    """Build content directly from raw bytes"""
+    return message_builder.build_content(images, "What are in the pictures?")
+
+
+def measure(func, images):
+    """Get CPU seconds and peak python memory in MB"""
+    tracemalloc.start()
+    start = time.process_time()
+    func(images)
+    cpu = time.process_time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return cpu, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--image-mb", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{'images':>8} {'builder':>8} {'cpu s':>8} {'peak MB':>9}")
+    for count in args.counts:
+        images = [os.urandom(int(args.image_mb * 1024 * 1024)) for _ in range(count)]
+        for name, func in (("jinja", jinja_build), ("direct", direct_build)):
+            cpu, peak = measure(func, images)
+            print(f"{count:>8} {name:>8} {cpu:>8.3f} {peak:>9.1f}")
+        jinja_format_content_for_claude3.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Benchmark search latency and memory by result projection and library size
+
+Run from the image-reader directory: python -m benchmarks.search_benchmark
+"""
+
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+from lib import constants
+from lib import utils
+from lib import vector_store
+from benchmarks.ingest_benchmark import use_temp_storage
+
+PROJECTIONS = {
+    "full": ["embeddings", "metadatas", "distances"],
+    "lean": constants.SEARCH_INCLUDE,
+}
+
+
+def random_vector(rng, length):
+    """Make a random unit vector"""
+    vector = [rng.gauss(0, 1) for _ in range(length)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector]
+
+
+def populate(size, length, rng, batch_size=5000):
+    """Fill the collection with random vectors"""
+    for start in range(0, size, batch_size):
+        ids = [f"image-{i}.png" for i in range(start, min(start + batch_size, size))]
+        vector_store.upsert(
+            ids=ids,
+            embeddings=[random_vector(rng, length) for _ in ids],
+            metadatas=[
+                {"image_id": image_id, "file_path": f"{constants.FILE_LOCATION}/{image_id}"}
+                for image_id in ids
+            ],
+        )
+
+
+def measure(func, repeat):
+    """Get median latency in ms and peak python memory in KB"""
+    latencies = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return sorted(latencies)[len(latencies) // 2], peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--n-results", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    length = constants.OUTPUT_EMBEDDING_LENGTH
+    print(
+        f"{'size':>8} {'n_results':>10} {'mode':>10} {'p50 ms':>10} {'peak KB':>10}"
+    )
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as root:
+            use_temp_storage(root)
+            populate(size, length, rng)
+            query_embedding = random_vector(rng, length)
+            for n_results in args.n_results:
+                for mode, include in PROJECTIONS.items():
+                    latency, peak = measure(
+                        lambda: utils.find_similar_image(
+                            query_embeddings=[query_embedding],
+                            n_results=n_results,
+                            include=include,
+                        ),
+                        args.repeat,
+                    )
+                    print(
+                        f"{size:>8} {n_results:>10} {mode:>10} {latency:>10.2f} {peak:>10.0f}"
+                    )
+            vector_store.reset()
+
+
+if __name__ == "__main__":
+    main()
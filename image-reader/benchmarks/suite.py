@@ -0,0 +1,216 @@
+"""Benchmark the app hot paths against a local fake bedrock
+
+Run from the image-reader directory: python -m benchmarks.suite --save baseline.json
+then python -m benchmarks.suite --baseline baseline.json to fail on regressions.
+Measures ingestion, search, response streaming and image generation at
+every library size, with throughput, latency percentiles and peak RSS.
+"""
+
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+
+from lib import constants
+from lib import generation
+from lib import message_builder
+from lib import utils
+from lib import vector_store
+from lib.fake_bedrock import FakeBedrockRuntime
+from benchmarks.ingest_benchmark import make_images, use_temp_storage
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of this process, where Linux allows it"""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """Get the peak resident memory of this process since the last reset"""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(operation, count):
+    """Run operation(i) count times, return throughput, latency percentiles and peak RSS"""
+    reset_peak_rss()
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        operation_start = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - operation_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "ops": count,
+        "ops_per_sec": count / elapsed,
+        "p50_ms": vector_store.percentile(latencies, 50) * 1000,
+        "p99_ms": vector_store.percentile(latencies, 99) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_ingest(images, args):
+    """Add every image to the library in one call, latency is per upsert batch"""
+    vector_store.latency = vector_store.LatencyTracker()
+    stats = measure(
+        lambda _: utils.add_images_to_library(images, max_in_flight=args.concurrency), 1
+    )
+    upserts = vector_store.latency.summary("upsert")
+    return stats | {
+        "ops": len(images),
+        "ops_per_sec": len(images) * stats["ops_per_sec"],
+        "p50_ms": upserts["p50"] * 1000,
+        "p99_ms": upserts["p99"] * 1000,
+    }
+
+
+def bench_search(args):
+    """Search the library with distinct text queries"""
+    return measure(
+        lambda i: utils.find_similar_image(
+            query_texts=[f"benchmark query {i}"], n_results=5
+        ),
+        args.queries,
+    )
+
+
+def bench_streaming(image, args):
+    """Read one image with a streamed response"""
+    records = []
+
+    def read(_):
+        encoded_images, media_types, image_summary = utils.prepare_images_for_claude3(
+            [image]
+        )
+        content = utils.format_content_for_claude3(encoded_images, "Describe", media_types)
+        body = message_builder.build_request_body("", content)
+        for _ in utils.stream_claude3_response(
+            constants.MODEL_IDS[0], body, image_summary, records.append
+        ):
+            pass
+
+    stats = measure(read, args.streams)
+    ttfts = sorted(record["time_to_first_token_ms"] for record in records)
+    stats["ttft_p50_ms"] = vector_store.percentile(ttfts, 50)
+    return stats
+
+
+def bench_generation(args):
+    """Generate a grid of distinct seeds, cold result cache"""
+    latencies = []
+
+    def generate(prompt, **params):
+        start = time.perf_counter()
+        images = utils.generate_images(prompt, **params)
+        latencies.append(time.perf_counter() - start)
+        return images
+
+    grid = generation.parameter_grid(seeds=range(args.generations))
+    stats = measure(
+        lambda _: list(generation.run_grid("benchmark", grid, generate)), 1
+    )
+    latencies.sort()
+    return stats | {
+        "ops": len(grid),
+        "ops_per_sec": len(grid) * stats["ops_per_sec"],
+        "p50_ms": vector_store.percentile(latencies, 50) * 1000,
+        "p99_ms": vector_store.percentile(latencies, 99) * 1000,
+    }
+
+
+def run(args):
+    """Run every phase at every library size"""
+    results = []
+    for size in args.sizes:
+        images = make_images(size, args.image_edge)
+        with tempfile.TemporaryDirectory() as root:
+            use_temp_storage(root)
+            utils.bedrock_runtime = FakeBedrockRuntime(
+                latency=args.latency,
+                token_latency=args.token_latency,
+                output_tokens=args.output_tokens,
+            )
+            phases = [
+                ("ingest", lambda: bench_ingest(images, args)),
+                ("search", lambda: bench_search(args)),
+                ("streaming", lambda: bench_streaming(images[0], args)),
+                ("generation", lambda: bench_generation(args)),
+            ]
+            for phase, bench in phases:
+                results.append({"size": size, "phase": phase, **bench()})
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """Compare with baseline results, list throughput drops and p99 increases"""
+    previous = {(result["size"], result["phase"]): result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get((result["size"], result["phase"]))
+        if before is None:
+            continue
+        name = f"{result['phase']} at {result['size']}"
+        if result["ops_per_sec"] < before["ops_per_sec"] * (1 - tolerance):
+            found.append(
+                f"{name}: {before['ops_per_sec']:.1f} -> {result['ops_per_sec']:.1f} ops/sec"
+            )
+        if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            found.append(f"{name}: p99 {before['p99_ms']:.1f} -> {result['p99_ms']:.1f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--image-edge", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--streams", type=int, default=10)
+    parser.add_argument("--generations", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=constants.EMBED_MAX_IN_FLIGHT)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--token-latency", type=float, default=0.001)
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(args)
+    print(
+        f"{'size':>6} {'phase':>11} {'ops':>6} {'ops/sec':>9} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'peak MB':>8}"
+    )
+    for result in results:
+        print(
+            f"{result['size']:>6} {result['phase']:>11} {result['ops']:>6} "
+            f"{result['ops_per_sec']:>9.1f} {result['p50_ms']:>8.1f} "
+            f"{result['p99_ms']:>8.1f} {result['peak_rss_mb']:>8.0f}"
+        )
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Benchmark vector store backends on recall, latency, memory and startup time
+
+Run from the image-reader directory: python -m benchmarks.vector_store_benchmark
+Every backend is measured in a fresh process so startup time and RSS are comparable.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+BACKENDS = [
+    ("chroma", "float32"),
+    ("numpy", "float32"),
+    ("numpy", "float16"),
+    ("numpy", "int8"),
+]
+
+
+def make_vectors(size, queries, dimension, rng):
+    """Make clustered unit vectors and queries near random members"""
+    centers = rng.standard_normal((max(1, size // 100), dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size)]
+    vectors += 0.5 * rng.standard_normal((size, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picks = vectors[rng.integers(0, size, queries)]
+    picks = picks + 0.2 * rng.standard_normal(picks.shape).astype(np.float32)
+    picks /= np.linalg.norm(picks, axis=1, keepdims=True)
+    return vectors, picks
+
+
+def configure(root, backend, dtype):
+    """Point the constants to the benchmark store"""
+    from lib import constants
+
+    constants.VECTOR_LOCATION = os.path.join(root, backend, dtype)
+    constants.VECTOR_BACKEND = backend
+    constants.NUMPY_VECTOR_DTYPE = dtype
+
+
+def build(root, backend, dtype, vectors, batch_size=5000):
+    """Fill the backend with the vectors, return seconds taken"""
+    from lib import vector_store
+
+    configure(root, backend, dtype)
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), batch_size):
+        batch = vectors[offset : offset + batch_size]
+        ids = [f"image-{i}" for i in range(offset, offset + len(batch))]
+        vector_store.upsert(
+            ids=ids,
+            embeddings=batch.tolist(),
+            metadatas=[{"image_id": image_id, "file_path": image_id} for image_id in ids],
+        )
+    elapsed = time.perf_counter() - start
+    vector_store.reset()
+    return elapsed
+
+
+def peak_rss_mb():
+    """Get the peak resident memory of this process"""
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker(args):
+    """Open the backend in this process and measure it"""
+    start = time.perf_counter()
+    from lib import vector_store
+
+    configure(args.root, args.backend, args.dtype)
+    queries = np.load(os.path.join(args.root, "queries.npy"))
+    truth = np.load(os.path.join(args.root, "truth.npy"))
+    vector_store.query(queries[:1].tolist(), args.k, ["distances"])
+    startup = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = vector_store.query([query.tolist()], args.k, ["distances"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {int(image_id.split("-")[1]) for image_id in result["ids"][0]}
+        hits += len(found & set(expected.tolist()))
+    latencies.sort()
+    print(
+        json.dumps(
+            {
+                "startup_s": startup,
+                "p50_ms": latencies[len(latencies) // 2],
+                "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+                "recall": hits / truth.size,
+                "rss_mb": peak_rss_mb(),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--dtype", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args)
+        return
+
+    from lib import constants
+
+    constants.OUTPUT_EMBEDDING_LENGTH = args.dimension
+    rng = np.random.default_rng(0)
+    print(
+        f"{'size':>8} {'backend':>14} {'build s':>8} {'startup s':>10} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {f'recall@{args.k}':>10} {'RSS MB':>8}"
+    )
+    for size in args.sizes:
+        vectors, queries = make_vectors(size, args.queries, args.dimension, rng)
+        distances = (queries**2).sum(1)[:, None] + (vectors**2).sum(1) - 2 * queries @ vectors.T
+        truth = np.argsort(distances, axis=1)[:, : args.k]
+        with tempfile.TemporaryDirectory() as root:
+            np.save(os.path.join(root, "queries.npy"), queries)
+            np.save(os.path.join(root, "truth.npy"), truth)
+            for backend, dtype in BACKENDS:
+                build_seconds = build(root, backend, dtype, vectors)
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.vector_store_benchmark",
+                        "--worker",
+                        "--root",
+                        root,
+                        "--backend",
+                        backend,
+                        "--dtype",
+                        dtype,
+                        "--k",
+                        str(args.k),
+                    ],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                stats = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{size:>8} {f'{backend}/{dtype}':>14} {build_seconds:>8.1f} "
+                    f"{stats['startup_s']:>10.2f} {stats['p50_ms']:>8.2f} "
+                    f"{stats['p99_ms']:>8.2f} {stats['recall']:>10.3f} {stats['rss_mb']:>8.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Import a directory tree or a manifest of images into the library
+
+Run from the image-reader directory: python -m cli.bulk_import ~/Pictures
+Interrupted imports resume from the checkpoint journal when run again.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from lib import constants
+from lib import file_store
+from lib import namespaces
+from lib import utils
+from lib.fake_bedrock import FakeBedrockRuntime
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+class FileImage:
+    """Image file read on demand, with the interface of streamlit UploadedFile"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._data = None
+        self._content_id = None
+
+    def getvalue(self):
+        """Read the file once and keep the bytes until the image is released"""
+        if self._data is None:
+            with open(self.path, "rb") as f:
+                self._data = f.read()
+        return self._data
+
+    def getbuffer(self):
+        """Get the bytes as a memoryview"""
+        return memoryview(self.getvalue())
+
+    @property
+    def content_id(self):
+        """Hash and identify the image once, the library reuses the id"""
+        if self._content_id is None:
+            self._content_id = file_store.content_id(self.getvalue(), self.name)
+        return self._content_id
+
+
+def find_images(source):
+    """Yield image paths from a directory tree or a manifest file"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.abspath(os.path.join(root, name))
+    else:
+        with open(source, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield os.path.abspath(line.strip())
+
+
+def load_journal(path):
+    """Get the source paths already imported"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+class Progress:
+    """Print throughput and ETA on one line
+
+    Images already in the library are counted as duplicates, not imported.
+    """
+
+    def __init__(self, total, done):
+        self.total = total
+        self.done = done
+        self.imported = 0
+        self.duplicates = 0
+        self.start = time.monotonic()
+
+    def update(self, count, duplicates=False):
+        """Record imported or duplicate images and print the progress line"""
+        if duplicates:
+            self.duplicates += count
+        else:
+            self.imported += count
+        self.done += count
+        elapsed = time.monotonic() - self.start
+        processed = self.imported + self.duplicates
+        rate = processed / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        sys.stderr.write(
+            f"\r{self.done}/{self.total} images, {rate:.1f} images/sec, "
+            f"ETA {time.strftime('%H:%M:%S', time.gmtime(eta))}"
+        )
+        sys.stderr.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory to walk or file with one image path per line")
+    parser.add_argument(
+        "--journal",
+        help="checkpoint journal of imported source paths, bulk_import.journal "
+        "in the namespace directory by default",
+    )
+    parser.add_argument(
+        "--namespace",
+        default=constants.DEFAULT_NAMESPACE,
+        help="library namespace, created when missing",
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int, default=constants.EMBED_MAX_IN_FLIGHT
+    )
+    parser.add_argument("--batch-size", type=int, default=constants.UPSERT_BATCH_SIZE)
+    parser.add_argument(
+        "--caption",
+        action="store_true",
+        help="caption and tag every new image with claude 3 for hybrid search",
+    )
+    parser.add_argument(
+        "--fake-bedrock", action="store_true", help="use local fake bedrock"
+    )
+    parser.add_argument(
+        "--fake-latency", type=float, default=0.05, help="fake bedrock latency in seconds"
+    )
+    args = parser.parse_args()
+
+    if args.fake_bedrock:
+        utils.bedrock_runtime = FakeBedrockRuntime(latency=args.fake_latency)
+    utils.setup_storage(args.namespace)
+    journal_path = args.journal or os.path.join(
+        namespaces.get(args.namespace).root, "bulk_import.journal"
+    )
+    imported = load_journal(journal_path)
+    total = sum(1 for _ in find_images(args.source))
+    progress = Progress(total, len(imported))
+    in_flight = {}
+
+    def images():
+        for path in find_images(args.source):
+            if path in imported:
+                continue
+            image = FileImage(path)
+            in_flight.setdefault(image.content_id, []).append(path)
+            yield image
+
+    with open(journal_path, "a", encoding="utf-8") as journal:
+
+        def record(paths, duplicates=False):
+            for path in paths:
+                journal.write(f"{path}\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+            progress.update(len(paths), duplicates)
+
+        def on_batch(ids):
+            record([path for image_id in ids for path in in_flight.pop(image_id, [])])
+
+        def on_duplicate(image, image_id):
+            in_flight[image_id].remove(image.path)
+            record([image.path], duplicates=True)
+
+        utils.add_images_to_library(
+            images(),
+            max_in_flight=args.max_in_flight,
+            batch_size=args.batch_size,
+            on_batch=on_batch,
+            on_duplicate=on_duplicate,
+            describe=utils.generate_caption if args.caption else None,
+            namespace=args.namespace,
+        )
+    sys.stderr.write("\n")
+    print(
+        f"Imported {progress.imported} new images, skipped {progress.duplicates} "
+        f"already in library, {progress.done}/{total} done."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Caption, tag and transcribe every library image with Claude 3
+
+Run from the image-reader directory: python -m cli.caption_library --tpm 100000 --rpm 50
+Interrupted runs resume from the saved results when run again.
+"""
+
+import sys
+import json
+import argparse
+
+from lib import caption_job
+from lib import constants
+from lib import namespaces
+from lib import utils
+from lib.fake_bedrock import FakeBedrockRuntime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--model",
+        nargs="+",
+        choices=constants.MODEL_IDS,
+        default=[constants.CAPTION_MODEL_ID],
+        help="models to run one after another",
+    )
+    parser.add_argument(
+        "--images-per-request", type=int, default=constants.CAPTION_IMAGES_PER_REQUEST
+    )
+    parser.add_argument(
+        "--tpm",
+        type=int,
+        default=constants.CAPTION_TOKENS_PER_MINUTE,
+        help="tokens per minute budget, 0 for no limit",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        default=constants.CAPTION_REQUESTS_PER_MINUTE,
+        help="requests per minute budget, 0 for no limit",
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int, default=constants.CAPTION_MAX_IN_FLIGHT
+    )
+    parser.add_argument("--limit", type=int, help="caption at most this many images")
+    parser.add_argument(
+        "--recaption", action="store_true", help="caption images captioned before"
+    )
+    parser.add_argument(
+        "--namespace",
+        default=constants.DEFAULT_NAMESPACE,
+        help="library namespace, created when missing",
+    )
+    parser.add_argument(
+        "--fake-bedrock", action="store_true", help="use local fake bedrock"
+    )
+    parser.add_argument(
+        "--fake-latency", type=float, default=0.05, help="fake bedrock latency in seconds"
+    )
+    args = parser.parse_args()
+
+    if args.fake_bedrock:
+        utils.bedrock_runtime = FakeBedrockRuntime(latency=args.fake_latency)
+    utils.setup_storage(args.namespace)
+
+    def on_batch(report):
+        sys.stderr.write(
+            f"\r{report['model_id']}: {report['images'] + report['failed']}/"
+            f"{report['pending']} images, {report['failed']} failed, "
+            f"{report['images_per_minute']} images/min, ${report['cost_usd'] or 0:.4f}"
+        )
+        sys.stderr.flush()
+
+    reports = []
+    for model_id in args.model:
+        reports.append(
+            caption_job.caption_library(
+                model_id,
+                images_per_request=args.images_per_request,
+                tokens_per_minute=args.tpm or None,
+                requests_per_minute=args.rpm or None,
+                max_in_flight=args.max_in_flight,
+                limit=args.limit,
+                recaption=args.recaption,
+                on_batch=on_batch,
+                namespace=args.namespace,
+            )
+        )
+        sys.stderr.write("\n")
+    results = caption_job.get_results(
+        namespaces.get(args.namespace).caption_results_path
+    )
+    print(json.dumps({"runs": reports, "stored": results.summary()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Maintain the image library index
+
+Run from the image-reader directory: python -m cli.library_index reconcile
+Add --vectors to also embed files missing vectors and prune orphaned vectors.
+"""
+
+import json
+import argparse
+
+from lib import constants
+from lib import reconciler
+from lib import utils
+from lib.fake_bedrock import FakeBedrockRuntime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--namespace",
+        default=constants.DEFAULT_NAMESPACE,
+        help="library namespace, created when missing",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = subparsers.add_parser(
+        "reconcile", help="rebuild the index from the files on disk"
+    )
+    reconcile_parser.add_argument(
+        "--vectors",
+        action="store_true",
+        help="also embed files missing vectors and prune orphaned vectors",
+    )
+    reconcile_parser.add_argument(
+        "--dry-run", action="store_true", help="report vector changes without applying"
+    )
+    reconcile_parser.add_argument(
+        "--max-in-flight", type=int, default=constants.EMBED_MAX_IN_FLIGHT
+    )
+    reconcile_parser.add_argument(
+        "--fake-bedrock", action="store_true", help="use local fake bedrock"
+    )
+    list_parser = subparsers.add_parser("list", help="list indexed images")
+    list_parser.add_argument("--offset", type=int, default=0)
+    list_parser.add_argument("--limit", type=int, default=constants.LIBRARY_PAGE_SIZE)
+    list_parser.add_argument("--sort-by", default="name", choices=["name", "size", "mtime"])
+    list_parser.add_argument("--descending", action="store_true")
+    list_parser.add_argument("--filter", dest="name_filter")
+    args = parser.parse_args()
+
+    if getattr(args, "fake_bedrock", False):
+        utils.bedrock_runtime = FakeBedrockRuntime()
+    utils.setup_storage(args.namespace)
+    if args.command == "reconcile" and args.vectors:
+        report = reconciler.reconcile(
+            args.namespace, max_in_flight=args.max_in_flight, dry_run=args.dry_run
+        )
+        print(json.dumps(report, indent=2))
+    elif args.command == "reconcile":
+        print(json.dumps(utils.reconcile_library_index(args.namespace)))
+    elif args.command == "list":
+        for path in utils.get_images_in_library(
+            offset=args.offset,
+            limit=args.limit,
+            sort_by=args.sort_by,
+            descending=args.descending,
+            name_filter=args.name_filter,
+            namespace=args.namespace,
+        ):
+            print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Re-embed the image library with another embedding length
+
+Run from the image-reader directory: python -m cli.migrate_embeddings 384
+The app keeps searching the current collection until the new one is swapped in.
+"""
+
+import sys
+import json
+import argparse
+
+from lib import constants
+from lib import migration
+from lib import utils
+from lib.fake_bedrock import FakeBedrockRuntime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "embedding_length", type=int, choices=[256, 384, 1024], help="Titan output length"
+    )
+    parser.add_argument("--target", help="name of the new collection")
+    parser.add_argument(
+        "--max-in-flight", type=int, default=constants.EMBED_MAX_IN_FLIGHT
+    )
+    parser.add_argument(
+        "--drop-old", action="store_true", help="delete the old collection after the swap"
+    )
+    parser.add_argument(
+        "--namespace",
+        default=constants.DEFAULT_NAMESPACE,
+        help="library namespace, created when missing",
+    )
+    parser.add_argument(
+        "--fake-bedrock", action="store_true", help="use local fake bedrock"
+    )
+    args = parser.parse_args()
+
+    if args.fake_bedrock:
+        utils.bedrock_runtime = FakeBedrockRuntime()
+    utils.setup_storage(args.namespace)
+
+    def on_batch(ids):
+        sys.stderr.write(f"Migrated {len(ids)} images.\n")
+
+    report = migration.migrate_embeddings(
+        args.embedding_length,
+        target_name=args.target,
+        max_in_flight=args.max_in_flight,
+        drop_old=args.drop_old,
+        on_batch=on_batch,
+        namespace=args.namespace,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""Refresh the bundled Anthropic prompt library snapshot
+
+Run from the image-reader directory with network access: python -m cli.prompt_snapshot
+"""
+
+import argparse
+
+from lib import prompt_library
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+    snapshot = prompt_library.save_snapshot()
+    print(
+        f"Saved {len(snapshot['prompts'])} prompts to {prompt_library.SNAPSHOT_PATH}."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Search the image library with many text or image queries
+
+Run from the image-reader directory: python -m cli.search --text "a red car" --image photo.png
+"""
+
+import json
+import argparse
+
+from lib import constants
+from lib import utils
+from lib.fake_bedrock import FakeBedrockRuntime
+
+
+def load_queries(args):
+    """Collect (label, query) pairs from the arguments"""
+    queries = [(text, text) for text in args.text]
+    for path in args.image:
+        with open(path, "rb") as f:
+            queries.append((path, f.read()))
+    for path in args.queries_file:
+        with open(path, encoding="utf-8") as f:
+            queries.extend((line.strip(), line.strip()) for line in f if line.strip())
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--text", action="append", default=[], help="text query")
+    parser.add_argument("--image", action="append", default=[], help="image file query")
+    parser.add_argument(
+        "--queries-file",
+        action="append",
+        default=[],
+        help="file with one text query per line",
+    )
+    parser.add_argument("--n-results", type=int, default=constants.N_RESULTS)
+    parser.add_argument(
+        "--max-in-flight", type=int, default=constants.EMBED_MAX_IN_FLIGHT
+    )
+    parser.add_argument(
+        "--namespace",
+        action="append",
+        help="library namespace to search, repeat to search several and merge results",
+    )
+    parser.add_argument(
+        "--fake-bedrock", action="store_true", help="use local fake bedrock"
+    )
+    args = parser.parse_args()
+
+    if args.fake_bedrock:
+        utils.bedrock_runtime = FakeBedrockRuntime()
+    names = args.namespace or [constants.DEFAULT_NAMESPACE]
+    for name in names:
+        utils.setup_storage(name)
+    queries = load_queries(args)
+    if not queries:
+        parser.error("no queries given")
+    results = [[] for _ in queries]
+    for name in names:
+        found = utils.find_similar_images_batch(
+            [query for _, query in queries],
+            n_results=args.n_results,
+            max_in_flight=args.max_in_flight,
+            namespace=name,
+        )
+        for merged, found_images in zip(results, found):
+            merged.extend((*found_image, name) for found_image in found_images)
+    for (label, _), found_images in zip(queries, results):
+        found_images.sort(key=lambda found_image: found_image[2])
+        print(
+            json.dumps(
+                {
+                    "query": label,
+                    "results": [
+                        {
+                            "image_id": image_id,
+                            "file_path": file_path,
+                            "distance": distance,
+                            "namespace": name,
+                        }
+                        for image_id, file_path, distance, name in found_images[
+                            : args.n_results
+                        ]
+                    ],
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
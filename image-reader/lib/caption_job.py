@@ -0,0 +1,311 @@
+"""Caption and transcribe the image library offline with Claude 3"""
+
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lib import constants
+from lib import handles
+from lib import image_processing
+from lib import ingest
+from lib import message_builder
+from lib import metrics
+from lib import migration
+from lib import namespaces
+from lib import utils
+from lib import vector_store
+
+logger = logging.getLogger(__name__)
+
+
+class CaptionResults(handles.SQLiteHandle):
+    """SQLite store of caption results, one row per image and model"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(image_id TEXT NOT NULL, model_id TEXT NOT NULL, caption TEXT, tags TEXT, "
+            "text TEXT, input_tokens REAL, output_tokens REAL, created_at REAL, "
+            "PRIMARY KEY (image_id, model_id))"
+        )
+        self._connection.commit()
+
+    def done(self, model_id):
+        """Get ids of the images captioned by the model"""
+        with self._lock:
+            return {
+                image_id
+                for (image_id,) in self._connection.execute(
+                    "SELECT image_id FROM results WHERE model_id = ?", (model_id,)
+                )
+            }
+
+    def put(self, model_id, descriptions, input_tokens, output_tokens):
+        """Save {image_id: description} of one request, tokens are split evenly"""
+        share = len(descriptions) or 1
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO results (image_id, model_id, caption, tags, text, "
+                "input_tokens, output_tokens, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        image_id,
+                        model_id,
+                        description["caption"],
+                        json.dumps(description["tags"]),
+                        description["text"],
+                        input_tokens / share,
+                        output_tokens / share,
+                        time.time(),
+                    )
+                    for image_id, description in descriptions.items()
+                ],
+            )
+            self._connection.commit()
+
+    def summary(self):
+        """Get images, tokens and cost of the stored results per model"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT model_id, COUNT(*), SUM(input_tokens), SUM(output_tokens) "
+                "FROM results GROUP BY model_id ORDER BY model_id"
+            ).fetchall()
+        return [
+            {
+                "model_id": model_id,
+                "images": images,
+                "input_tokens": round(input_tokens),
+                "output_tokens": round(output_tokens),
+                "cost_usd": cost(model_id, input_tokens, output_tokens),
+            }
+            for model_id, images, input_tokens, output_tokens in rows
+        ]
+
+
+_results = handles.HandleCache("caption results")
+
+
+def get_results(path=None):
+    """Get the process wide caption results store of the path, closed when unused"""
+    path = path or constants.CAPTION_RESULTS_PATH
+    return _results.get(path, lambda: CaptionResults(path))
+
+
+def cost(model_id, input_tokens, output_tokens):
+    """Get the cost in USD of the tokens, None for models without a price"""
+    if model_id not in constants.MODEL_PRICES:
+        return None
+    input_price, output_price = constants.MODEL_PRICES[model_id]
+    return round((input_tokens * input_price + output_tokens * output_price) / 1000, 6)
+
+
+def parse_descriptions(text, count):
+    """Get a {"caption", "tags", "text"} per image from a JSON array reply
+
+    Images the reply misses, or every image of a reply that is not valid
+    JSON, are None.
+    """
+    try:
+        reply = json.loads(text[text.index("[") : text.rindex("]") + 1])
+    except ValueError:
+        if count != 1:
+            return [None] * count
+        reply = [utils.parse_caption(text)]
+    if isinstance(reply, dict):
+        reply = [reply]
+    descriptions = [None] * count
+    for position, item in enumerate(reply):
+        if not isinstance(item, dict):
+            continue
+        try:
+            idx = int(item.get("image", position + 1)) - 1
+        except (TypeError, ValueError):
+            idx = position
+        if 0 <= idx < count and item.get("caption"):
+            descriptions[idx] = {
+                "caption": str(item["caption"]).strip(),
+                "tags": [str(tag).strip() for tag in item.get("tags", []) if tag],
+                "text": str(item.get("text") or "").strip(),
+            }
+    return descriptions
+
+
+def build_request(batch):
+    """Read and downscale the images of a batch once
+
+    Returns (image ids, request body, estimated tokens) of the readable images.
+    """
+    image_ids = []
+    images = []
+    media_types = []
+    image_tokens = 0
+    for image_id, file_path in batch:
+        try:
+            with open(file_path, "rb") as f:
+                image_bytes, media_type, stats = image_processing.prepare_image_for_claude(
+                    f.read()
+                )
+        except Exception as err:
+            logger.warning(f"Skip {image_id}, failed to read image: {err}")
+            continue
+        image_ids.append(image_id)
+        images.append(image_bytes)
+        media_types.append(media_type)
+        image_tokens += stats["tokens"]
+    content = utils.format_content_for_claude3(
+        images, constants.CAPTION_BATCH_PROMPT, media_types
+    )
+    body = json.loads(message_builder.build_request_body("", content))
+    body["max_tokens"] = constants.CAPTION_BATCH_MAX_TOKENS
+    estimate = (
+        image_tokens
+        + len(constants.CAPTION_BATCH_PROMPT) // 4
+        + constants.CAPTION_BATCH_MAX_TOKENS
+    )
+    return image_ids, json.dumps(body), estimate
+
+
+def caption_batch(model_id, batch, budget, limiter, namespace):
+    """Caption the images of one request and save the results
+
+    Returns (captioned count, failed count, input tokens, output tokens).
+    """
+    image_ids, body, estimate = build_request(batch)
+    failed = len(batch) - len(image_ids)
+    if not image_ids:
+        return 0, failed, 0, 0
+
+    def send():
+        ticket = budget.acquire(estimate)
+        message = utils.invoke_claude3(model_id, body)
+        usage = message["usage"]
+        budget.settle(ticket, usage["input_tokens"] + usage["output_tokens"])
+        return message
+
+    message = ingest.call_with_backoff(send, limiter)
+    utils.count_message_tokens(model_id, message)
+    text = "".join(
+        block.get("text", "") for block in message["content"] if block["type"] == "text"
+    )
+    descriptions = {
+        image_id: description
+        for image_id, description in zip(
+            image_ids, parse_descriptions(text, len(image_ids))
+        )
+        if description is not None
+    }
+    failed += len(image_ids) - len(descriptions)
+    if descriptions:
+        get_results(namespace.caption_results_path).put(
+            model_id,
+            descriptions,
+            message["usage"]["input_tokens"],
+            message["usage"]["output_tokens"],
+        )
+        utils.store_descriptions(descriptions, namespace)
+        metrics.count("captioned_images", len(descriptions), model_id=model_id)
+    return (
+        len(descriptions),
+        failed,
+        message["usage"]["input_tokens"],
+        message["usage"]["output_tokens"],
+    )
+
+
+def caption_library(
+    model_id=None,
+    images_per_request=constants.CAPTION_IMAGES_PER_REQUEST,
+    tokens_per_minute=constants.CAPTION_TOKENS_PER_MINUTE,
+    requests_per_minute=constants.CAPTION_REQUESTS_PER_MINUTE,
+    max_in_flight=constants.CAPTION_MAX_IN_FLIGHT,
+    limit=None,
+    recaption=False,
+    on_batch=None,
+    namespace=None,
+):
+    """Caption library images the model has not captioned yet, return the run report
+
+    Several images are packed in each request and requests are held within
+    the tokens and requests per minute budgets. Results are saved after every
+    request, so an interrupted run resumes where it stopped. on_batch is
+    called with the report after every request.
+    """
+    model_id = model_id or constants.CAPTION_MODEL_ID
+    namespace = namespaces.get(namespace)
+    results = get_results(namespace.caption_results_path)
+    done = set() if recaption else results.done(model_id)
+    store = vector_store.collection_store(namespace.collection)
+    items = [
+        (image_id, metadata["file_path"])
+        for image_id, metadata in migration.list_items(store).items()
+        if image_id not in done
+    ]
+    items = items[:limit] if limit is not None else items
+    batches = [
+        items[start : start + images_per_request]
+        for start in range(0, len(items), images_per_request)
+    ]
+    logger.info(
+        f"Captioning {len(items)} images in {len(batches)} requests with {model_id}, "
+        f"{len(done)} are done."
+    )
+    budget = ingest.RateBudget(tokens_per_minute, requests_per_minute)
+    limiter = ingest.AdaptiveLimiter(max_in_flight)
+    report = {
+        "model_id": model_id,
+        "pending": len(items),
+        "requests": 0,
+        "images": 0,
+        "failed": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+    }
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=limiter.max_in_flight) as executor:
+        futures = {
+            executor.submit(
+                caption_batch, model_id, batch, budget, limiter, namespace
+            ): batch
+            for batch in batches
+        }
+        try:
+            for future in as_completed(futures):
+                try:
+                    captioned, failed, input_tokens, output_tokens = future.result()
+                except Exception as err:
+                    failed = len(futures[future])
+                    logger.warning(f"Failed to caption {failed} images: {err}")
+                    captioned, input_tokens, output_tokens = 0, 0, 0
+                else:
+                    report["requests"] += 1
+                report["images"] += captioned
+                report["failed"] += failed
+                report["input_tokens"] += input_tokens
+                report["output_tokens"] += output_tokens
+                finish_report(report, time.perf_counter() - start)
+                if on_batch is not None:
+                    on_batch(report)
+        except BaseException:
+            # Stop queued requests on interruption, saved results are kept
+            for future in futures:
+                future.cancel()
+            raise
+    return finish_report(report, time.perf_counter() - start)
+
+
+def finish_report(report, elapsed):
+    """Add elapsed time, throughput and cost to the run report"""
+    minutes = elapsed / 60 or 1
+    report["elapsed_seconds"] = round(elapsed, 1)
+    report["images_per_minute"] = round(report["images"] / minutes, 1)
+    report["tokens_per_minute"] = round(
+        (report["input_tokens"] + report["output_tokens"]) / minutes
+    )
+    report["cost_usd"] = cost(
+        report["model_id"], report["input_tokens"], report["output_tokens"]
+    )
+    return report
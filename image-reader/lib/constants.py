@@ -1,3 +1,5 @@
+import os
+
 # Region setting
 BEDROCK_REGION = "us-west-2"
 BOTO_CONFIG = {"max_attempts": 3, "mode": "standard"}
@@ -13,11 +15,38 @@ MAX_TOKENS = 2000
 TEMPERATURE = 0
 DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant with perfect vision and pay great attention to detail which makes you an expert at reading objects in images."
 DEFAULT_PROMPT = "What are in the picture?"
+STREAM_FLUSH_INTERVAL = 0.1
+STREAM_FLUSH_CHARS = 400
+CLAUDE_IMAGE_MAX_EDGE = 1568
+CLAUDE_IMAGE_MAX_PIXELS = 1150000
+CLAUDE_IMAGE_QUALITY = 85
+CLAUDE_IMAGE_REENCODE_MIN_BYTES = 256 * 1024
+
+# Prompt library setting
+PROMPT_LIBRARY_OFFLINE = False
+PROMPT_CACHE_TTL = 24 * 60 * 60
+PROMPT_RETRY_INTERVAL = 5 * 60
 
 # Titan multimodal embed setting
 MM_EMBED_MODEL = "amazon.titan-embed-image-v1"
 OUTPUT_EMBEDDING_LENGTH = 1024
 
+# Ingestion setting
+EMBED_MAX_IN_FLIGHT = 8
+UPSERT_BATCH_SIZE = 64
+THROTTLE_MAX_RETRIES = 8
+THROTTLE_BACKOFF_BASE = 0.5
+THROTTLE_BACKOFF_MAX = 20.0
+
+# Embedding cache setting, the last use of a hit is only written when the
+# recorded one is older than EMBEDDING_CACHE_TOUCH_INTERVAL seconds
+EMBEDDING_CACHE_MAX_ENTRIES = 100000
+EMBEDDING_CACHE_TOUCH_INTERVAL = 60 * 60
+
+# Claude 3 response cache setting, responses are reused only when TEMPERATURE is 0
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
 # Titan image generator setting
 IMAGE_GENERATOR_MODEL = "amazon.titan-image-generator-v1"
 NUMBER_OF_IMAGES = 1
@@ -27,6 +56,10 @@ HEIGHT = 512
 WIDTH = 512
 SEED = 0
 IMAGE_NUMBERS = [1, 2, 3, 4, 5]
+GENERATION_MAX_IN_FLIGHT = 4
+GENERATION_MAX_GRID = 12
+GENERATION_CACHE_TTL = 30 * 24 * 60 * 60
+GENERATION_CACHE_MAX_BYTES = 512 * 1024 * 1024
 IMAGE_SIZE = [
     (1024, 1024),
     (768, 768),
@@ -55,12 +88,104 @@ IMAGE_SIZE = [
     (1173, 640),
 ]
 
+# Vector store setting, backend is chroma or numpy
+VECTOR_BACKEND = "chroma"
+NUMPY_VECTOR_DTYPE = "float32"
+NUMPY_VECTOR_METRIC = "l2"
+NUMPY_INITIAL_CAPACITY = 1024
+NUMPY_QUERY_CHUNK = 8192
+
 # Chroma setting
 COLLECTION_NAME = "image_library"
 N_RESULTS = 1
+MAX_N_RESULTS = 50
+SEARCH_INCLUDE = ["metadatas", "distances"]
+LATENCY_WINDOW = 1000
+LATENCY_LOG_INTERVAL = 50
+
+# Namespace setting, every namespace has its own collection, files and indexes.
+# Up to HANDLES_MAX_OPEN vector store, library index and keyword index handles
+# of each kind stay open, handles idle for HANDLES_IDLE_SECONDS are closed.
+# Closing a chroma handle frees nothing, collections live in the shared chroma
+# client, which keeps at most CHROMA_MEMORY_LIMIT_BYTES of them in memory, 0
+# for no limit. The ECS task sets the limit from its memory size, keep it well
+# below the task memory
+DEFAULT_NAMESPACE = "default"
+HANDLES_MAX_OPEN = 8
+HANDLES_IDLE_SECONDS = 30 * 60
+CHROMA_MEMORY_LIMIT_BYTES = int(
+    os.environ.get("CHROMA_MEMORY_LIMIT_BYTES", 256 * 1024 * 1024)
+)
+
+# Hybrid search setting, caption and tag keywords are ranked with BM25 and
+# fused with vector ranks over the top HYBRID_CANDIDATES of each
+HYBRID_CANDIDATES = 50
+RRF_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+CAPTION_MODEL_ID = MODEL_IDS[0]
+CAPTION_MAX_TOKENS = 300
+CAPTION_PROMPT = 'Describe the picture in one or two sentences and list up to 10 short tags. Reply with JSON only, like {"caption": "...", "tags": ["..."]}.'
+
+# Batch captioning setting, budgets are per minute and None for no limit
+CAPTION_IMAGES_PER_REQUEST = 4
+CAPTION_BATCH_MAX_TOKENS = 2000
+CAPTION_TOKENS_PER_MINUTE = 100000
+CAPTION_REQUESTS_PER_MINUTE = 50
+CAPTION_MAX_IN_FLIGHT = 4
+CAPTION_BATCH_PROMPT = 'For every image, write a one or two sentence caption, up to 10 short tags and any text in it word for word. Reply with a JSON array only, one object per image in order, like [{"image": 1, "caption": "...", "tags": ["..."], "text": "..."}].'
+
+# Model pricing in USD per 1000 input and output tokens, check Bedrock pricing of your region
+MODEL_PRICES = {
+    "anthropic.claude-3-haiku-20240307-v1:0": (0.00025, 0.00125),
+    "anthropic.claude-3-sonnet-20240229-v1:0": (0.003, 0.015),
+    "anthropic.claude-3-opus-20240229-v1:0": (0.015, 0.075),
+}
+
+# Metrics setting, set METRICS_PORT to None to disable the endpoint. The stream
+# metrics log is rotated to one previous file once it reaches the size limit
+METRICS_PREFIX = "image_reader"
+METRICS_PORT = 8502
+METRICS_DUMP_INTERVAL = 60
+STREAM_METRICS_LOG_MAX_BYTES = 4 * 1024 * 1024
+
+# Image library setting
+LIBRARY_PAGE_SIZE = 24
+LIBRARY_SORT_OPTIONS = {
+    "Name": ("name", False),
+    "Newest": ("mtime", True),
+    "Oldest": ("mtime", False),
+    "Largest": ("size", True),
+}
+
+# Library reconciliation setting, set RECONCILE_INTERVAL to 0 to disable the
+# background run, files younger than the grace period may still be ingesting
+RECONCILE_INTERVAL = 15 * 60
+RECONCILE_GRACE_SECONDS = 10 * 60
+
+# File storage setting, files are sharded by the first characters of their hash
+FILE_SHARD_WIDTH = 2
+
+# Thumbnail setting
+THUMBNAIL_SIZE = (256, 256)
+THUMBNAIL_QUALITY = 80
 
 # Persistent storage setting
 DATA_LOCATION = "./data"
 VECTOR_LOCATION = f"{DATA_LOCATION}/vector"
 FILE_LOCATION = f"{DATA_LOCATION}/file"
+THUMBNAIL_LOCATION = f"{DATA_LOCATION}/thumbnail"
+LIBRARY_INDEX_PATH = f"{DATA_LOCATION}/library.sqlite"
+ACTIVE_COLLECTIONS_PATH = f"{DATA_LOCATION}/active_collections.json"
+KEYWORD_INDEX_PATH = f"{DATA_LOCATION}/keywords.sqlite"
+CAPTION_RESULTS_PATH = f"{DATA_LOCATION}/captions.sqlite"
+NAMESPACE_LOCATION = f"{DATA_LOCATION}/namespace"
 TEMP_LOCATION = f"{DATA_LOCATION}/temp"
+CACHE_LOCATION = f"{DATA_LOCATION}/cache"
+EMBEDDING_CACHE_PATH = f"{CACHE_LOCATION}/embeddings.sqlite"
+RESPONSE_CACHE_PATH = f"{CACHE_LOCATION}/responses.sqlite"
+PROMPT_CACHE_LOCATION = f"{CACHE_LOCATION}/prompt_library"
+GENERATION_CACHE_LOCATION = f"{CACHE_LOCATION}/generation"
+METRICS_LOCATION = f"{DATA_LOCATION}/metrics"
+STREAM_METRICS_LOG_PATH = f"{METRICS_LOCATION}/stream.jsonl"
+METRICS_DUMP_PATH = f"{METRICS_LOCATION}/metrics.json"
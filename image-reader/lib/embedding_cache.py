@@ -0,0 +1,124 @@
+"""Persistent LRU cache of embeddings keyed by content hash"""
+
+import time
+import array
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from lib import constants
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(kind, content, embedding_length=None):
+    """Build cache key from content hash and embedding settings"""
+    digest = hashlib.sha256(content).hexdigest()
+    embedding_length = embedding_length or constants.OUTPUT_EMBEDDING_LENGTH
+    return f"{constants.MM_EMBED_MODEL}:{embedding_length}:{kind}:{digest}"
+
+
+def image_key(image_bytes, embedding_length=None):
+    """Build cache key for raw image bytes"""
+    return content_key("image", image_bytes, embedding_length)
+
+
+def text_key(text, embedding_length=None):
+    """Build cache key for text input"""
+    return content_key("text", text.encode("utf-8"), embedding_length)
+
+
+class EmbeddingCache:
+    """SQLite backed embedding cache with least recently used eviction
+
+    Hits only write their last use when the recorded one is older than
+    touch_interval, so repeated searches read without taking the write lock.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_entries=constants.EMBEDDING_CACHE_MAX_ENTRIES,
+        touch_interval=constants.EMBEDDING_CACHE_TOUCH_INTERVAL,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._connection.commit()
+
+    def get(self, key):
+        """Get embedding by key, None if it is not cached"""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT embedding, last_used FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if now - row[1] > self.touch_interval:
+                self._connection.execute(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", (now, key)
+                )
+                self._connection.commit()
+        return array.array("f", row[0]).tolist()
+
+    def put(self, key, embedding):
+        """Store embedding and evict the least recently used entries over the limit"""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                (key, array.array("f", embedding).tobytes(), time.time()),
+            )
+            size = self._connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+            if size > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (size - self.max_entries,),
+                )
+                logger.info(f"Evicted {size - self.max_entries} cached embeddings.")
+            self._connection.commit()
+
+    def stats(self):
+        """Get cache hit and miss counters"""
+        with self._lock:
+            size = self._connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": size,
+            "max_entries": self.max_entries,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Get the process wide embedding cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.path != constants.EMBEDDING_CACHE_PATH:
+            _cache = EmbeddingCache(constants.EMBEDDING_CACHE_PATH)
+        return _cache
@@ -0,0 +1,204 @@
+"""Local stand-in for the bedrock runtime client"""
+
+import io
+import json
+import base64
+import time
+import random
+import hashlib
+import threading
+
+from PIL import Image
+from botocore.exceptions import ClientError
+
+from lib import constants
+
+
+class FakeBedrockRuntime:
+    """Mimic the bedrock runtime calls used by the app without network access
+
+    latency is the delay before a response or the first streamed chunk,
+    token_latency the delay between streamed tokens and output_tokens the
+    length of streamed responses.
+    """
+
+    def __init__(
+        self, latency=0.05, max_tps=None, token_latency=0.0, output_tokens=200
+    ):
+        self.latency = latency
+        self.max_tps = max_tps
+        self.token_latency = token_latency
+        self.output_tokens = output_tokens
+        self.calls = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_calls = 0
+
+    def _check_quota(self, operation):
+        """Raise throttling error when the calls per second quota is exceeded"""
+        with self._lock:
+            self.calls += 1
+            if self.max_tps is None:
+                return
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_calls = 0
+            self._window_calls += 1
+            if self._window_calls > self.max_tps:
+                self.throttled += 1
+                raise ClientError(
+                    {
+                        "Error": {
+                            "Code": "ThrottlingException",
+                            "Message": "Too many requests, please wait before trying again.",
+                        }
+                    },
+                    operation,
+                )
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None):
+        """Return a deterministic embedding, Titan images or Claude message for the input"""
+        self._check_quota("InvokeModel")
+        time.sleep(self.latency)
+        request = json.loads(body)
+        if modelId == constants.IMAGE_GENERATOR_MODEL:
+            response = {"images": fake_images(request)}
+        elif modelId.startswith("anthropic."):
+            response = fake_message(modelId, request, len(body) // 4)
+        else:
+            length = request.get("embeddingConfig", {}).get(
+                "outputEmbeddingLength", constants.OUTPUT_EMBEDDING_LENGTH
+            )
+            seed = hashlib.sha256(
+                (request.get("inputImage", "") + request.get("inputText", "")).encode()
+            ).digest()
+            response = {"embedding": fake_embedding(seed, length)}
+        return {"body": io.BytesIO(json.dumps(response).encode())}
+
+    def invoke_model_with_response_stream(
+        self, body, modelId, accept=None, contentType=None
+    ):
+        """Return Claude 3 style chunk events, streamed with the configured latency"""
+        self._check_quota("InvokeModelWithResponseStream")
+        request = json.loads(body)
+        return {"body": self._stream(modelId, len(body) // 4, request["max_tokens"])}
+
+    def _stream(self, model_id, input_tokens, max_tokens):
+        """Yield chunk events of one response"""
+        start = time.perf_counter()
+        time.sleep(self.latency)
+        first_byte = time.perf_counter()
+        output_tokens = min(self.output_tokens, max_tokens)
+        yield chunk_event(
+            {
+                "type": "message_start",
+                "message": {"model": model_id, "role": "assistant", "content": []},
+            }
+        )
+        yield chunk_event({"type": "content_block_start", "index": 0})
+        for idx in range(output_tokens):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            text = f"token{idx}" + ("\n\n" if idx % 50 == 49 else " ")
+            yield chunk_event(
+                {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": "text_delta", "text": text},
+                }
+            )
+        yield chunk_event({"type": "content_block_stop", "index": 0})
+        yield chunk_event(
+            {"type": "message_delta", "delta": {"stop_reason": "end_turn"}}
+        )
+        end = time.perf_counter()
+        yield chunk_event(
+            {
+                "type": "message_stop",
+                "amazon-bedrock-invocationMetrics": {
+                    "inputTokenCount": input_tokens,
+                    "outputTokenCount": output_tokens,
+                    "invocationLatency": round((end - start) * 1000),
+                    "firstByteLatency": round((first_byte - start) * 1000),
+                },
+            }
+        )
+
+
+def chunk_event(data):
+    """Wrap data as a response stream chunk event"""
+    return {"chunk": {"bytes": json.dumps(data).encode()}}
+
+
+def fake_images(request):
+    """Generate deterministic base64 PNG images for a Titan image request"""
+    config = request.get("imageGenerationConfig", {})
+    width = config.get("width", constants.WIDTH)
+    height = config.get("height", constants.HEIGHT)
+    images = []
+    for idx in range(config.get("numberOfImages", constants.NUMBER_OF_IMAGES)):
+        seed = hashlib.sha256(
+            json.dumps([request.get("textToImageParams"), config, idx]).encode()
+        ).digest()
+        rng = random.Random(seed)
+        tile = Image.frombytes(
+            "RGB", (width // 8, height // 8), rng.randbytes(width // 8 * height // 8 * 3)
+        )
+        buffer = io.BytesIO()
+        tile.resize((width, height), Image.NEAREST).save(buffer, format="PNG")
+        images.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+    return images
+
+
+FAKE_TAGS = (
+    "cat dog bird car bicycle tree flower beach mountain city street house "
+    "kitchen food coffee book laptop phone sign chart diagram receipt person "
+    "child sunset snow river boat train bridge"
+).split()
+
+
+def fake_description(seed):
+    """Pick a caption and tags by the seed"""
+    tags = random.Random(seed).sample(FAKE_TAGS, 4)
+    return {"caption": f"A {tags[0]} next to a {tags[1]} near a {tags[2]}.", "tags": tags}
+
+
+def fake_message(model_id, request, input_tokens):
+    """Build a Claude 3 message with a caption and tags per image picked by its hash
+
+    Several images are described by a JSON array, one image by a JSON object.
+    """
+    content = request["messages"][0]["content"]
+    seeds = [
+        hashlib.sha256(block["source"]["data"].encode()).digest()
+        for block in content
+        if block["type"] == "image"
+    ] or [hashlib.sha256(json.dumps(content).encode()).digest()]
+    if len(seeds) == 1:
+        text = json.dumps(fake_description(seeds[0]))
+    else:
+        text = json.dumps(
+            [
+                {"image": idx + 1, **fake_description(seed), "text": ""}
+                for idx, seed in enumerate(seeds)
+            ]
+        )
+    return {
+        "id": f"msg_{seeds[0].hex()[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": model_id,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": input_tokens, "output_tokens": len(text) // 4},
+    }
+
+
+def fake_embedding(seed, length):
+    """Generate a unit length vector from the seed"""
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(length)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector]
@@ -0,0 +1,62 @@
+"""Content addressed image files, sharded by hash prefix under FILE_LOCATION"""
+
+import io
+import os
+import uuid
+import hashlib
+
+from PIL import Image
+
+from lib import constants
+
+EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg"}
+
+
+def image_extension(image_bytes, name=None):
+    """Get the file extension from the image format, fall back to the name"""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            if image.format in EXTENSIONS:
+                return EXTENSIONS[image.format]
+    except Exception:
+        pass
+    return os.path.splitext(name or "")[1].lower() or ".png"
+
+
+def content_id(image_bytes, name=None):
+    """Build the image id from the hash of the bytes and the image format"""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return f"{digest}{image_extension(image_bytes, name)}"
+
+
+def content_path(image_id, location=None):
+    """Get the sharded path of the image id, two levels of 256 directories"""
+    return os.path.join(
+        location or constants.FILE_LOCATION,
+        image_id[: constants.FILE_SHARD_WIDTH],
+        image_id[constants.FILE_SHARD_WIDTH : constants.FILE_SHARD_WIDTH * 2],
+        image_id,
+    )
+
+
+def write(image_id, image_bytes, location=None):
+    """Write the image once, return (path, written)"""
+    path = content_path(image_id, location)
+    if os.path.exists(path):
+        return path, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(image_bytes)
+    os.replace(temp_path, path)
+    return path, True
+
+
+def iter_files(location=None):
+    """Yield (image_id, path) of every file, sharded or left flat by older versions"""
+    location = location or constants.FILE_LOCATION
+    for root, dirs, files in os.walk(location):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith(".tmp"):
+                yield name, os.path.join(root, name)
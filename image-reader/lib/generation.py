@@ -0,0 +1,273 @@
+"""Generate images for a grid of parameter combinations concurrently"""
+
+import os
+import json
+import time
+import uuid
+import base64
+import shutil
+import hashlib
+import functools
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lib import constants
+from lib import ingest
+from lib import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def parameter_grid(
+    seeds=(constants.SEED,),
+    cfg_scales=(constants.CFG_SCALE,),
+    sizes=((constants.WIDTH, constants.HEIGHT),),
+    number_of_images=constants.NUMBER_OF_IMAGES,
+    quality=constants.QUALITY,
+):
+    """Build generation parameters for every seed, cfg scale and size combination"""
+    check_grid_size(len(seeds) * len(cfg_scales) * len(sizes))
+    return [
+        {
+            "number_of_images": number_of_images,
+            "quality": quality,
+            "cfg_scale": cfg_scale,
+            "width": width,
+            "height": height,
+            "seed": seed,
+        }
+        for seed, cfg_scale, (width, height) in itertools.product(
+            seeds, cfg_scales, sizes
+        )
+    ]
+
+
+def check_grid_size(size):
+    """Raise ValueError when the grid has more cells than GENERATION_MAX_GRID"""
+    if size > constants.GENERATION_MAX_GRID:
+        raise ValueError(
+            f"{size} parameter combinations, generate at most "
+            f"{constants.GENERATION_MAX_GRID} at once"
+        )
+
+
+def request_key(prompt, params):
+    """Build result cache key, Titan output is deterministic for a fixed seed"""
+    request = {"model": constants.IMAGE_GENERATOR_MODEL, "prompt": prompt, **params}
+    encoded = json.dumps(request, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResultCache:
+    """Generated images on disk, one directory of PNG files per request
+
+    Entries expire once the TTL passed since they were generated, the mtime
+    of their files, however often they are used. The directory mtime is the
+    last use, the least recently used are evicted once the total size is
+    over max_bytes. The total is counted by one scan of the location, then
+    kept up to date as results are stored by this process.
+    """
+
+    def __init__(
+        self,
+        location,
+        ttl=constants.GENERATION_CACHE_TTL,
+        max_bytes=constants.GENERATION_CACHE_MAX_BYTES,
+    ):
+        self.location = location
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._total = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get image bytes of the request, None if it is not cached or expired"""
+        directory = os.path.join(self.location, key)
+        try:
+            names = sorted(os.listdir(directory), key=lambda name: int(name.split(".")[0]))
+            if not names or self.is_expired(os.path.join(directory, names[0])):
+                self.remove(directory)
+                return None
+            images = []
+            for name in names:
+                with open(os.path.join(directory, name), "rb") as f:
+                    images.append(f.read())
+            os.utime(directory)
+            return images
+        except (OSError, ValueError):
+            return None
+
+    def is_expired(self, path):
+        """Check if the file was generated more than the TTL ago"""
+        return time.time() - os.path.getmtime(path) > self.ttl
+
+    def put(self, key, images):
+        """Store image bytes of the request, visible only once complete"""
+        directory = os.path.join(self.location, key)
+        temp_directory = f"{directory}.{uuid.uuid4()}.tmp"
+        os.makedirs(temp_directory, exist_ok=True)
+        for idx, image in enumerate(images):
+            with open(os.path.join(temp_directory, f"{idx}.png"), "wb") as f:
+                f.write(image)
+        try:
+            os.rename(temp_directory, directory)
+        except OSError:
+            # Another job stored the same request first
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            return
+        with self._lock:
+            if self._total is not None:
+                self._total += sum(len(image) for image in images)
+            if self._total is None or self._total > self.max_bytes:
+                self.evict()
+
+    def remove(self, directory):
+        """Remove an entry and its size from the total"""
+        try:
+            size = sum(entry.stat().st_size for entry in os.scandir(directory))
+        except OSError:
+            return
+        shutil.rmtree(directory, ignore_errors=True)
+        with self._lock:
+            if self._total is not None:
+                self._total -= size
+
+    def evict(self):
+        """Remove expired entries, then the least recently used over max_bytes
+
+        Scans every entry and recounts the total, caller holds the lock.
+        """
+        entries = []
+        for name in os.listdir(self.location):
+            directory = os.path.join(self.location, name)
+            if name.endswith(".tmp") or not os.path.isdir(directory):
+                continue
+            try:
+                files = list(os.scandir(directory))
+                used = os.path.getmtime(directory)
+                size = sum(entry.stat().st_size for entry in files)
+                expired = not files or self.is_expired(files[0].path)
+            except OSError:
+                continue
+            entries.append((not expired, used, size, directory))
+        # Expired entries sort first, then the least recently used
+        entries.sort()
+        total = sum(size for _, _, size, _ in entries)
+        evicted = 0
+        for live, _, size, directory in entries:
+            if live and total <= self.max_bytes:
+                break
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+            evicted += 1
+        self._total = total
+        if evicted:
+            logger.info(f"Evicted {evicted} cached generation results.")
+
+
+class GeneratedImage:
+    """Generated PNG bytes with the interface of streamlit UploadedFile
+
+    Names derive from the request key, so saving the same image twice
+    overwrites it instead of adding a duplicate.
+    """
+
+    def __init__(self, data, name):
+        self.data = data
+        self.name = name
+
+    def getvalue(self):
+        """Get the image bytes without copying"""
+        return self.data
+
+    def getbuffer(self):
+        """Get the bytes as a memoryview"""
+        return memoryview(self.data)
+
+
+def generated_images(key, images):
+    """Wrap image bytes of the request"""
+    return [
+        GeneratedImage(image, f"generated-{key[:16]}-{idx}.png")
+        for idx, image in enumerate(images)
+    ]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Get the process wide generation result cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.location != constants.GENERATION_CACHE_LOCATION:
+            _cache = ResultCache(constants.GENERATION_CACHE_LOCATION)
+        return _cache
+
+
+def run_grid(
+    prompt,
+    grid,
+    generate,
+    max_in_flight=constants.GENERATION_MAX_IN_FLIGHT,
+    embed=None,
+):
+    """Generate every parameter combination, yield results as they complete
+
+    Yields (index, params, images, cached) where images are GeneratedImage
+    objects and index is the position in the grid. generate(prompt, **params)
+    returns base64 images. Identical requests in the grid are generated once.
+    embed(image_bytes, base64_encoded_image) is called on every new image
+    while the base64 payload is still in hand.
+    """
+    check_grid_size(len(grid))
+    cache = get_cache()
+    keys = [request_key(prompt, params) for params in grid]
+    waiting = {}
+    for idx, (key, params) in enumerate(zip(keys, grid)):
+        waiting.setdefault(key, []).append(idx)
+
+    def generate_and_cache(key, params):
+        images = []
+        for base64_encoded_image in ingest.call_with_backoff(
+            functools.partial(generate, **params), limiter, prompt
+        ):
+            with metrics.timer("base64", operation="decode"):
+                image = base64.b64decode(base64_encoded_image)
+            if embed is not None:
+                try:
+                    embed(image, base64_encoded_image)
+                except Exception as err:
+                    logger.warning(f"Failed to embed generated image: {err}")
+            images.append(image)
+        cache.put(key, images)
+        return generated_images(key, images)
+
+    limiter = ingest.AdaptiveLimiter(max_in_flight)
+    with ThreadPoolExecutor(max_workers=limiter.max_in_flight) as executor:
+        futures = {}
+        cached = []
+        for key, indexes in waiting.items():
+            images = cache.get(key)
+            if images is None:
+                future = executor.submit(generate_and_cache, key, grid[indexes[0]])
+                futures[future] = key
+            else:
+                images = generated_images(key, images)
+                cached.extend((idx, grid[idx], images, True) for idx in indexes)
+        logger.info(
+            f"Generating {len(futures)} of {len(grid)} requests, "
+            f"{len(waiting) - len(futures)} served from cache."
+        )
+        yield from cached
+        try:
+            for future in as_completed(futures):
+                images = future.result()
+                for idx in waiting[futures[future]]:
+                    yield idx, grid[idx], images, False
+        finally:
+            for future in futures:
+                future.cancel()
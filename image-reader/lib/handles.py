@@ -0,0 +1,117 @@
+"""Process wide handles of namespace stores, bounded by count and idle time"""
+
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from lib import constants
+from lib import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteHandle:
+    """Base of SQLite backed handles, the connection opens on first use
+
+    Subclasses set path and _lock. A handle closed on eviction reopens its
+    connection when a caller still holding it uses it again.
+    """
+
+    _db = None
+
+    @property
+    def _connection(self):
+        """Get the connection, open it when closed"""
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+        return self._db
+
+    def close(self):
+        """Close the connection once running calls finish"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class HandleCache:
+    """Handles by key, opened on first use and shared across sessions
+
+    The least recently used handles beyond HANDLES_MAX_OPEN, and handles
+    idle for HANDLES_IDLE_SECONDS, are closed when another handle is used
+    and reopened when used again. Handles without a close method are only
+    dropped. on_evict is called with the key of every evicted handle.
+    """
+
+    def __init__(
+        self,
+        kind,
+        max_open=constants.HANDLES_MAX_OPEN,
+        idle_seconds=constants.HANDLES_IDLE_SECONDS,
+        on_evict=None,
+    ):
+        self.kind = kind
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self.on_evict = on_evict
+        self._handles = OrderedDict()
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, open_handle):
+        """Get the handle of the key, open_handle() opens it when missing"""
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = self._handles[key] = open_handle()
+            self._handles.move_to_end(key)
+            self._last_used[key] = time.monotonic()
+            evicted = self._evict(keep=key)
+        # Closed outside the cache lock, a handle waits for its running calls
+        for evicted_key, evicted_handle in evicted:
+            logger.info(f"Closing {self.kind} {evicted_key}.")
+            close(evicted_handle)
+        return handle
+
+    def _evict(self, keep):
+        """Pop least recently used and idle handles, caller holds the lock"""
+        now = time.monotonic()
+        evicted = []
+        for key in list(self._handles):
+            if key == keep:
+                continue
+            idle = now - self._last_used[key] > self.idle_seconds
+            if idle or len(self._handles) > self.max_open:
+                evicted.append((key, self._handles.pop(key)))
+                del self._last_used[key]
+                metrics.count("handle_evictions", kind=self.kind)
+                if self.on_evict:
+                    self.on_evict(key)
+        return evicted
+
+    def forget(self, key):
+        """Drop the handle of the key without closing it"""
+        with self._lock:
+            self._handles.pop(key, None)
+            self._last_used.pop(key, None)
+
+    def clear(self):
+        """Close and drop every handle"""
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+            self._last_used.clear()
+        for handle in handles:
+            close(handle)
+
+
+def close(handle):
+    """Close the handle when it can be closed, log failures"""
+    if not hasattr(handle, "close"):
+        return
+    try:
+        handle.close()
+    except Exception as err:
+        logger.warning(f"Failed to close {handle}: {err}")
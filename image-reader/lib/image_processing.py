@@ -0,0 +1,112 @@
+"""Downscale and re-encode images before sending them to Claude 3"""
+
+import io
+import logging
+
+from PIL import Image
+from PIL import ImageOps
+
+from lib import constants
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "GIF": "image/gif", "WEBP": "image/webp"}
+ORIENTATION_TAG = 0x0112
+SWAPPED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def estimate_image_tokens(width, height):
+    """Estimate Claude 3 input tokens of an image"""
+    return (width * height) // 750
+
+
+def target_size(width, height):
+    """Get the size within the max edge and pixel budget, keeping aspect ratio"""
+    scale = min(
+        1.0,
+        constants.CLAUDE_IMAGE_MAX_EDGE / max(width, height),
+        (constants.CLAUDE_IMAGE_MAX_PIXELS / (width * height)) ** 0.5,
+    )
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def has_transparency(image):
+    """Check if any pixel of the image is not fully opaque"""
+    if "transparency" in image.info:
+        return True
+    if image.mode in ("RGBA", "LA"):
+        return image.getchannel("A").getextrema()[0] < 255
+    return False
+
+
+def upright_size(image, orientation):
+    """Get the size of the image once rotated by its EXIF orientation"""
+    width, height = image.size
+    if orientation in SWAPPED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def encode_candidates(image, has_alpha):
+    """Encode the image as PNG and, unless it has transparency, as JPEG"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    candidates = [(buffer.getvalue(), MEDIA_TYPES["PNG"])]
+    if not has_alpha:
+        buffer = io.BytesIO()
+        image.convert("RGB").save(
+            buffer, format="JPEG", quality=constants.CLAUDE_IMAGE_QUALITY
+        )
+        candidates.append((buffer.getvalue(), MEDIA_TYPES["JPEG"]))
+    return candidates
+
+
+def prepare_image_for_claude(image_bytes):
+    """Downscale and re-encode the image, return (bytes, media type, stats)
+
+    Images are rotated upright by their EXIF orientation, since re-encoding
+    drops the tag. The original bytes are sent as is only when they are
+    upright, within the size limits and smaller than the re-encoded ones.
+    Token stats are estimated from the dimensions of the image actually sent.
+    Claude downscales larger images to the same limits, so downscaling saves
+    upload bytes and latency but not input tokens.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        original_format = image.format
+        orientation = image.getexif().get(ORIENTATION_TAG, 1)
+        original_size = upright_size(image, orientation)
+        size = target_size(*original_size)
+        candidates = []
+        if (
+            size == original_size
+            and orientation == 1
+            and original_format in ("PNG", "JPEG")
+        ):
+            candidates.append((image_bytes, MEDIA_TYPES[original_format]))
+        if (
+            not candidates
+            or len(image_bytes) > constants.CLAUDE_IMAGE_REENCODE_MIN_BYTES
+        ):
+            has_alpha = has_transparency(image)
+            if original_format == "JPEG":
+                # Drafted in the stored orientation, before it is transposed
+                swapped = orientation in SWAPPED_ORIENTATIONS
+                image.draft("RGB", size[::-1] if swapped else size)
+            upright = ImageOps.exif_transpose(image) if orientation != 1 else image
+            resized = (
+                upright.resize(size, Image.LANCZOS) if upright.size != size else upright
+            )
+            candidates.extend(encode_candidates(resized, has_alpha))
+        processed_bytes, media_type = min(candidates, key=lambda item: len(item[0]))
+    with Image.open(io.BytesIO(processed_bytes)) as sent:
+        sent_size = sent.size
+    stats = {
+        "original_bytes": len(image_bytes),
+        "bytes": len(processed_bytes),
+        "tokens": estimate_image_tokens(*sent_size),
+    }
+    logger.info(
+        f"Prepared image {original_size} -> {sent_size}, "
+        f"{stats['original_bytes'] // 1024} KB -> {stats['bytes'] // 1024} KB."
+    )
+    return processed_bytes, media_type, stats
@@ -0,0 +1,199 @@
+"""Bounded concurrency ingestion engine"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from botocore.exceptions import ClientError
+
+from lib import constants
+from lib import metrics
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException")
+
+
+def is_throttling_error(err):
+    """Check if the error is raised by bedrock throttling"""
+    return (
+        isinstance(err, ClientError)
+        and err.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    )
+
+
+class AdaptiveLimiter:
+    """Limit the calls in flight, halve the limit on throttling and grow it back on success"""
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max(1, max_in_flight)
+        self.limit = self.max_in_flight
+        self.in_flight = 0
+        self.successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot"""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        """Free a slot and adjust the limit"""
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.limit < self.max_in_flight and self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+            self._condition.notify_all()
+
+
+class RateBudget:
+    """Hold requests until they fit requests and tokens per minute budgets
+
+    Requests are counted over a sliding minute with their estimated tokens,
+    settle replaces the estimate with the actual tokens once known.
+    """
+
+    def __init__(self, tokens_per_minute=None, requests_per_minute=None, window=60.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self._requests = deque()
+        self._condition = threading.Condition()
+
+    def _wait_time(self, now, tokens):
+        """Get seconds until the request fits, 0 when it fits now"""
+        while self._requests and self._requests[0][0] <= now - self.window:
+            self._requests.popleft()
+        wait = 0.0
+        if self.requests_per_minute and len(self._requests) >= self.requests_per_minute:
+            oldest = self._requests[-self.requests_per_minute][0]
+            wait = oldest + self.window - now
+        if self.tokens_per_minute:
+            # A request larger than the whole budget runs alone in the window
+            excess = sum(used for _, used in self._requests) + tokens - self.tokens_per_minute
+            for started, used in self._requests:
+                if excess <= 0:
+                    break
+                excess -= used
+                wait = max(wait, started + self.window - now)
+        return wait
+
+    def acquire(self, tokens=0):
+        """Wait until the request fits both budgets, return a ticket for settle"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    ticket = [now, tokens]
+                    self._requests.append(ticket)
+                    return ticket
+                self._condition.wait(wait)
+
+    def settle(self, ticket, tokens):
+        """Replace the estimated tokens of a request with the actual tokens"""
+        with self._condition:
+            ticket[1] = tokens
+            self._condition.notify_all()
+
+
+def call_with_backoff(func, limiter, *args):
+    """Call the function within the limiter, back off and retry on throttling"""
+    for attempt in range(constants.THROTTLE_MAX_RETRIES + 1):
+        limiter.acquire()
+        try:
+            result = func(*args)
+        except Exception as err:
+            throttled = is_throttling_error(err)
+            limiter.release(throttled=throttled)
+            if not throttled or attempt == constants.THROTTLE_MAX_RETRIES:
+                raise
+            metrics.count("throttled_retries")
+            delay = min(
+                constants.THROTTLE_BACKOFF_MAX,
+                constants.THROTTLE_BACKOFF_BASE * 2**attempt,
+            ) * random.uniform(0.5, 1)
+            logger.warning(
+                f"Throttled, limit is {limiter.limit}, retry in {delay:.2f} seconds."
+            )
+            time.sleep(delay)
+        else:
+            limiter.release()
+            return result
+
+
+def run_ingestion(
+    records,
+    embed,
+    upsert,
+    max_in_flight=constants.EMBED_MAX_IN_FLIGHT,
+    batch_size=constants.UPSERT_BATCH_SIZE,
+    on_batch=None,
+):
+    """Embed (id, content, metadata) records concurrently and upsert them in batches
+
+    on_batch is called with the ids of every batch once it is upserted.
+    """
+    limiter = AdaptiveLimiter(max_in_flight)
+    records = iter(records)
+    pending = {}
+    ids, embeddings, metadatas = [], [], []
+    count = 0
+
+    def flush():
+        nonlocal ids, embeddings, metadatas, count
+        if ids:
+            batch = (ids, embeddings, metadatas)
+            ids, embeddings, metadatas = [], [], []
+            upsert(*batch)
+            count += len(batch[0])
+            if on_batch is not None:
+                on_batch(batch[0])
+
+    with ThreadPoolExecutor(max_workers=limiter.max_in_flight) as executor:
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < limiter.max_in_flight * 2:
+                    record = next(records, None)
+                    if record is None:
+                        exhausted = True
+                        break
+                    record_id, content, metadata = record
+                    future = executor.submit(call_with_backoff, embed, limiter, content)
+                    pending[future] = (record_id, metadata)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record_id, metadata = pending.pop(future)
+                    embedding = future.result()
+                    ids.append(record_id)
+                    embeddings.append(embedding)
+                    metadatas.append(metadata)
+                if len(ids) >= batch_size:
+                    flush()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            # Keep the embeddings made so far, a flush error must not hide
+            # the original one
+            try:
+                flush()
+            except Exception as err:
+                logger.warning(f"Failed to upsert the last batch after an error: {err}")
+            raise
+        flush()
+    logger.info(f"Ingested {count} images.")
+    return count
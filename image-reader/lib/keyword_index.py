@@ -0,0 +1,145 @@
+"""Inverted keyword index over image captions and tags with BM25 ranking"""
+
+import re
+import json
+import math
+import logging
+import threading
+from collections import Counter
+
+from lib import constants
+from lib import handles
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the there "
+    "this to was were with image picture photo shows".split()
+)
+
+
+def tokenize(text):
+    """Split text into lower case terms without stop words"""
+    return [
+        term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOP_WORDS
+    ]
+
+
+class KeywordIndex(handles.SQLiteHandle):
+    """SQLite backed postings of caption and tag terms"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(image_id TEXT PRIMARY KEY, caption TEXT, tags TEXT, length INTEGER NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS postings "
+            "(term TEXT NOT NULL, image_id TEXT NOT NULL, frequency INTEGER NOT NULL, "
+            "PRIMARY KEY (term, image_id))"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS postings_image_id ON postings (image_id)"
+        )
+        self._connection.commit()
+
+    def add(self, image_id, caption="", tags=(), text=""):
+        """Add or replace the caption and tags of an image, tags count twice
+
+        Text transcribed from the image is indexed but not stored.
+        """
+        terms = Counter(tokenize(f"{caption or ''} {text or ''}"))
+        for tag in tags:
+            for term in tokenize(tag):
+                terms[term] += 2
+        with self._lock:
+            self._remove(image_id)
+            self._connection.execute(
+                "INSERT INTO documents (image_id, caption, tags, length) VALUES (?, ?, ?, ?)",
+                (image_id, caption, json.dumps(list(tags)), sum(terms.values())),
+            )
+            self._connection.executemany(
+                "INSERT INTO postings (term, image_id, frequency) VALUES (?, ?, ?)",
+                [(term, image_id, frequency) for term, frequency in terms.items()],
+            )
+            self._connection.commit()
+
+    def _remove(self, image_id):
+        """Remove the postings of an image, caller holds the lock"""
+        self._connection.execute("DELETE FROM postings WHERE image_id = ?", (image_id,))
+        self._connection.execute("DELETE FROM documents WHERE image_id = ?", (image_id,))
+
+    def remove(self, image_ids):
+        """Remove images from the index"""
+        with self._lock:
+            for image_id in image_ids:
+                self._remove(image_id)
+            self._connection.commit()
+
+    def get(self, image_id):
+        """Get {"caption", "tags"} of an image, None if it is not indexed"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT caption, tags FROM documents WHERE image_id = ?", (image_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"caption": row[0], "tags": json.loads(row[1])}
+
+    def count(self):
+        """Count indexed images"""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def search(self, query, limit=constants.HYBRID_CANDIDATES):
+        """Rank images by BM25 score of the query terms, return [(image_id, score)]"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            total, average_length = self._connection.execute(
+                "SELECT COUNT(*), AVG(length) FROM documents"
+            ).fetchone()
+            if not total:
+                return []
+            rows = self._connection.execute(
+                "SELECT p.term, p.image_id, p.frequency, d.length, "
+                "(SELECT COUNT(*) FROM postings WHERE term = p.term) "
+                "FROM postings p JOIN documents d ON d.image_id = p.image_id "
+                f"WHERE p.term IN ({placeholders})",
+                list(terms),
+            ).fetchall()
+        scores = Counter()
+        k1 = constants.BM25_K1
+        b = constants.BM25_B
+        for _, image_id, frequency, length, document_frequency in rows:
+            idf = math.log(1 + (total - document_frequency + 0.5) / (document_frequency + 0.5))
+            norm = k1 * (1 - b + b * length / (average_length or 1))
+            scores[image_id] += idf * frequency * (k1 + 1) / (frequency + norm)
+        return scores.most_common(limit)
+
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """Fuse ranked id lists by summing 1 / (k + rank), return [(id, score)] best first"""
+    k = constants.RRF_K if k is None else k
+    scores = Counter()
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] += 1 / (k + rank)
+    return scores.most_common()
+
+
+_indexes = handles.HandleCache("keyword index")
+
+
+def get_index(path=None):
+    """Get the process wide keyword index of the path
+
+    Least recently used and idle indexes are closed, see handles.HandleCache.
+    """
+    path = path or constants.KEYWORD_INDEX_PATH
+    return _indexes.get(path, lambda: KeywordIndex(path))
@@ -0,0 +1,174 @@
+"""Persistent manifest of the images in library"""
+
+import io
+import os
+import logging
+import mimetypes
+import threading
+
+from PIL import Image
+
+from lib import constants
+from lib import file_store
+from lib import handles
+
+logger = logging.getLogger(__name__)
+
+SORT_COLUMNS = ("name", "size", "mtime")
+SORT_EXPRESSIONS = {
+    "name": "COALESCE(original_name, name)",
+    "size": "size",
+    "mtime": "mtime",
+}
+IMAGE_MIME_TYPES = ("image/png", "image/jpeg")
+
+
+def image_dimensions(source):
+    """Get (width, height) from the image header, (None, None) if unreadable"""
+    try:
+        with Image.open(source) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+
+class LibraryIndex(handles.SQLiteHandle):
+    """SQLite backed manifest with name, size, mtime, mime and dimensions
+
+    name is the stored file name, which is the image id, original_name the
+    name the image was uploaded with.
+    """
+
+    def __init__(self, path, file_location=None):
+        self.path = path
+        self.file_location = file_location
+        self._lock = threading.Lock()
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS images "
+            "(name TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER, mtime REAL, "
+            "mime TEXT, width INTEGER, height INTEGER)"
+        )
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(images)")]
+        if "original_name" not in columns:
+            self._connection.execute("ALTER TABLE images ADD COLUMN original_name TEXT")
+        for column in SORT_COLUMNS[1:]:
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS images_{column} ON images ({column})"
+            )
+        self._connection.commit()
+
+    def add(self, name, path, image_bytes=None, original_name=None):
+        """Add or update an image entry from the file on disk, keep the known original name"""
+        stat = os.stat(path)
+        width, height = image_dimensions(
+            path if image_bytes is None else io.BytesIO(image_bytes)
+        )
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO images "
+                "(name, path, size, mtime, mime, width, height, original_name) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET path = excluded.path, "
+                "size = excluded.size, mtime = excluded.mtime, mime = excluded.mime, "
+                "width = excluded.width, height = excluded.height, "
+                "original_name = COALESCE(excluded.original_name, original_name)",
+                (
+                    name,
+                    path,
+                    stat.st_size,
+                    stat.st_mtime,
+                    mimetypes.guess_type(path)[0],
+                    width,
+                    height,
+                    original_name,
+                ),
+            )
+            self._connection.commit()
+
+    def remove(self, name):
+        """Remove an image entry"""
+        with self._lock:
+            self._connection.execute("DELETE FROM images WHERE name = ?", (name,))
+            self._connection.commit()
+
+    def count(self, name_filter=None):
+        """Count images matching the filter"""
+        where, params = self._where(name_filter)
+        with self._lock:
+            return self._connection.execute(
+                f"SELECT COUNT(*) FROM images {where}", params
+            ).fetchone()[0]
+
+    def list(
+        self, offset=0, limit=None, sort_by="name", descending=False, name_filter=None
+    ):
+        """List image entries as dicts, one page at a time"""
+        if sort_by not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort_by}, use one of {SORT_COLUMNS}.")
+        where, params = self._where(name_filter)
+        order = "DESC" if descending else "ASC"
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT name, path, size, mtime, mime, width, height, original_name "
+                f"FROM images {where} "
+                f"ORDER BY {SORT_EXPRESSIONS[sort_by]} {order}, name LIMIT ? OFFSET ?",
+                (*params, -1 if limit is None else limit, offset),
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _where(self, name_filter):
+        """Build where clause for the name filter, matching stored or original name"""
+        if not name_filter:
+            return "", ()
+        pattern = f"%{name_filter}%"
+        return "WHERE name LIKE ? OR original_name LIKE ?", (pattern, pattern)
+
+    def reconcile(self, location=None):
+        """Rebuild the manifest from the files on disk"""
+        location = location or self.file_location or constants.FILE_LOCATION
+        on_disk = {
+            name: path
+            for name, path in file_store.iter_files(location)
+            if mimetypes.guess_type(path)[0] in IMAGE_MIME_TYPES
+        }
+        with self._lock:
+            indexed = {
+                name: (size, mtime)
+                for name, size, mtime in self._connection.execute(
+                    "SELECT name, size, mtime FROM images"
+                )
+            }
+        removed = [name for name in indexed if name not in on_disk]
+        for name in removed:
+            self.remove(name)
+        updated = 0
+        for name, path in on_disk.items():
+            stat = os.stat(path)
+            if indexed.get(name) != (stat.st_size, stat.st_mtime):
+                self.add(name, path)
+                updated += 1
+        logger.info(
+            f"Reconciled library index, {updated} added or updated, {len(removed)} removed."
+        )
+        return {"added_or_updated": updated, "removed": len(removed), "total": len(on_disk)}
+
+
+_indexes = handles.HandleCache("library index")
+
+
+def get_index(path=None, file_location=None):
+    """Get the process wide library index of the path, build it from disk on first use
+
+    Least recently used and idle indexes are closed, see handles.HandleCache.
+    """
+    path = path or constants.LIBRARY_INDEX_PATH
+    file_location = file_location or constants.FILE_LOCATION
+
+    def open_index():
+        index = LibraryIndex(path, file_location)
+        if index.count() == 0 and os.path.isdir(file_location):
+            index.reconcile()
+        return index
+
+    return _indexes.get(path, open_index)
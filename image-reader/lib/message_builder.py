@@ -0,0 +1,55 @@
+"""Build Claude 3 messages as plain dicts"""
+
+import json
+import base64
+
+from lib import constants
+
+
+def encode_image(image):
+    """Get base64 string of raw image bytes, pass base64 strings through"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return base64.b64encode(image).decode("ascii")
+    return image
+
+
+def image_block(image, media_type="image/jpeg"):
+    """Build image content block from raw bytes or base64 string"""
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": media_type,
+            "data": encode_image(image),
+        },
+    }
+
+
+def text_block(text):
+    """Build text content block"""
+    return {"type": "text", "text": text}
+
+
+def build_content(images, query, media_types=None):
+    """Build content blocks, label images as "Image N:" when there are several"""
+    content = []
+    images = images or []
+    for idx, image in enumerate(images):
+        if len(images) > 1:
+            content.append(text_block(f"Image {idx + 1}:"))
+        media_type = media_types[idx] if media_types else "image/jpeg"
+        content.append(image_block(image, media_type))
+    content.append(text_block(query))
+    return content
+
+
+def build_request_body(system, content):
+    """Serialize the invoke model request body for Claude 3"""
+    body = {
+        "anthropic_version": constants.ANTHROPIC_VERSION,
+        "max_tokens": constants.MAX_TOKENS,
+        "temperature": constants.TEMPERATURE,
+        "system": system,
+        "messages": [{"role": "user", "content": content}],
+    }
+    return json.dumps(body)
@@ -0,0 +1,209 @@
+"""Process wide timers and counters, served as Prometheus text and dumped as JSON"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lib import constants
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Timer:
+    """Count, sum and recent samples of one labelled duration"""
+
+    def __init__(self, window):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def quantiles(self):
+        """Get nearest rank quantiles of the recent samples"""
+        samples = sorted(self.samples)
+        if not samples:
+            return {quantile: 0.0 for quantile in QUANTILES}
+        return {
+            quantile: samples[max(0, round(quantile * len(samples)) - 1)]
+            for quantile in QUANTILES
+        }
+
+
+class Registry:
+    """Labelled counters and timers"""
+
+    def __init__(self, window=constants.LATENCY_WINDOW):
+        self.window = window
+        self.started_at = time.time()
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        """Increase a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = Timer(self.window)
+            timer.count += 1
+            timer.sum += seconds
+            timer.samples.append(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the wrapped block, count failures by exception type"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as err:
+            self.count(f"{name}_errors", error=type(err).__name__, **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Get every counter and timer as plain dicts"""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            timers = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": timer.count,
+                    "sum": timer.sum,
+                    "quantiles": {str(q): v for q, v in timer.quantiles().items()},
+                }
+                for (name, labels), timer in sorted(self._timers.items())
+            ]
+        return {
+            "timestamp": time.time(),
+            "uptime_seconds": time.time() - self.started_at,
+            "counters": counters,
+            "timers": timers,
+        }
+
+    def render_prometheus(self):
+        """Render the metrics in Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in snapshot["counters"]:
+            name = f"{constants.METRICS_PREFIX}_{counter['name']}_total"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{format_labels(counter['labels'])} {counter['value']}")
+        for timer in snapshot["timers"]:
+            name = f"{constants.METRICS_PREFIX}_{timer['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            for quantile, value in timer["quantiles"].items():
+                labels = format_labels({**timer["labels"], "quantile": quantile})
+                lines.append(f"{name}{labels} {value}")
+            labels = format_labels(timer["labels"])
+            lines.append(f"{name}_sum{labels} {timer['sum']}")
+            lines.append(f"{name}_count{labels} {timer['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    """Format labels as {key="value",...}"""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{key}="{escape_label_value(value)}"' for key, value in sorted(labels.items())
+    )
+    return f"{{{pairs}}}"
+
+
+def escape_label_value(value):
+    """Escape backslashes, quotes and newlines in a label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+count = registry.count
+observe = registry.observe
+timer = registry.timer
+snapshot = registry.snapshot
+render_prometheus = registry.render_prometheus
+
+
+def dump_json(path=None):
+    """Write the metrics snapshot to a JSON file atomically"""
+    path = path or constants.METRICS_DUMP_PATH
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve /metrics as Prometheus text and /metrics.json as JSON"""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Keep scrapes out of the app log"""
+
+
+_exporter = {"started": False}
+_exporter_lock = threading.Lock()
+
+
+def dump_periodically():
+    """Dump the metrics snapshot every METRICS_DUMP_INTERVAL seconds"""
+    while True:
+        time.sleep(constants.METRICS_DUMP_INTERVAL)
+        try:
+            dump_json()
+        except OSError as err:
+            logger.warning(f"Failed to dump metrics: {err}")
+
+
+def start_exporter():
+    """Start the metrics endpoint and the periodic JSON dump once per process"""
+    with _exporter_lock:
+        if _exporter["started"]:
+            return
+        _exporter["started"] = True
+    threading.Thread(target=dump_periodically, daemon=True).start()
+    if not constants.METRICS_PORT:
+        return
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", constants.METRICS_PORT), MetricsHandler)
+    except OSError as err:
+        logger.warning(f"Failed to serve metrics on port {constants.METRICS_PORT}: {err}")
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on port {constants.METRICS_PORT}.")
@@ -0,0 +1,133 @@
+"""Re-embed the image library into a new collection and swap it in"""
+
+import time
+import logging
+
+from lib import constants
+from lib import ingest
+from lib import namespaces
+from lib import utils
+from lib import vector_store
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 20
+PAGE_SIZE = 1000
+
+
+def list_items(store):
+    """Get {image_id: metadata} of every vector in the store"""
+    items = {}
+    offset = 0
+    while True:
+        page = store.get(offset=offset, limit=PAGE_SIZE)
+        items.update(zip(page["ids"], page["metadatas"]))
+        if len(page["ids"]) < PAGE_SIZE:
+            return items
+        offset += PAGE_SIZE
+
+
+def describe(store, name):
+    """Measure size and query latency of the store"""
+    count = store.count()
+    samples = []
+    if count:
+        query = [[0.0] * store.embedding_length]
+        for _ in range(LATENCY_SAMPLES):
+            start = time.perf_counter()
+            store.query(
+                query_embeddings=query,
+                n_results=constants.N_RESULTS,
+                include=constants.SEARCH_INCLUDE,
+            )
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "collection": name,
+        "embedding_length": store.embedding_length,
+        "count": count,
+        "vector_bytes": count * store.embedding_length * 4,
+        "query_p50_ms": vector_store.percentile(samples, 50) * 1000 if samples else None,
+    }
+
+
+def read_records(items):
+    """Yield (id, image bytes, metadata) records, skip images missing on disk"""
+    for image_id, metadata in items.items():
+        try:
+            with open(metadata["file_path"], "rb") as f:
+                yield image_id, f.read(), metadata
+        except OSError as err:
+            logger.warning(f"Skip {image_id}, failed to read image: {err}")
+
+
+def copy_items(source, target, embedding_length, max_in_flight, on_batch=None):
+    """Embed images of the source store missing in the target store, return the count"""
+    source_items = list_items(source)
+    target_ids = set(list_items(target))
+    removed = list(target_ids - set(source_items))
+    if removed:
+        target.delete(ids=removed)
+    missing = {
+        image_id: metadata
+        for image_id, metadata in source_items.items()
+        if image_id not in target_ids
+    }
+    return ingest.run_ingestion(
+        read_records(missing),
+        embed=lambda image_bytes: utils.embed_image(image_bytes, embedding_length),
+        upsert=lambda ids, embeddings, metadatas: target.upsert(
+            ids=ids, embeddings=embeddings, metadatas=metadatas
+        ),
+        max_in_flight=max_in_flight,
+        on_batch=on_batch,
+    )
+
+
+def migrate_embeddings(
+    embedding_length,
+    target_name=None,
+    max_in_flight=constants.EMBED_MAX_IN_FLIGHT,
+    drop_old=False,
+    on_batch=None,
+    namespace=None,
+):
+    """Re-embed the active collection of the namespace and swap it in
+
+    The active collection keeps serving searches while the new one is filled.
+    Images added or deleted meanwhile are caught up in a second pass right
+    before the swap. Embeddings come from the cache when the same image was
+    embedded at this length before, otherwise from the raw image files.
+    """
+    collection = namespaces.get(namespace).collection
+    source_name = vector_store.active_collection_name(collection)
+    target_name = target_name or f"{collection}_{embedding_length}_{int(time.time())}"
+    if target_name == source_name:
+        raise ValueError(f"Collection {target_name} is already active.")
+    source = vector_store.get_store(name=source_name)
+    target = vector_store.get_store(name=target_name, embedding_length=embedding_length)
+    if target.embedding_length != embedding_length:
+        raise ValueError(
+            f"Collection {target_name} has embedding length {target.embedding_length}."
+        )
+    before = describe(source, source_name)
+    logger.info(f"Migrating {before['count']} images from {source_name} to {target_name}.")
+
+    start = time.perf_counter()
+    migrated = copy_items(source, target, embedding_length, max_in_flight, on_batch)
+    migrated += copy_items(source, target, embedding_length, max_in_flight, on_batch)
+    vector_store.set_active_collection(target_name, collection)
+    elapsed = time.perf_counter() - start
+
+    after = describe(target, target_name)
+    if drop_old:
+        source.drop()
+        vector_store.forget_store(source_name)
+        logger.info(f"Dropped collection {source_name}.")
+    return {
+        "before": before,
+        "after": after,
+        "migrated": migrated,
+        "seconds": elapsed,
+        "dropped_old": drop_old,
+    }
@@ -0,0 +1,98 @@
+"""Library namespaces, each with its own collection, files and indexes"""
+
+import os
+import re
+
+from lib import constants
+
+NAME_PATTERN = re.compile(r"^[a-z0-9](?:[a-z0-9_-]{0,30}[a-z0-9])?$")
+
+
+class Namespace:
+    """Storage locations of one tenant or project library
+
+    The default namespace keeps the original locations, so an existing
+    library is served as is. Locations are read from constants on access.
+    """
+
+    def __init__(self, name):
+        if not NAME_PATTERN.match(name):
+            raise ValueError(
+                f"Invalid namespace {name}, use up to 32 lower case letters, "
+                "digits, - or _, starting and ending with a letter or digit."
+            )
+        self.name = name
+
+    def __repr__(self):
+        return f"Namespace({self.name!r})"
+
+    @property
+    def is_default(self):
+        return self.name == constants.DEFAULT_NAMESPACE
+
+    @property
+    def root(self):
+        if self.is_default:
+            return constants.DATA_LOCATION
+        return f"{constants.NAMESPACE_LOCATION}/{self.name}"
+
+    @property
+    def collection(self):
+        """Configured collection name, migrations may swap in another one"""
+        if self.is_default:
+            return constants.COLLECTION_NAME
+        return f"{constants.COLLECTION_NAME}-{self.name}"
+
+    @property
+    def file_location(self):
+        if self.is_default:
+            return constants.FILE_LOCATION
+        return f"{self.root}/file"
+
+    @property
+    def thumbnail_location(self):
+        if self.is_default:
+            return constants.THUMBNAIL_LOCATION
+        return f"{self.root}/thumbnail"
+
+    @property
+    def library_index_path(self):
+        if self.is_default:
+            return constants.LIBRARY_INDEX_PATH
+        return f"{self.root}/library.sqlite"
+
+    @property
+    def keyword_index_path(self):
+        if self.is_default:
+            return constants.KEYWORD_INDEX_PATH
+        return f"{self.root}/keywords.sqlite"
+
+    @property
+    def caption_results_path(self):
+        if self.is_default:
+            return constants.CAPTION_RESULTS_PATH
+        return f"{self.root}/captions.sqlite"
+
+    def setup(self):
+        """Create the directories of the namespace"""
+        for location in [self.root, self.file_location, self.thumbnail_location]:
+            os.makedirs(location, exist_ok=True)
+
+
+def get(name=None):
+    """Get the namespace by name, the default namespace when name is empty"""
+    if isinstance(name, Namespace):
+        return name
+    return Namespace(name or constants.DEFAULT_NAMESPACE)
+
+
+def list_names():
+    """Get the names of the default and every created namespace"""
+    names = [constants.DEFAULT_NAMESPACE]
+    if os.path.isdir(constants.NAMESPACE_LOCATION):
+        names += sorted(
+            name
+            for name in os.listdir(constants.NAMESPACE_LOCATION)
+            if NAME_PATTERN.match(name) and name != constants.DEFAULT_NAMESPACE
+        )
+    return names
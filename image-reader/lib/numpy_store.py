@@ -0,0 +1,417 @@
+"""Memory mapped vector store with brute force top k search in NumPy"""
+
+import os
+import re
+import json
+import fcntl
+import shutil
+import sqlite3
+import logging
+import threading
+import contextlib
+
+import numpy as np
+
+from lib import constants
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+METRICS = ("l2", "cosine")
+WHERE_OPERATORS = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+    "$in": "IN",
+    "$nin": "NOT IN",
+}
+WHERE_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def quantize(vectors, dtype):
+    """Convert float32 vectors to the storage dtype, return (stored, scales)"""
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        stored = np.round(vectors / scales[:, None]).astype(np.int8)
+        return stored, scales.astype(np.float32)
+    return vectors.astype(DTYPES[dtype]), np.ones(len(vectors), dtype=np.float32)
+
+
+def where_sql(where):
+    """Translate a chroma style metadata where filter to (SQL condition, parameters)"""
+    clauses = []
+    parameters = []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(part) for part in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            parameters.extend(value for _, values in parts for value in values)
+            continue
+        if not WHERE_KEY_PATTERN.match(key):
+            raise ValueError(f"Unsupported where key {key!r}, use letters, digits and _.")
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator not in WHERE_OPERATORS:
+                raise ValueError(f"Unsupported where operator {operator}.")
+            column = f"json_extract(metadata, '$.{key}')"
+            if operator in ("$in", "$nin"):
+                placeholders = ",".join("?" * len(value))
+                clauses.append(f"{column} {WHERE_OPERATORS[operator]} ({placeholders})")
+                parameters.extend(value)
+            else:
+                clauses.append(f"{column} {WHERE_OPERATORS[operator]} ?")
+                parameters.append(value)
+    return " AND ".join(clauses) or "1", parameters
+
+
+class NumpyVectorStore:
+    """Array backed store, vectors in memory mapped files and metadata in SQLite
+
+    Query results follow the shape of chroma collection.query results.
+    Several processes may open the same store, writes hold a file lock and
+    rows are reloaded whenever another process committed changes. A closed
+    store reopens its files when it is used again. float16 vectors are
+    converted to float32 once and kept in memory for queries, so float16
+    halves the files but not the memory of a queried store.
+    """
+
+    def __init__(
+        self,
+        path,
+        name,
+        dtype=constants.NUMPY_VECTOR_DTYPE,
+        metric=constants.NUMPY_VECTOR_METRIC,
+        dimension=constants.OUTPUT_EMBEDDING_LENGTH,
+    ):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, use one of {list(DTYPES)}.")
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric {metric}, use one of {METRICS}.")
+        self.directory = os.path.join(path, "numpy", name)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._connect()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items "
+            "(id TEXT PRIMARY KEY, row INTEGER UNIQUE NOT NULL, metadata TEXT)"
+        )
+        settings = dict(self._db.execute("SELECT key, value FROM settings"))
+        if settings:
+            dtype = settings["dtype"]
+            metric = settings["metric"]
+            dimension = int(settings["dimension"])
+        else:
+            self._db.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?)",
+                [("dtype", dtype), ("metric", metric), ("dimension", str(dimension))],
+            )
+            self._db.commit()
+        self.dtype = dtype
+        self.metric = metric
+        self.dimension = dimension
+        self.embedding_length = dimension
+        self._refresh()
+
+    def _connect(self):
+        """Open the metadata database and the lock file, rows load on refresh"""
+        self._db = sqlite3.connect(
+            os.path.join(self.directory, "metadata.sqlite"), check_same_thread=False
+        )
+        self._lock_file = open(os.path.join(self.directory, "lock"), "a")
+        self._capacity = 0
+        self._version = None
+        self._float32 = None
+
+    def close(self):
+        """Close the files and release the mapped arrays"""
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.close()
+            self._lock_file.close()
+            self._db = None
+            self._float32 = None
+            del self._vectors, self._scales, self._norms
+            del self._live, self._ids, self._row_of, self._free
+
+    def _refresh(self):
+        """Reload the rows when another connection committed since the last load"""
+        if self._db is None:
+            self._connect()
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version:
+            return
+        self._version = version
+        self._float32 = None
+        self._row_of = dict(self._db.execute("SELECT id, row FROM items"))
+        self._size = max(self._row_of.values(), default=-1) + 1
+        if self._capacity:
+            self._grow(self._size)
+        else:
+            self._map(max(constants.NUMPY_INITIAL_CAPACITY, self._size))
+        self._live = np.zeros(self._capacity, dtype=bool)
+        self._live[list(self._row_of.values())] = True
+        self._ids = np.empty(self._capacity, dtype=object)
+        for image_id, row in self._row_of.items():
+            self._ids[row] = image_id
+        self._free = [row for row in range(self._size) if not self._live[row]]
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Hold the thread and file locks with the rows of the latest commit"""
+        with self._lock:
+            if self._db is None:
+                self._connect()
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _map(self, capacity):
+        """Map the array files with room for the capacity"""
+        self._capacity = capacity
+        self._float32 = None
+        self._vectors = self._map_file(
+            "vectors.bin", DTYPES[self.dtype], (capacity, self.dimension)
+        )
+        self._scales = self._map_file("scales.bin", np.float32, (capacity,))
+        self._norms = self._map_file("norms.bin", np.float32, (capacity,))
+
+    def _map_file(self, filename, dtype, shape):
+        """Map the file, extending it to fit the shape"""
+        path = os.path.join(self.directory, filename)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < nbytes:
+                f.truncate(nbytes)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _grow(self, size):
+        """Double the capacity until the size fits"""
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+        if capacity == self._capacity:
+            return
+        self._map(capacity)
+        self._live = np.concatenate(
+            [self._live, np.zeros(capacity - len(self._live), dtype=bool)]
+        )
+        self._ids = np.concatenate(
+            [self._ids, np.empty(capacity - len(self._ids), dtype=object)]
+        )
+
+    def _dequantize(self, rows):
+        """Get float32 vectors of the rows"""
+        return self._vectors[rows].astype(np.float32) * self._scales[rows, None]
+
+    def count(self):
+        """Count stored vectors"""
+        with self._lock:
+            self._refresh()
+            return len(self._row_of)
+
+    def get(self, offset=0, limit=None, ids=None, where=None):
+        """Get ids and metadatas of stored vectors, optionally of the ids matching where"""
+        condition, parameters = where_sql(where or {})
+        if ids is not None:
+            condition += f" AND id IN ({','.join('?' * len(ids))})"
+            parameters += list(ids)
+        with self._lock:
+            self._refresh()
+            rows = self._db.execute(
+                f"SELECT id, metadata FROM items WHERE {condition} "
+                "ORDER BY row LIMIT ? OFFSET ?",
+                parameters + [-1 if limit is None else limit, offset],
+            ).fetchall()
+        return {
+            "ids": [image_id for image_id, _ in rows],
+            "metadatas": [json.loads(metadata) for _, metadata in rows],
+        }
+
+    def existing(self, ids):
+        """Get the subset of ids that are stored"""
+        with self._lock:
+            self._refresh()
+            return {image_id for image_id in ids if image_id in self._row_of}
+
+    def upsert(self, ids, embeddings, metadatas):
+        """Add or update vectors"""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match {self.dimension}."
+            )
+        if self.metric == "cosine":
+            vectors = vectors / np.maximum(
+                np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+            )
+        stored, scales = quantize(vectors, self.dtype)
+        with self._writing():
+            rows = []
+            for image_id in ids:
+                row = self._row_of.get(image_id)
+                if row is None:
+                    row = self._free.pop() if self._free else self._size
+                    self._size = max(self._size, row + 1)
+                    self._row_of[image_id] = row
+                rows.append(row)
+            self._grow(self._size)
+            self._vectors[rows] = stored
+            if self._float32 is not None:
+                self._float32[rows] = stored
+            self._scales[rows] = scales
+            self._norms[rows] = np.square(self._dequantize(rows)).sum(axis=1)
+            self._live[rows] = True
+            self._ids[rows] = ids
+            for array in (self._vectors, self._scales, self._norms):
+                array.flush()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO items (id, row, metadata) VALUES (?, ?, ?)",
+                [
+                    (image_id, row, json.dumps(metadata))
+                    for image_id, row, metadata in zip(ids, rows, metadatas)
+                ],
+            )
+            self._db.commit()
+
+    def update(self, ids, metadatas):
+        """Replace the metadatas of stored vectors, unknown ids are ignored"""
+        with self._writing():
+            self._db.executemany(
+                "UPDATE items SET metadata = ? WHERE id = ?",
+                [
+                    (json.dumps(metadata), image_id)
+                    for image_id, metadata in zip(ids, metadatas)
+                ],
+            )
+            self._db.commit()
+
+    def delete(self, ids):
+        """Delete vectors"""
+        with self._writing():
+            for image_id in ids:
+                row = self._row_of.pop(image_id, None)
+                if row is not None:
+                    self._live[row] = False
+                    self._ids[row] = None
+                    self._free.append(row)
+            self._db.executemany(
+                "DELETE FROM items WHERE id = ?", [(image_id,) for image_id in ids]
+            )
+            self._db.commit()
+
+    def drop(self):
+        """Delete the collection files"""
+        with self._lock:
+            self.close()
+            shutil.rmtree(self.directory)
+
+    def _where_rows(self, where):
+        """Get the rows of the metadata matching the where filter"""
+        condition, parameters = where_sql(where)
+        return np.array(
+            [
+                row
+                for (row,) in self._db.execute(
+                    f"SELECT row FROM items WHERE {condition} ORDER BY row", parameters
+                )
+            ],
+            dtype=np.int64,
+        )
+
+    def _query_vectors(self):
+        """Get the vectors to multiply with the queries
+
+        Converting float16 blocks on every query is several times slower than
+        the float32 matmul, so they are converted once and updated on upsert.
+        """
+        if self.dtype != "float16":
+            return self._vectors
+        if self._float32 is None:
+            self._float32 = self._vectors.astype(np.float32)
+        return self._float32
+
+    def _distances(self, queries, rows=None):
+        """Get distances from the queries to the rows, every row by default
+
+        Deleted rows are at infinity when scanning every row.
+        """
+        size = self._size if rows is None else len(rows)
+        distances = np.empty((len(queries), size), dtype=np.float32)
+        if self.metric == "cosine":
+            queries = queries / np.maximum(
+                np.linalg.norm(queries, axis=1, keepdims=True), 1e-12
+            )
+        query_norms = np.square(queries).sum(axis=1)[:, None]
+        vectors = self._query_vectors()
+        for start in range(0, size, constants.NUMPY_QUERY_CHUNK):
+            end = min(start + constants.NUMPY_QUERY_CHUNK, size)
+            block = slice(start, end) if rows is None else rows[start:end]
+            dots = queries @ vectors[block].astype(np.float32, copy=False).T
+            dots *= self._scales[block]
+            if self.metric == "cosine":
+                distances[:, start:end] = 1 - dots
+            else:
+                distances[:, start:end] = query_norms + self._norms[block] - 2 * dots
+        if rows is None:
+            distances[:, ~self._live[:size]] = np.inf
+        return distances
+
+    def query(self, query_embeddings, n_results, include, where=None):
+        """Find the nearest vectors of every query
+
+        A metadata where filter narrows the rows before the scan, so only
+        matching vectors are read.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        result = {
+            "ids": [],
+            "distances": [] if "distances" in include else None,
+            "metadatas": [] if "metadatas" in include else None,
+            "embeddings": [] if "embeddings" in include else None,
+        }
+        with self._lock:
+            self._refresh()
+            candidates = self._where_rows(where) if where else None
+            k = min(n_results, self.count() if candidates is None else len(candidates))
+            if k == 0:
+                for key in result:
+                    if result[key] is not None:
+                        result[key] = [[] for _ in queries]
+                return result
+            distances = self._distances(queries, candidates)
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            for query_columns, query_distances in zip(top, distances):
+                columns = query_columns[np.argsort(query_distances[query_columns])]
+                rows = columns if candidates is None else candidates[columns]
+                result["ids"].append(self._ids[rows].tolist())
+                if result["distances"] is not None:
+                    result["distances"].append(query_distances[columns].tolist())
+                if result["metadatas"] is not None:
+                    result["metadatas"].append(self._metadatas(rows))
+                if result["embeddings"] is not None:
+                    result["embeddings"].append(self._dequantize(rows).tolist())
+        return result
+
+    def _metadatas(self, rows):
+        """Load metadatas of the rows in order"""
+        placeholders = ",".join("?" * len(rows))
+        found = dict(
+            self._db.execute(
+                f"SELECT row, metadata FROM items WHERE row IN ({placeholders})",
+                [int(row) for row in rows],
+            )
+        )
+        return [json.loads(found[int(row)]) for row in rows]
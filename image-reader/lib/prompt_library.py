@@ -1,25 +1,41 @@
 """Crawl Anthropic prompt library"""
 
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
 from typing import Dict
 
-import streamlit as st
 import requests
 from bs4 import BeautifulSoup
 
+from lib import constants
+
 URL = "https://docs.anthropic.com/claude"
+SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), "prompt_library_snapshot.json")
+# Prompts only in the bundled snapshot, they have no page to crawl
+BUNDLED_PREFIX = "offline/"
+
+logger = logging.getLogger(__name__)
 
+_entries = {}
+_failures = {}
+_refreshing = set()
+_lock = threading.Lock()
 
-@st.cache_data(show_spinner=False)
-def crawl_contents(url: str) -> str:
+
+def crawl_contents(url: str) -> BeautifulSoup:
     """Crawl contents from the given URL"""
     response = requests.get(url=url, timeout=5)
+    response.raise_for_status()
     contents = BeautifulSoup(response.content, "html.parser")
     return contents
 
 
-@st.cache_data(show_spinner=False)
-def crawl_prompt_list() -> Dict:
-    """Get a list of Claude prompt library"""
+def fetch_prompt_list() -> Dict:
+    """Crawl and parse the list of Claude prompt library"""
     contents = crawl_contents(f"{URL}/prompt-library").select(".examples-grid a")
     prompts = {}
     for prompt in contents:
@@ -27,12 +43,13 @@ def crawl_prompt_list() -> Dict:
         title = prompt.select_one(".icon-item-title").text
         description = prompt.select_one(".icon-item-desc").text.strip()
         prompts[title] = {"href": href, "description": description}
+    if not prompts:
+        raise ValueError("No prompts are found in the prompt library page.")
     return prompts
 
 
-@st.cache_data(show_spinner=False)
-def crawl_prompt(path: str) -> Dict:
-    """Get a prompt details"""
+def fetch_prompt(path: str) -> Dict:
+    """Crawl and parse a prompt details"""
     contents = crawl_contents(f"{URL}/{path}")
     prompt = {"system": "", "user": ""}
     system_prompt = contents.find("td", string="System")
@@ -42,3 +59,124 @@ def crawl_prompt(path: str) -> Dict:
     if user_prompt is not None:
         prompt["user"] = user_prompt.find_next("td").get_text()
     return prompt
+
+
+def load_snapshot() -> Dict:
+    """Load the bundled prompt library snapshot"""
+    with open(SNAPSHOT_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_snapshot() -> Dict:
+    """Crawl the whole prompt library into the bundled snapshot"""
+    prompts = fetch_prompt_list()
+    details = {prompt["href"]: fetch_prompt(prompt["href"]) for prompt in prompts.values()}
+    snapshot = {"prompts": prompts, "details": details}
+    with open(SNAPSHOT_PATH, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=2)
+    return snapshot
+
+
+def cache_path(key: str) -> str:
+    """Get the disk cache file of the key"""
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(constants.PROMPT_CACHE_LOCATION, f"{digest}.json")
+
+
+def load_entry(key: str):
+    """Load cached entry from memory or disk, None if it is not cached"""
+    with _lock:
+        if key in _entries:
+            return _entries[key]
+    try:
+        with open(cache_path(key), encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    with _lock:
+        _entries[key] = entry
+    return entry
+
+
+def save_entry(key: str, data: Dict):
+    """Save entry to memory and disk"""
+    entry = {"fetched_at": time.time(), "data": data}
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(f"{path}.tmp", path)
+    with _lock:
+        _entries[key] = entry
+
+
+def refresh(key: str, fetch):
+    """Fetch and cache the entry, keep the stale one on failure"""
+    try:
+        save_entry(key, fetch())
+        with _lock:
+            _failures.pop(key, None)
+        logger.info(f"Refreshed prompt library cache for {key}.")
+    except Exception as err:
+        with _lock:
+            _failures[key] = time.time()
+        logger.warning(f"Failed to refresh prompt library cache for {key}: {err}")
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def refresh_in_background(key: str, fetch):
+    """Start refreshing the entry unless it is being refreshed"""
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    threading.Thread(target=refresh, args=(key, fetch), daemon=True).start()
+
+
+def get_cached(key: str, fetch, fallback) -> Dict:
+    """Get entry from cache, serve stale while revalidating, fall back when offline"""
+    if constants.PROMPT_LIBRARY_OFFLINE:
+        return fallback()
+    entry = load_entry(key)
+    with _lock:
+        failed_at = _failures.get(key)
+    can_retry = (
+        failed_at is None or time.time() - failed_at > constants.PROMPT_RETRY_INTERVAL
+    )
+    if entry is None:
+        if failed_at is not None:
+            if can_retry:
+                refresh_in_background(key, fetch)
+            return fallback()
+        try:
+            data = fetch()
+        except Exception as err:
+            with _lock:
+                _failures[key] = time.time()
+            logger.warning(f"Failed to crawl {key}, use bundled snapshot: {err}")
+            return fallback()
+        save_entry(key, data)
+        return data
+    if time.time() - entry["fetched_at"] > constants.PROMPT_CACHE_TTL and can_retry:
+        refresh_in_background(key, fetch)
+    return entry["data"]
+
+
+def crawl_prompt_list() -> Dict:
+    """Get a list of Claude prompt library"""
+    return get_cached(
+        "prompt-library", fetch_prompt_list, lambda: load_snapshot()["prompts"]
+    )
+
+
+def crawl_prompt(path: str) -> Dict:
+    """Get a prompt details, bundled prompts are served from the snapshot"""
+    if path.startswith(BUNDLED_PREFIX):
+        return load_snapshot()["details"].get(path, {"system": "", "user": ""})
+    return get_cached(
+        path,
+        lambda: fetch_prompt(path),
+        lambda: load_snapshot()["details"].get(path, {"system": "", "user": ""}),
+    )
@@ -0,0 +1,249 @@
+"""Reconcile the library files on disk with the vector store"""
+
+import re
+import time
+import logging
+import threading
+
+from lib import constants
+from lib import file_store
+from lib import ingest
+from lib import keyword_index
+from lib import library_index
+from lib import metrics
+from lib import migration
+from lib import namespaces
+from lib import thumbnails
+from lib import utils
+from lib import vector_store
+
+logger = logging.getLogger(__name__)
+
+CONTENT_ID_PATTERN = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+
+_run_lock = threading.Lock()
+_reports = {}
+
+
+def is_changed(entry, metadata):
+    """Check if the file changed after it was embedded
+
+    Files are compared by the mtime recorded with the vector, or the embed
+    time for vectors of earlier versions, and only files modified since are
+    read. Content addressed files changed when their bytes no longer match
+    the hash in their name.
+    """
+    if "file_mtime" in metadata:
+        if entry["mtime"] == metadata["file_mtime"]:
+            return False
+    elif entry["mtime"] <= metadata.get("added_at", entry["mtime"]) + 1:
+        return False
+    if not CONTENT_ID_PATTERN.match(entry["name"]):
+        return True
+    try:
+        with open(entry["path"], "rb") as f:
+            image_id = file_store.content_id(f.read(), entry["name"])
+    except OSError:
+        return False
+    return image_id != entry["name"]
+
+
+def plan(namespace=None):
+    """Compare the files on disk with the vectors of the namespace
+
+    The library index is reconciled with the disk first, by size and mtime,
+    then vectors are listed once. Returns {"index", "files", "vectors",
+    "missing", "changed", "previous", "moved", "touched", "orphaned"}, where
+    missing and changed are library entries to embed, previous is {image_id:
+    metadata} of the changed ones, moved and touched are {image_id:
+    metadata} to update with the new path or mtime and orphaned are ids of
+    vectors without a file.
+    """
+    namespace = namespaces.get(namespace)
+    index = library_index.get_index(
+        namespace.library_index_path, namespace.file_location
+    )
+    index_report = index.reconcile()
+    on_disk = {entry["name"]: entry for entry in index.list()}
+    store = vector_store.collection_store(namespace.collection)
+    vectors = migration.list_items(store)
+    # Files written moments ago may still be waiting for their batch upsert
+    settled = time.time() - constants.RECONCILE_GRACE_SECONDS
+    missing = [
+        entry
+        for image_id, entry in on_disk.items()
+        if image_id not in vectors and entry["mtime"] < settled
+    ]
+    changed = []
+    previous = {}
+    moved = {}
+    touched = {}
+    for image_id, metadata in vectors.items():
+        entry = on_disk.get(image_id)
+        if entry is None:
+            continue
+        if is_changed(entry, metadata):
+            changed.append(entry)
+            previous[image_id] = metadata
+        elif metadata.get("file_path") != entry["path"]:
+            moved[image_id] = {
+                **metadata,
+                "file_path": entry["path"],
+                "file_mtime": entry["mtime"],
+            }
+        elif metadata.get("file_mtime") != entry["mtime"]:
+            touched[image_id] = {**metadata, "file_mtime": entry["mtime"]}
+    return {
+        "index": index_report,
+        "files": len(on_disk),
+        "vectors": len(vectors),
+        "missing": missing,
+        "changed": changed,
+        "previous": previous,
+        "moved": moved,
+        "touched": touched,
+        "orphaned": [image_id for image_id in vectors if image_id not in on_disk],
+    }
+
+
+def read_records(entries, previous):
+    """Yield (id, image bytes, metadata) records of library entries to embed
+
+    Name and added time of changed images are kept, their captions are
+    dropped since they describe the old bytes.
+    """
+    for entry in entries:
+        try:
+            with open(entry["path"], "rb") as f:
+                image_bytes = f.read()
+        except OSError as err:
+            logger.warning(f"Skip {entry['name']}, failed to read image: {err}")
+            continue
+        metadata = previous.get(entry["name"], {})
+        yield entry["name"], image_bytes, {
+            "image_id": entry["name"],
+            "file_path": entry["path"],
+            "name": metadata.get("name") or entry["original_name"] or entry["name"],
+            "added_at": metadata.get("added_at") or int(entry["mtime"]),
+            "embedded_at": int(time.time()),
+            "file_mtime": entry["mtime"],
+        }
+
+
+def reconcile(
+    namespace=None, max_in_flight=constants.EMBED_MAX_IN_FLIGHT, dry_run=False
+):
+    """Embed files missing vectors, prune orphaned vectors, return the report
+
+    Vectors pointing to an old path of the file are repointed and files
+    changed after they were embedded are embedded again. With dry_run the
+    report counts what would be done without changing anything.
+    """
+    namespace = namespaces.get(namespace)
+    with _run_lock:
+        start = time.perf_counter()
+        found = plan(namespace)
+        report = {
+            "namespace": namespace.name,
+            "dry_run": dry_run,
+            "files": found["files"],
+            "vectors": found["vectors"],
+            "index": found["index"],
+            "missing": len(found["missing"]),
+            "changed": len(found["changed"]),
+            "moved": len(found["moved"]),
+            "touched": len(found["touched"]),
+            "orphaned": len(found["orphaned"]),
+            "embedded": 0,
+            "error": None,
+        }
+        if not dry_run:
+            try:
+                apply(namespace, found, max_in_flight, report)
+            except Exception as err:
+                logger.warning(f"Failed to reconcile namespace {namespace.name}: {err}")
+                report["error"] = str(err)
+        report["elapsed_seconds"] = round(time.perf_counter() - start, 2)
+        report["finished_at"] = int(time.time())
+        if not dry_run:
+            _reports[namespace.name] = report
+        logger.info(
+            f"Reconciled namespace {namespace.name}, {report['embedded']} embedded, "
+            f"{report['orphaned']} orphaned vectors, {report['moved']} moved."
+        )
+        return report
+
+
+def apply(namespace, found, max_in_flight, report):
+    """Apply the reconciliation plan, count embedded images in the report"""
+    store = vector_store.collection_store(namespace.collection)
+    keywords = keyword_index.get_index(namespace.keyword_index_path)
+    if found["orphaned"]:
+        store.delete(ids=found["orphaned"])
+        keywords.remove(found["orphaned"])
+        for image_id in found["orphaned"]:
+            thumbnails.delete_thumbnail(image_id, namespace.thumbnail_location)
+        metrics.count("reconciled_images", len(found["orphaned"]), action="pruned")
+    for action in ["moved", "touched"]:
+        if found[action]:
+            store.update(
+                ids=list(found[action]), metadatas=list(found[action].values())
+            )
+            metrics.count("reconciled_images", len(found[action]), action=action)
+    changed_ids = [entry["name"] for entry in found["changed"]]
+    if changed_ids:
+        # Deleted rather than overwritten, upserts keep the old caption keys
+        store.delete(ids=changed_ids)
+        keywords.remove(changed_ids)
+        for entry in found["changed"]:
+            thumbnails.delete_thumbnail(entry["path"], namespace.thumbnail_location)
+    entries = found["missing"] + found["changed"]
+    if not entries:
+        return
+    embedding_length = store.embedding_length
+
+    def on_batch(ids):
+        report["embedded"] += len(ids)
+        metrics.count("reconciled_images", len(ids), action="embedded")
+
+    ingest.run_ingestion(
+        read_records(entries, found["previous"]),
+        embed=lambda image_bytes: utils.embed_image(image_bytes, embedding_length),
+        upsert=lambda ids, embeddings, metadatas: utils.upsert_embedding_to_chroma(
+            ids, embeddings, metadatas, namespace
+        ),
+        max_in_flight=max_in_flight,
+        on_batch=on_batch,
+    )
+
+
+def last_reports():
+    """Get the report of the last reconciliation of every namespace"""
+    return dict(_reports)
+
+
+def reconcile_periodically():
+    """Reconcile every namespace now and every RECONCILE_INTERVAL seconds"""
+    while True:
+        for name in namespaces.list_names():
+            try:
+                reconcile(name)
+            except Exception as err:
+                logger.warning(f"Failed to reconcile namespace {name}: {err}")
+        time.sleep(constants.RECONCILE_INTERVAL)
+
+
+_scheduler = {"started": False}
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler():
+    """Start the background reconciliation once per process"""
+    if not constants.RECONCILE_INTERVAL:
+        return
+    with _scheduler_lock:
+        if _scheduler["started"]:
+            return
+        _scheduler["started"] = True
+    threading.Thread(target=reconcile_periodically, daemon=True).start()
+    logger.info(f"Reconciling the library every {constants.RECONCILE_INTERVAL} seconds.")
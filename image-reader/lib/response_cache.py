@@ -0,0 +1,180 @@
+"""Persistent cache of Claude 3 responses keyed by request content hashes"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from lib import constants
+
+logger = logging.getLogger(__name__)
+
+
+def digest(content):
+    """Get the SHA-256 hex digest of bytes or text"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def request_key(model_id, system, images, query):
+    """Build cache key from the model, prompt hashes and raw image content hashes
+
+    Settings that change the request body once images are downscaled are part
+    of the key, so a settings change is a miss rather than a stale answer.
+    """
+    request = {
+        "model_id": model_id,
+        "anthropic_version": constants.ANTHROPIC_VERSION,
+        "max_tokens": constants.MAX_TOKENS,
+        "temperature": constants.TEMPERATURE,
+        "image_settings": [
+            constants.CLAUDE_IMAGE_MAX_EDGE,
+            constants.CLAUDE_IMAGE_MAX_PIXELS,
+            constants.CLAUDE_IMAGE_QUALITY,
+            constants.CLAUDE_IMAGE_REENCODE_MIN_BYTES,
+        ],
+        "system": digest(system or ""),
+        "query": digest(query or ""),
+        "images": [digest(image.getvalue()) for image in images or [] if image],
+    }
+    return digest(json.dumps(request, sort_keys=True))
+
+
+def is_cacheable():
+    """Only greedy decoding gives the same answer to the same request"""
+    return constants.TEMPERATURE == 0
+
+
+class ResponseCache:
+    """SQLite backed response cache with TTL and least recently used size eviction
+
+    Entries keep the text deltas of the stream, the image summary and the
+    metrics record of the original response, so hits replay the same stream.
+    """
+
+    def __init__(
+        self,
+        path,
+        ttl=constants.RESPONSE_CACHE_TTL,
+        max_bytes=constants.RESPONSE_CACHE_MAX_BYTES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, model_id TEXT NOT NULL, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        self._connection.commit()
+
+    def get(self, key):
+        """Get {"deltas", "image_summary", "record", "created_at"} by key
+
+        Returns None if it is not cached or older than the TTL.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+        return {**json.loads(row[0]), "created_at": row[1]}
+
+    def put(self, key, model_id, deltas, image_summary, record):
+        """Store a complete response, evict expired and least recently used entries"""
+        response = json.dumps(
+            {"deltas": deltas, "image_summary": image_summary, "record": record}
+        )
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, model_id, response, size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_id, response, len(response), now, now),
+            )
+            expired = self._connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)
+            ).rowcount
+            evicted = 0
+            total = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._connection.execute(
+                    "SELECT key, size FROM responses ORDER BY last_used"
+                ).fetchall()
+                victims = []
+                for victim, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    victims.append((victim,))
+                    total -= size
+                self._connection.executemany(
+                    "DELETE FROM responses WHERE key = ?", victims
+                )
+                evicted = len(victims)
+            self._connection.commit()
+        if expired or evicted:
+            logger.info(
+                f"Evicted {expired} expired and {evicted} least recently used "
+                "cached responses."
+            )
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+    def stats(self):
+        """Get cache hit and miss counters and the stored size"""
+        with self._lock:
+            size, stored_bytes = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": size,
+            "bytes": stored_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Get the process wide response cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.path != constants.RESPONSE_CACHE_PATH:
+            _cache = ResponseCache(constants.RESPONSE_CACHE_PATH)
+        return _cache
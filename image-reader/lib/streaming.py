@@ -0,0 +1,232 @@
+"""Render Claude 3 response streams incrementally and record their latency"""
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+
+from lib import constants
+
+logger = logging.getLogger(__name__)
+
+_log_lock = threading.Lock()
+
+
+def coalesce(
+    deltas,
+    interval=constants.STREAM_FLUSH_INTERVAL,
+    max_chars=constants.STREAM_FLUSH_CHARS,
+):
+    """Join deltas into chunks, flushed once the time or size budget is spent"""
+    buffer = []
+    size = 0
+    flushed_at = time.monotonic()
+    for delta in deltas:
+        buffer.append(delta)
+        size += len(delta)
+        now = time.monotonic()
+        if size >= max_chars or now - flushed_at >= interval:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+            flushed_at = now
+    if buffer:
+        yield "".join(buffer)
+
+
+class StreamRenderer:
+    """Append streamed markdown to a container without re-rendering finished paragraphs
+
+    Paragraphs closed by a blank line outside a code fence are frozen into
+    their own element, only the open paragraph is re-rendered on each chunk.
+    """
+
+    def __init__(self, container):
+        self.container = container
+        self.text = ""
+        self._frozen = 0
+        self._tail = None
+
+    def append(self, chunk):
+        """Render the chunk"""
+        self.text += chunk
+        split = self.text.rfind("\n\n", self._frozen)
+        if split != -1 and self.text.count("```", 0, split) % 2 == 0:
+            if self._tail is None:
+                self._tail = self.container.empty()
+            self._tail.markdown(escape(self.text[self._frozen : split]))
+            self._frozen = split + 2
+            self._tail = None
+        if self._tail is None:
+            self._tail = self.container.empty()
+        self._tail.markdown(escape(self.text[self._frozen :]))
+
+    def render(self, chunks):
+        """Render every chunk, return the whole text"""
+        for chunk in chunks:
+            self.append(chunk)
+        return self.text
+
+
+def merge_streams(streams):
+    """Consume every stream in its own thread, yield (name, item) as items arrive
+
+    A failing stream yields (name, exception) and stops, the others go on.
+    """
+    events = queue.Queue()
+    done = object()
+
+    def consume(name, stream):
+        try:
+            for item in stream:
+                events.put((name, item))
+        except Exception as err:
+            logger.warning(f"Stream {name} failed: {err}")
+            events.put((name, err))
+        finally:
+            events.put((name, done))
+
+    for name, stream in streams.items():
+        threading.Thread(target=consume, args=(name, stream), daemon=True).start()
+    running = len(streams)
+    while running:
+        name, item = events.get()
+        if item is done:
+            running -= 1
+        else:
+            yield name, item
+
+
+def render_side_by_side(containers, events):
+    """Render merged (name, text or exception) events into the container of each name"""
+    renderers = {name: StreamRenderer(container) for name, container in containers.items()}
+    for name, item in events:
+        if isinstance(item, Exception):
+            containers[name].error(f"{name} failed: {item}")
+        else:
+            renderers[name].append(item)
+    return {name: renderer.text for name, renderer in renderers.items()}
+
+
+def summary_rows(records):
+    """Order metrics records by total latency for a comparison table"""
+    columns = [
+        "model_id",
+        "total_latency_ms",
+        "time_to_first_token_ms",
+        "invocation_latency_ms",
+        "first_byte_latency_ms",
+        "input_tokens",
+        "output_tokens",
+        "tokens_per_sec",
+    ]
+    return [
+        {
+            **{column: record[column] for column in columns},
+            "cached": record.get("cached", False),
+        }
+        for record in sorted(records, key=lambda record: record["total_latency_ms"])
+    ]
+
+
+def escape(text):
+    """Keep dollar signs from being rendered as LaTeX"""
+    return text.replace("$", "\\$")
+
+
+class StreamMetrics:
+    """Client side latency of one streamed response"""
+
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._first_token = None
+        self._end = None
+        self.deltas = 0
+
+    def token(self):
+        """Record one content delta"""
+        if self._first_token is None:
+            self._first_token = time.perf_counter()
+        self.deltas += 1
+
+    def finish(self, invocation_metrics):
+        """Close the response with Bedrock invocation metrics, return the summary"""
+        self._end = time.perf_counter()
+        first_token = self._first_token or self._end
+        output_tokens = invocation_metrics.get("outputTokenCount", self.deltas)
+        generation_seconds = self._end - first_token
+        return {
+            "timestamp": self.started_at,
+            "model_id": self.model_id,
+            "time_to_first_token_ms": round((first_token - self._start) * 1000),
+            "total_latency_ms": round((self._end - self._start) * 1000),
+            "tokens_per_sec": (
+                round(output_tokens / generation_seconds, 1)
+                if generation_seconds > 0
+                else None
+            ),
+            "input_tokens": invocation_metrics.get("inputTokenCount"),
+            "output_tokens": output_tokens,
+            "invocation_latency_ms": invocation_metrics.get("invocationLatency"),
+            "first_byte_latency_ms": invocation_metrics.get("firstByteLatency"),
+        }
+
+
+def log_metrics(record, path=None, max_bytes=None):
+    """Append the record to the stream metrics log as a JSON line
+
+    Once the log reaches max_bytes it replaces the previous log at path.1,
+    so at most twice max_bytes are kept.
+    """
+    path = path or constants.STREAM_METRICS_LOG_PATH
+    max_bytes = max_bytes or constants.STREAM_METRICS_LOG_MAX_BYTES
+    try:
+        with _log_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+                rotate = f.tell() >= max_bytes
+            if rotate:
+                os.replace(path, f"{path}.1")
+    except OSError as err:
+        logger.warning(f"Failed to log stream metrics: {err}")
+
+
+def tail_lines(path, limit=None, block_size=64 * 1024):
+    """Read the last limit non empty lines of the file, reading back from the end"""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        data = b""
+        while end > 0 and (limit is None or data.count(b"\n") <= limit):
+            start = max(0, end - block_size)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+    lines = data.decode("utf-8").splitlines()
+    if end > 0:
+        # The first line may be cut by the block boundary
+        lines = lines[1:]
+    lines = [line for line in lines if line.strip()]
+    return lines if limit is None else lines[max(0, len(lines) - limit) :]
+
+
+def load_metrics(path=None, limit=None):
+    """Load the stream metrics log, only the last limit records when given
+
+    Only the tail of the log is read, the previous log too when the current
+    one holds fewer records.
+    """
+    path = path or constants.STREAM_METRICS_LOG_PATH
+    with _log_lock:
+        lines = tail_lines(path, limit)
+        if limit is None or len(lines) < limit:
+            previous = tail_lines(
+                f"{path}.1", None if limit is None else limit - len(lines)
+            )
+            lines = previous + lines
+    return [json.loads(line) for line in lines]
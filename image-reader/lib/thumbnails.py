@@ -0,0 +1,51 @@
+"""Downscaled image derivatives for library grids"""
+
+import io
+import os
+import logging
+
+from PIL import Image
+from PIL import ImageOps
+
+from lib import constants
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_path(image_path, location=None):
+    """Get the thumbnail path of the library image"""
+    image_name = os.path.basename(image_path)
+    return os.path.join(location or constants.THUMBNAIL_LOCATION, f"{image_name}.jpg")
+
+
+def create_thumbnail(image_bytes, image_path, location=None):
+    """Create thumbnail from the image bytes, rotated upright by its EXIF orientation"""
+    path = thumbnail_path(image_path, location)
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.draft("RGB", constants.THUMBNAIL_SIZE)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(constants.THUMBNAIL_SIZE)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(path, format="JPEG", quality=constants.THUMBNAIL_QUALITY)
+    return path
+
+
+def get_thumbnail(image_path, location=None):
+    """Get thumbnail of the library image, create it if missing, fall back to the original"""
+    path = thumbnail_path(image_path, location)
+    if os.path.exists(path):
+        return path
+    try:
+        with open(image_path, "rb") as f:
+            return create_thumbnail(f.read(), image_path, location)
+    except Exception as err:
+        logger.warning(f"Failed to create thumbnail for {image_path}: {err}")
+        return image_path
+
+
+def delete_thumbnail(image_path, location=None):
+    """Delete thumbnail of the library image"""
+    path = thumbnail_path(image_path, location)
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,20 +1,33 @@
 """Image Helper"""
 
 import os
-import uuid
 import json
+import time
 import base64
 import logging
-import mimetypes
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import streamlit as st
-import chromadb
+from streamlit import runtime
 from botocore.config import Config
-from chromadb.utils.embedding_functions import AmazonBedrockEmbeddingFunction
-from jinja2.nativetypes import NativeEnvironment
 
 from lib import constants
+from lib import ingest
+from lib import embedding_cache
+from lib import vector_store
+from lib import thumbnails
+from lib import library_index
+from lib import file_store
+from lib import image_processing
+from lib import message_builder
+from lib import generation
+from lib import streaming
+from lib import metrics
+from lib import keyword_index
+from lib import namespaces
+from lib import response_cache
 
 boto3.set_stream_logger(name="botocore.credentials", level=logging.ERROR)
 
@@ -29,90 +42,161 @@ bedrock_runtime = session.client(
 
 accept = "application/json"
 content_type = "application/json"
+footer_separator = "\n\n----------------\n"
 
 
-def setup_storage():
-    """Setup local storage"""
+def setup_storage(namespace=None):
+    """Setup local storage of the default and the given namespace"""
+    namespace = namespaces.get(namespace)
     for data_storage in [
         constants.DATA_LOCATION,
         constants.VECTOR_LOCATION,
         constants.FILE_LOCATION,
+        constants.THUMBNAIL_LOCATION,
         constants.TEMP_LOCATION,
+        constants.CACHE_LOCATION,
+        constants.PROMPT_CACHE_LOCATION,
+        constants.GENERATION_CACHE_LOCATION,
+        constants.METRICS_LOCATION,
     ]:
         if not os.path.exists(data_storage):
             os.mkdir(data_storage)
+    namespace.setup()
+    vector_store.warm_up(namespace.collection)
+    if runtime.exists():
+        from lib import reconciler
 
+        metrics.start_exporter()
+        reconciler.start_scheduler()
 
-@st.cache_data(show_spinner=False)
-def format_content_for_claude3(base64_encoded_images, query):
-    """Format content per claude 3 message format"""
-    content = []
-    template_image_id = '{"type": "text", "text": "Image {{image_id}}:"}'
-    template_image = '{"type": "image", "source": {"type": "base64","media_type": "image/jpeg","data": "{{image}}"} }'
-    if base64_encoded_images:
-        for idx, image in enumerate(base64_encoded_images):
-            if len(base64_encoded_images) > 1:
-                image_id = (
-                    NativeEnvironment()
-                    .from_string(template_image_id)
-                    .render(image_id=idx + 1)
-                )
 
-                content.append(image_id)
-            image_content = (
-                NativeEnvironment().from_string(template_image).render(image=image)
-            )
-            content.append(image_content)
-    content.append(
-        {
-            "type": "text",
-            "text": query,
-        }
+def list_namespaces():
+    """Get the names of the library namespaces"""
+    return namespaces.list_names()
+
+
+def create_namespace():
+    """Create the namespace named in the sidebar and select it"""
+    name = st.session_state.get("new_library_namespace", "").strip()
+    if not name:
+        return
+    try:
+        setup_storage(name)
+    except ValueError as err:
+        st.session_state["new_library_namespace_error"] = str(err)
+    else:
+        st.session_state["library_namespace"] = name
+        st.session_state.pop("new_library_namespace_error", None)
+
+
+def select_namespace():
+    """Pick the library namespace in the sidebar, create new ones on demand
+
+    The choice is kept in the session so every page opens the same library.
+    """
+    names = namespaces.list_names()
+    current = st.session_state.get("library_namespace")
+    if current not in names:
+        current = constants.DEFAULT_NAMESPACE
+    name = st.sidebar.selectbox(
+        "Library namespace:", options=names, index=names.index(current)
     )
-    return content
+    st.session_state["library_namespace"] = name
+    with st.sidebar.expander("New namespace"):
+        st.text_input("Name:", key="new_library_namespace")
+        st.button("Create", on_click=create_namespace)
+        if "new_library_namespace_error" in st.session_state:
+            st.error(st.session_state.pop("new_library_namespace_error"))
+    setup_storage(name)
+    return name
 
 
-def send_content_to_claude3_with_response_stream(
-    model_id, system, base64_encoded_images, query
-):
-    """Send payload to bedrock claude 3 with response stream"""
-    content = format_content_for_claude3(base64_encoded_images, query)
+def format_content_for_claude3(images, query, media_types=None):
+    """Format content per claude 3 message format, images are raw bytes or base64 strings"""
+    return message_builder.build_content(images, query, media_types)
+
+
+def invoke_claude3_with_response_stream(model_id, body):
+    """Send serialized request body to bedrock claude 3 with response stream"""
     try:
-        response = bedrock_runtime.invoke_model_with_response_stream(
-            modelId=model_id,
-            accept=accept,
-            contentType=content_type,
-            body=json.dumps(
-                {
-                    "anthropic_version": constants.ANTHROPIC_VERSION,
-                    "max_tokens": constants.MAX_TOKENS,
-                    "temperature": constants.TEMPERATURE,
-                    "system": system,
-                    "messages": [{"role": "user", "content": content}],
-                }
-            ),
-        )
+        with metrics.timer(
+            "bedrock", model_id=model_id, operation="invoke_model_with_response_stream"
+        ):
+            response = bedrock_runtime.invoke_model_with_response_stream(
+                modelId=model_id,
+                accept=accept,
+                contentType=content_type,
+                body=body,
+            )
         response_body = response.get("body")
     except Exception as err:
         raise
     return response_body
 
 
-def read_images_with_response_stream(model_id, system, images, query):
-    """Describe the content of image with response stream"""
-    base64_encoded_images = []
+def send_content_to_claude3_with_response_stream(
+    model_id, system, images, query, media_types=None
+):
+    """Send payload to bedrock claude 3 with response stream"""
+    content = format_content_for_claude3(images, query, media_types)
+    return invoke_claude3_with_response_stream(
+        model_id, message_builder.build_request_body(system, content)
+    )
+
+
+def prepare_images_for_claude3(images):
+    """Downscale and base64 encode images once
+
+    Returns (encoded_images, media_types, image_summary) where image_summary
+    is the image part of the response footer.
+    """
+    encoded_images = []
+    media_types = []
     images_size = ""
-    model = ""
+    images_saving = ""
     if not images or images == [None]:
         images_size = "0, "
     else:
+        saved_bytes = 0
         for image in images:
-            base64_encoded_image = base64.b64encode(image.getvalue()).decode("utf-8")
-            base64_encoded_images.append(base64_encoded_image)
-            images_size += f"{image.size // 1024} KB, "
-    response = send_content_to_claude3_with_response_stream(
-        model_id, system, base64_encoded_images, query
+            with metrics.timer("image_preprocess"):
+                image_bytes, media_type, stats = image_processing.prepare_image_for_claude(
+                    image.getvalue()
+                )
+            with metrics.timer("base64", operation="encode"):
+                encoded_images.append(message_builder.encode_image(image_bytes))
+            media_types.append(media_type)
+            images_size += f"{stats['bytes'] // 1024} KB, "
+            saved_bytes += stats["original_bytes"] - stats["bytes"]
+        images_saving = f"Preprocessing Saved: {saved_bytes // 1024} KB, "
+    return encoded_images, media_types, f"Image Size: {images_size}{images_saving}"
+
+
+def format_footer(image_summary, model, record, cached=""):
+    """Format the metrics footer of a response, cached prefixes replayed ones"""
+    return (
+        f"{footer_separator}"
+        f"*{cached}{image_summary}"
+        f"Model: {model}, Input Tokens: {record['input_tokens']}, Output Tokens: {record['output_tokens']}, "
+        f"Invocation Latency: {record['invocation_latency_ms']} ms, First Byte Latency: {record['first_byte_latency_ms']} ms, "
+        f"Time To First Token: {record['time_to_first_token_ms']} ms, Tokens/sec: {record['tokens_per_sec']}, "
+        f"Total Latency: {record['total_latency_ms']} ms.*"
     )
+
+
+def stream_claude3_response(
+    model_id, body, image_summary="", on_finish=None, cache_key=None
+):
+    """Yield "message_start", text deltas and a metrics footer of one response
+
+    Client side latency is appended to the footer and the stream metrics log,
+    on_finish is called with the metrics record. Complete responses are
+    stored in the response cache under cache_key when it is given.
+    """
+    model = ""
+    deltas = []
+    stream_metrics = streaming.StreamMetrics(model_id)
+    response = invoke_claude3_with_response_stream(model_id, body)
     if response:
         for event in response:
             chunk = event.get("chunk")
@@ -122,22 +206,233 @@ def read_images_with_response_stream(model_id, system, images, query):
                     model = data["message"]["model"]
                     yield ("message_start")
                 if data["type"] == "content_block_delta":
-                    yield (data.get("delta", {}).get("text", ""))
+                    stream_metrics.token()
+                    delta = data.get("delta", {}).get("text", "")
+                    deltas.append(delta)
+                    yield (delta)
                 if data["type"] == "message_stop":
-                    metrics = data["amazon-bedrock-invocationMetrics"]
-                    yield (
-                        f"\n\n----------------\n"
-                        f"*Image Size: {images_size}"
-                        f"Model: {model}, Input Tokens: {metrics['inputTokenCount']}, Output Tokens: {metrics['outputTokenCount']}, "
-                        f"Invocation Latency: {metrics['invocationLatency']} ms, First Byte Latency: {metrics['firstByteLatency']} ms.*"
+                    record = stream_metrics.finish(
+                        data["amazon-bedrock-invocationMetrics"]
                     )
+                    streaming.log_metrics(record)
+                    record_stream_metrics(record)
+                    if cache_key is not None:
+                        response_cache.get_cache().put(
+                            cache_key,
+                            model_id,
+                            deltas,
+                            image_summary,
+                            {**record, "model": model},
+                        )
+                    if on_finish is not None:
+                        on_finish(record)
+                    yield format_footer(image_summary, model, record)
+
+
+def get_cached_response(model_id, system, images, query, use_cache=True):
+    """Look up the response cache, return (cache key, cached entry or None)
+
+    The key is None when responses are not cacheable. use_cache=False
+    bypasses the lookup, the fresh response still refreshes the entry.
+    """
+    if not response_cache.is_cacheable():
+        return None, None
+    key = response_cache.request_key(model_id, system, images, query)
+    if not use_cache:
+        metrics.count("response_cache_lookups", model_id=model_id, result="bypass")
+        return key, None
+    with metrics.timer("response_cache", operation="get"):
+        entry = response_cache.get_cache().get(key)
+    metrics.count(
+        "response_cache_lookups",
+        model_id=model_id,
+        result="miss" if entry is None else "hit",
+    )
+    return key, entry
+
+
+def replay_cached_response(entry, on_finish=None):
+    """Yield "message_start", text deltas and footer of a cached response
+
+    The footer keeps the metrics of the original response, marked as cached.
+    """
+    record = {**entry["record"], "cached": True}
+    model = record.pop("model", "")
+    yield ("message_start")
+    yield from entry["deltas"]
+    if on_finish is not None:
+        on_finish(record)
+    cached_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["created_at"]))
+    yield format_footer(
+        entry["image_summary"],
+        model,
+        record,
+        cached=f"Cached response from {cached_at}, original metrics. ",
+    )
+
+
+def strip_response_footer(text):
+    """Get the response text without the metrics footer"""
+    return text.split(footer_separator)[0].strip()
+
+
+def record_stream_metrics(record):
+    """Export client side latency and token counts of a streamed response"""
+    model_id = record["model_id"]
+    metrics.observe(
+        "stream_time_to_first_token_seconds",
+        record["time_to_first_token_ms"] / 1000,
+        model_id=model_id,
+    )
+    metrics.observe(
+        "stream_total_seconds", record["total_latency_ms"] / 1000, model_id=model_id
+    )
+    metrics.count("input_tokens", record["input_tokens"] or 0, model_id=model_id)
+    metrics.count("output_tokens", record["output_tokens"] or 0, model_id=model_id)
+
+
+def read_images_with_response_stream(model_id, system, images, query, use_cache=True):
+    """Describe the content of image with response stream
+
+    Identical requests are replayed from the response cache without calling
+    bedrock or preprocessing the images, use_cache=False bypasses it.
+    """
+    cache_key, cached = get_cached_response(model_id, system, images, query, use_cache)
+    if cached is not None:
+        yield from replay_cached_response(cached)
+        return
+    encoded_images, media_types, image_summary = prepare_images_for_claude3(images)
+    content = format_content_for_claude3(encoded_images, query, media_types)
+    body = message_builder.build_request_body(system, content)
+    yield from stream_claude3_response(
+        model_id, body, image_summary, cache_key=cache_key
+    )
 
 
-@st.cache_data(show_spinner=False)
-def format_content_for_titan_mm_embed(base64_encoded_image=None, text_input=None):
+def compare_models_with_response_stream(
+    model_ids, system, images, query, on_finish=None, use_cache=True
+):
+    """Stream the same request to several models concurrently
+
+    Images are encoded and the request body is built once for the models
+    missing in the response cache, cached models are replayed. Yields
+    (model_id, text) as each model produces coalesced text, or
+    (model_id, exception) when a model fails.
+    """
+    lookups = {
+        model_id: get_cached_response(model_id, system, images, query, use_cache)
+        for model_id in model_ids
+    }
+    body = None
+    if any(cached is None for _, cached in lookups.values()):
+        encoded_images, media_types, image_summary = prepare_images_for_claude3(images)
+        content = format_content_for_claude3(encoded_images, query, media_types)
+        body = message_builder.build_request_body(system, content)
+    streams = {}
+    for model_id, (cache_key, cached) in lookups.items():
+        if cached is not None:
+            tokens = replay_cached_response(cached, on_finish)
+        else:
+            tokens = stream_claude3_response(
+                model_id, body, image_summary, on_finish, cache_key
+            )
+        streams[model_id] = streaming.coalesce(
+            token for token in tokens if token != "message_start"
+        )
+    return streaming.merge_streams(streams)
+
+
+def invoke_claude3(model_id, body):
+    """Send serialized request body to bedrock claude 3, return the response message"""
+    with metrics.timer("bedrock", model_id=model_id, operation="invoke_model"):
+        response = bedrock_runtime.invoke_model(
+            modelId=model_id,
+            accept=accept,
+            contentType=content_type,
+            body=body,
+        )
+    return json.loads(response.get("body").read())
+
+
+def count_message_tokens(model_id, message):
+    """Export token counts of a claude 3 response message"""
+    metrics.count("input_tokens", message["usage"]["input_tokens"], model_id=model_id)
+    metrics.count("output_tokens", message["usage"]["output_tokens"], model_id=model_id)
+
+
+def parse_caption(text):
+    """Get {"caption", "tags"} from a JSON reply, fall back to the whole text as caption"""
+    try:
+        description = json.loads(text[text.index("{") : text.rindex("}") + 1])
+        return {
+            "caption": str(description.get("caption", "")).strip(),
+            "tags": [str(tag).strip() for tag in description.get("tags", []) if tag],
+        }
+    except ValueError:
+        return {"caption": text.strip(), "tags": []}
+
+
+def generate_caption(image_bytes, model_id=None):
+    """Caption and tag an image with claude 3, return {"caption", "tags"}"""
+    model_id = model_id or constants.CAPTION_MODEL_ID
+    with metrics.timer("image_preprocess"):
+        image_bytes, media_type, _ = image_processing.prepare_image_for_claude(
+            image_bytes
+        )
+    content = format_content_for_claude3(
+        [image_bytes], constants.CAPTION_PROMPT, [media_type]
+    )
+    body = json.loads(message_builder.build_request_body("", content))
+    body["max_tokens"] = constants.CAPTION_MAX_TOKENS
+    message = invoke_claude3(model_id, json.dumps(body))
+    count_message_tokens(model_id, message)
+    text = "".join(
+        block.get("text", "") for block in message["content"] if block["type"] == "text"
+    )
+    return parse_caption(text)
+
+
+def caption_metadata(description):
+    """Convert {"caption", "tags"} to vector metadata, tags joined as chroma takes scalars only"""
+    return {
+        "caption": description["caption"],
+        "tags": ", ".join(description.get("tags", [])),
+        "captioned": True,
+    }
+
+
+def store_descriptions(descriptions, namespace=None):
+    """Save {image_id: {"caption", "tags", "text"}} to vector metadata and the keyword index"""
+    namespace = namespaces.get(namespace)
+    found = vector_store.get(ids=list(descriptions), collection=namespace.collection)
+    ids = []
+    metadatas = []
+    index = keyword_index.get_index(namespace.keyword_index_path)
+    for image_id, metadata in zip(found["ids"], found["metadatas"]):
+        description = descriptions[image_id]
+        ids.append(image_id)
+        metadatas.append({**metadata, **caption_metadata(description)})
+        index.add(
+            image_id,
+            description["caption"],
+            description.get("tags", []),
+            description.get("text", ""),
+        )
+    if ids:
+        vector_store.update(
+            ids=ids, metadatas=metadatas, collection=namespace.collection
+        )
+
+
+def format_content_for_titan_mm_embed(
+    base64_encoded_image=None, text_input=None, embedding_length=None
+):
     """Format body for Tian multimodal embedding"""
     body = {
-        "embeddingConfig": {"outputEmbeddingLength": constants.OUTPUT_EMBEDDING_LENGTH}
+        "embeddingConfig": {
+            "outputEmbeddingLength": embedding_length
+            or constants.OUTPUT_EMBEDDING_LENGTH
+        }
     }
     if base64_encoded_image is not None:
         body["inputImage"] = base64_encoded_image
@@ -149,101 +444,475 @@ def format_content_for_titan_mm_embed(base64_encoded_image=None, text_input=None
 def generate_embeddings(body):
     """Generate embeding"""
     try:
-        response = bedrock_runtime.invoke_model(
-            body=body,
-            modelId=constants.MM_EMBED_MODEL,
-            accept=accept,
-            contentType=content_type,
-        )
+        with metrics.timer(
+            "bedrock", model_id=constants.MM_EMBED_MODEL, operation="invoke_model"
+        ):
+            response = bedrock_runtime.invoke_model(
+                body=body,
+                modelId=constants.MM_EMBED_MODEL,
+                accept=accept,
+                contentType=content_type,
+            )
         response_body = json.loads(response.get("body").read())
     except Exception as err:
         raise
     return response_body
 
 
-def upsert_embedding_to_chroma(ids, embeddings, metadatas):
-    """Add or update embedding to chroma"""
-    client = chromadb.PersistentClient(constants.VECTOR_LOCATION)
-    collection = client.get_or_create_collection(name=constants.COLLECTION_NAME)
-    collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+def upsert_embedding_to_chroma(ids, embeddings, metadatas, namespace=None):
+    """Add or update embedding to chroma, index captions and tags for keyword search"""
+    namespace = namespaces.get(namespace)
+    vector_store.upsert(
+        ids=ids,
+        embeddings=embeddings,
+        metadatas=metadatas,
+        collection=namespace.collection,
+    )
+    index = keyword_index.get_index(namespace.keyword_index_path)
+    for image_id, metadata in zip(ids, metadatas):
+        if metadata.get("captioned"):
+            tags = [tag.strip() for tag in metadata["tags"].split(",") if tag.strip()]
+            index.add(image_id, metadata["caption"], tags)
 
 
-def delete_embedding_from_chroma(ids):
+def delete_embedding_from_chroma(ids, namespace=None):
     """Delete embedding from chroma"""
-    client = chromadb.PersistentClient(constants.VECTOR_LOCATION)
-    collection = client.get_or_create_collection(name=constants.COLLECTION_NAME)
-    collection.delete(ids=ids)
+    vector_store.delete(ids=ids, collection=namespaces.get(namespace).collection)
+
+
+def format_found_images(result, index=0):
+    """Convert chroma query result to (image_id, file_path, distance) tuples
+
+    The embedding is appended to each tuple when the result includes embeddings.
+    """
+    image_ids = [metadata["image_id"] for metadata in result["metadatas"][index]]
+    file_paths = [metadata["file_path"] for metadata in result["metadatas"][index]]
+    distances = [distance for distance in result["distances"][index]]
+    if result.get("embeddings"):
+        return list(
+            zip(image_ids, file_paths, distances, result["embeddings"][index])
+        )
+    return list(zip(image_ids, file_paths, distances))
 
 
 def find_similar_image(
-    query_embeddings=None, query_texts=None, n_results=constants.N_RESULTS
+    query_embeddings=None,
+    query_texts=None,
+    n_results=constants.N_RESULTS,
+    include=constants.SEARCH_INCLUDE,
+    where=None,
+    namespace=None,
 ):
-    """Find similar image"""
-    client = chromadb.PersistentClient(constants.VECTOR_LOCATION)
-    collection = client.get_or_create_collection(
-        name=constants.COLLECTION_NAME,
-        embedding_function=AmazonBedrockEmbeddingFunction(
-            session=session, model_name=constants.MM_EMBED_MODEL
-        ),
-    )
-    result = collection.query(
+    """Find similar image, optionally among the metadata matching where"""
+    if query_embeddings is None:
+        query_embeddings = [
+            embed_text(text, namespace=namespace) for text in query_texts
+        ]
+    result = vector_store.query(
         query_embeddings=query_embeddings,
-        query_texts=query_texts,
         n_results=n_results,
-        include=["embeddings", "metadatas", "distances"],
+        include=include,
+        where=where,
+        collection=namespaces.get(namespace).collection,
     )
-    image_ids = [metadata["image_id"] for metadata in result["metadatas"][0]]
-    file_paths = [metadata["file_path"] for metadata in result["metadatas"][0]]
-    distances = [distance for distance in result["distances"][0]]
-    found_images = list(zip(image_ids, file_paths, distances))
+    found_images = format_found_images(result)
     logger.info(f"The most similar images are {found_images}.")
     return found_images
 
 
-def add_images_to_library(images):
-    """Add image to library"""
-    image_ids = []
-    embeddings = []
-    metadatas = []
-    for image in images:
-        image_name = f"{uuid.uuid4()}.png"
-        if hasattr(image, "name"):
-            image_name = image.name
-        logger.info(f"Adding {image_name} to image library.")
-        with open(os.path.join(constants.FILE_LOCATION, image_name), "wb") as f:
-            f.write(image.getbuffer())
-        image_ids.append(image_name)
-        base64_encoded_image = base64.b64encode(image.getvalue()).decode("utf-8")
-        body = format_content_for_titan_mm_embed(base64_encoded_image)
+def hybrid_search(
+    query, n_results=constants.N_RESULTS, where=None, candidates=None, namespace=None
+):
+    """Find images by fused caption keyword and vector ranks
+
+    The top candidates of the BM25 keyword ranking and of the vector ranking,
+    both among the metadata matching where, are fused with reciprocal rank
+    fusion. Returns (image_id, file_path, score) tuples, highest score first.
+    """
+    namespace = namespaces.get(namespace)
+    candidates = max(candidates or constants.HYBRID_CANDIDATES, n_results)
+    with metrics.timer("search", operation="hybrid"):
+        keyword_ids = [
+            image_id
+            for image_id, _ in keyword_index.get_index(
+                namespace.keyword_index_path
+            ).search(query, candidates)
+        ]
+        result = vector_store.query(
+            query_embeddings=[embed_text(query, namespace=namespace)],
+            n_results=candidates,
+            include=["metadatas"],
+            where=where,
+            collection=namespace.collection,
+        )
+        file_paths = {
+            metadata["image_id"]: metadata["file_path"]
+            for metadata in result["metadatas"][0]
+        }
+        missing = [image_id for image_id in keyword_ids if image_id not in file_paths]
+        if missing:
+            found = vector_store.get(
+                ids=missing, where=where, collection=namespace.collection
+            )
+            file_paths.update(
+                (metadata["image_id"], metadata["file_path"])
+                for metadata in found["metadatas"]
+            )
+        fused = keyword_index.reciprocal_rank_fusion(
+            [
+                result["ids"][0],
+                [image_id for image_id in keyword_ids if image_id in file_paths],
+            ]
+        )
+    found_images = [
+        (image_id, file_paths[image_id], score) for image_id, score in fused[:n_results]
+    ]
+    logger.info(f"The best hybrid matches are {found_images}.")
+    return found_images
+
+
+def search_namespaces(
+    query, names, n_results=constants.N_RESULTS, where=None, hybrid=True
+):
+    """Search several namespaces at once, merge into (image_id, file_path, score, namespace)
+
+    Text queries use hybrid search when hybrid is set, and results merge by
+    fused score, highest first. Otherwise results merge by distance, nearest
+    first, which only compares well between collections of the same
+    embedding length. Each namespace returns at most n_results.
+    """
+    names = list(dict.fromkeys(names))
+    use_hybrid = hybrid and isinstance(query, str)
+
+    def search(name):
+        if use_hybrid:
+            return hybrid_search(query, n_results, where=where, namespace=name)
+        return find_similar_image(
+            query_embeddings=[embed_query(query, namespace=name)],
+            n_results=n_results,
+            where=where,
+            namespace=name,
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, len(names))) as executor:
+        results = dict(zip(names, executor.map(search, names)))
+    merged = sorted(
+        (
+            (image_id, file_path, score, name)
+            for name, found_images in results.items()
+            for image_id, file_path, score in found_images
+        ),
+        key=lambda found_image: -found_image[2] if use_hybrid else found_image[2],
+    )
+    return merged[:n_results]
+
+
+def get_caption(image_id, namespace=None):
+    """Get {"caption", "tags"} of a library image, None if it has no caption"""
+    return keyword_index.get_index(namespaces.get(namespace).keyword_index_path).get(
+        image_id
+    )
+
+
+def embed_query(query, namespace=None):
+    """Generate embedding for text or image bytes query"""
+    if isinstance(query, str):
+        return embed_text(query, namespace=namespace)
+    return embed_image(query, namespace=namespace)
+
+
+def query_key(query, namespace=None):
+    """Get embedding cache key for text or image bytes query"""
+    embedding_length = vector_store.embedding_length(
+        namespaces.get(namespace).collection
+    )
+    if isinstance(query, str):
+        return embedding_cache.text_key(query, embedding_length)
+    return embedding_cache.image_key(query, embedding_length)
+
+
+def find_similar_images_batch(
+    queries,
+    n_results=constants.N_RESULTS,
+    max_in_flight=constants.EMBED_MAX_IN_FLIGHT,
+    include=constants.SEARCH_INCLUDE,
+    namespace=None,
+):
+    """Find similar images for many text or image bytes queries at once"""
+    queries = list(queries)
+    keys = [query_key(query, namespace) for query in queries]
+    unique_queries = dict(zip(keys, queries))
+    if not unique_queries:
+        return []
+    limiter = ingest.AdaptiveLimiter(max_in_flight)
+    with ThreadPoolExecutor(max_workers=limiter.max_in_flight) as executor:
+        futures = {
+            key: executor.submit(
+                ingest.call_with_backoff, embed_query, limiter, query, namespace
+            )
+            for key, query in unique_queries.items()
+        }
+        embeddings = {key: future.result() for key, future in futures.items()}
+    unique_keys = list(embeddings.keys())
+    result = vector_store.query(
+        query_embeddings=[embeddings[key] for key in unique_keys],
+        n_results=n_results,
+        include=include,
+        collection=namespaces.get(namespace).collection,
+    )
+    found_images = {
+        key: format_found_images(result, idx) for idx, key in enumerate(unique_keys)
+    }
+    logger.info(
+        f"Searched {len(queries)} queries with {len(unique_keys)} unique embeddings."
+    )
+    return [found_images[key] for key in keys]
+
+
+def embed_image(
+    image_bytes, embedding_length=None, base64_encoded_image=None, namespace=None
+):
+    """Generate embedding for image, reuse cached embedding of the same bytes
+
+    The embedding length defaults to the one of the active collection of the
+    namespace. Pass base64_encoded_image when it is already in hand to skip
+    encoding again.
+    """
+    embedding_length = embedding_length or vector_store.embedding_length(
+        namespaces.get(namespace).collection
+    )
+    cache = embedding_cache.get_cache()
+    key = embedding_cache.image_key(image_bytes, embedding_length)
+    embedding = cache.get(key)
+    metrics.count("embedding_cache_lookups", result="miss" if embedding is None else "hit")
+    if embedding is None:
+        if base64_encoded_image is None:
+            with metrics.timer("base64", operation="encode"):
+                base64_encoded_image = base64.b64encode(image_bytes).decode("utf-8")
+        body = format_content_for_titan_mm_embed(
+            base64_encoded_image, embedding_length=embedding_length
+        )
         embedding = generate_embeddings(body)["embedding"]
-        embeddings.append(embedding)
+        cache.put(key, embedding)
+    return embedding
+
+
+def embed_text(text, embedding_length=None, namespace=None):
+    """Generate embedding for text, reuse cached embedding of the same text
+
+    The embedding length defaults to the one of the active collection of the
+    namespace.
+    """
+    embedding_length = embedding_length or vector_store.embedding_length(
+        namespaces.get(namespace).collection
+    )
+    cache = embedding_cache.get_cache()
+    key = embedding_cache.text_key(text, embedding_length)
+    embedding = cache.get(key)
+    metrics.count("embedding_cache_lookups", result="miss" if embedding is None else "hit")
+    if embedding is None:
+        body = format_content_for_titan_mm_embed(
+            text_input=text, embedding_length=embedding_length
+        )
+        embedding = generate_embeddings(body)["embedding"]
+        cache.put(key, embedding)
+    return embedding
+
+
+def get_embedding_cache_stats():
+    """Get embedding cache hit and miss counters"""
+    return embedding_cache.get_cache().stats()
+
+
+def get_response_cache_stats():
+    """Get response cache hit and miss counters"""
+    return response_cache.get_cache().stats()
+
+
+def prepare_images_for_library(images, on_duplicate=None, namespace=None):
+    """Save images to library and yield records for embedding
+
+    Images are stored by content hash, the upload name is kept as metadata.
+    Images with a content_id attribute are not hashed again. Images already
+    in the library are skipped before writing or embedding, on_duplicate is
+    called with the image and its id.
+    """
+    namespace = namespaces.get(namespace)
+    index = library_index.get_index(
+        namespace.library_index_path, namespace.file_location
+    )
+    seen = set()
+    for image in images:
+        image_bytes = image.getvalue()
+        original_name = getattr(image, "name", None)
+        image_id = getattr(image, "content_id", None) or file_store.content_id(
+            image_bytes, original_name
+        )
+        original_name = original_name or image_id
+        image_path = file_store.content_path(image_id, namespace.file_location)
+        if image_id in seen or (
+            os.path.exists(image_path)
+            and vector_store.existing([image_id], collection=namespace.collection)
+        ):
+            logger.info(f"Skip {original_name}, it is in image library as {image_id}.")
+            metrics.count("library_duplicates")
+            if on_duplicate is not None:
+                on_duplicate(image, image_id)
+            continue
+        seen.add(image_id)
+        logger.info(f"Adding {original_name} to image library as {image_id}.")
+        with metrics.timer("file_io", operation="write_image"):
+            image_path, _ = file_store.write(
+                image_id, image_bytes, namespace.file_location
+            )
+        index.add(image_id, image_path, image_bytes, original_name)
+        try:
+            with metrics.timer("file_io", operation="write_thumbnail"):
+                thumbnails.create_thumbnail(
+                    image_bytes, image_path, namespace.thumbnail_location
+                )
+        except Exception as err:
+            logger.warning(f"Failed to create thumbnail for {original_name}: {err}")
         metadata = {
-            "image_id": image_name,
-            "file_path": f"{constants.FILE_LOCATION}/{image_name}",
+            "image_id": image_id,
+            "file_path": image_path,
+            "name": original_name,
+            "added_at": int(time.time()),
+            "file_mtime": os.stat(image_path).st_mtime,
         }
-        metadatas.append(metadata)
-    upsert_embedding_to_chroma(image_ids, embeddings, metadatas)
+        yield image_id, image_bytes, metadata
+
+
+def add_images_to_library(
+    images,
+    max_in_flight=constants.EMBED_MAX_IN_FLIGHT,
+    batch_size=constants.UPSERT_BATCH_SIZE,
+    on_batch=None,
+    on_duplicate=None,
+    describe=None,
+    namespace=None,
+):
+    """Add image to library of the namespace, skip images already in it
+
+    describe is called with the image bytes of every new image and returns
+    {"caption", "tags"} to store and index for hybrid search, for example
+    generate_caption. It runs next to the embedding call within the same
+    concurrency limit, failures other than throttling only skip the caption.
+    """
+    namespace = namespaces.get(namespace)
+    embedding_length = vector_store.embedding_length(namespace.collection)
+    records = prepare_images_for_library(images, on_duplicate, namespace)
+    if describe is None:
 
+        def embed(image_bytes):
+            return embed_image(image_bytes, embedding_length)
+
+    else:
+        records = (
+            (image_id, (image_bytes, metadata), metadata)
+            for image_id, image_bytes, metadata in records
+        )
+
+        def embed(content):
+            image_bytes, metadata = content
+            if "caption" not in metadata:
+                try:
+                    description = describe(image_bytes)
+                except Exception as err:
+                    if ingest.is_throttling_error(err):
+                        raise
+                    logger.warning(f"Failed to caption {metadata['name']}: {err}")
+                    description = None
+                if description and description["caption"]:
+                    metadata.update(caption_metadata(description))
+            return embed_image(image_bytes, embedding_length)
+
+    return ingest.run_ingestion(
+        records,
+        embed=embed,
+        upsert=lambda ids, embeddings, metadatas: upsert_embedding_to_chroma(
+            ids, embeddings, metadatas, namespace
+        ),
+        max_in_flight=max_in_flight,
+        batch_size=batch_size,
+        on_batch=on_batch,
+    )
+
+
+def get_library_index(namespace=None):
+    """Get the library index of the namespace"""
+    namespace = namespaces.get(namespace)
+    return library_index.get_index(namespace.library_index_path, namespace.file_location)
+
+
+def list_library_images(
+    offset=0,
+    limit=None,
+    sort_by="name",
+    descending=False,
+    name_filter=None,
+    namespace=None,
+):
+    """List library entries with path, original name, size, mtime and dimensions"""
+    return get_library_index(namespace).list(
+        offset=offset,
+        limit=limit,
+        sort_by=sort_by,
+        descending=descending,
+        name_filter=name_filter,
+    )
 
-def get_images_in_library():
+
+def get_images_in_library(
+    offset=0,
+    limit=None,
+    sort_by="name",
+    descending=False,
+    name_filter=None,
+    namespace=None,
+):
     """Get the sorted list of images library"""
-    sorted_images_list = sorted(
-        [
-            os.path.join(constants.FILE_LOCATION, image)
-            for image in os.listdir(constants.FILE_LOCATION)
-            if mimetypes.guess_type(os.path.join(constants.FILE_LOCATION, image))[0]
-            in ("image/png", "image/jpeg")
-        ]
+    entries = list_library_images(
+        offset, limit, sort_by, descending, name_filter, namespace
+    )
+    return [entry["path"] for entry in entries]
+
+
+def count_images_in_library(name_filter=None, namespace=None):
+    """Count images in library"""
+    return get_library_index(namespace).count(name_filter=name_filter)
+
+
+def reconcile_library_index(namespace=None):
+    """Rebuild library index from the files on disk"""
+    return get_library_index(namespace).reconcile()
+
+
+def get_thumbnail(image_path, namespace=None):
+    """Get thumbnail path of the library image"""
+    return thumbnails.get_thumbnail(
+        image_path, namespaces.get(namespace).thumbnail_location
     )
-    return sorted_images_list
 
 
-def delete_image_from_library(image_path):
-    """Delete image from library"""
+def delete_image_from_library(image_path, namespace=None):
+    """Delete image from library, file first
+
+    A failure after the file is gone leaves an orphaned vector, which the
+    reconciler prunes, rather than a file it would embed again.
+    """
     logger.info(f"Deleting {image_path} from image library.")
-    os.remove(image_path)
+    namespace = namespaces.get(namespace)
+    with metrics.timer("file_io", operation="delete_image"):
+        try:
+            os.remove(image_path)
+        except FileNotFoundError:
+            logger.warning(f"{image_path} is missing, deleting its entries only.")
+        thumbnails.delete_thumbnail(image_path, namespace.thumbnail_location)
     image_id = image_path.split("/")[-1]
-    delete_embedding_from_chroma(ids=[image_id])
+    get_library_index(namespace).remove(image_id)
+    keyword_index.get_index(namespace.keyword_index_path).remove([image_id])
+    delete_embedding_from_chroma(ids=[image_id], namespace=namespace)
 
 
 def generate_images(prompt, **kwargs):
@@ -269,11 +938,48 @@ def generate_images(prompt, **kwargs):
                 },
             }
         )
-        response = bedrock_runtime.invoke_model(
-            modelId=constants.IMAGE_GENERATOR_MODEL, body=request
-        )
+        with metrics.timer(
+            "bedrock", model_id=constants.IMAGE_GENERATOR_MODEL, operation="invoke_model"
+        ):
+            response = bedrock_runtime.invoke_model(
+                modelId=constants.IMAGE_GENERATOR_MODEL, body=request
+            )
         response_body = json.loads(response.get("body").read())
         base64_image_data = response_body["images"]
     except Exception as err:
         raise
     return base64_image_data
+
+
+def generate_image_grid(
+    prompt,
+    grid,
+    max_in_flight=constants.GENERATION_MAX_IN_FLIGHT,
+    embed=False,
+    namespace=None,
+):
+    """Generate images for every parameters in the grid, yield results as they complete
+
+    Yields (index, params, images, cached), images are GeneratedImage objects
+    ready for add_images_to_library. With embed, new images are embedded from
+    the Titan base64 payload right away with the embedding length of the
+    namespace, so saving them there hits the embedding cache.
+    """
+    embed_new_image = None
+    if embed:
+        embed_new_image = functools.partial(
+            embed_generated_image,
+            embedding_length=vector_store.embedding_length(
+                namespaces.get(namespace).collection
+            ),
+        )
+    return generation.run_grid(
+        prompt, grid, generate_images, max_in_flight, embed=embed_new_image
+    )
+
+
+def embed_generated_image(image_bytes, base64_encoded_image, embedding_length=None):
+    """Embed generated image from the base64 payload returned by Titan"""
+    return embed_image(
+        image_bytes, embedding_length, base64_encoded_image=base64_encoded_image
+    )
@@ -0,0 +1,320 @@
+"""Process wide vector store handles, backed by chroma or NumPy"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from lib import constants
+from lib import handles
+from lib import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Keep recent latency samples per operation and log percentiles periodically"""
+
+    def __init__(
+        self,
+        window=constants.LATENCY_WINDOW,
+        log_interval=constants.LATENCY_LOG_INTERVAL,
+    ):
+        self.window = window
+        self.log_interval = log_interval
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds):
+        """Record one latency sample"""
+        metrics.observe(
+            "vector_store_seconds",
+            seconds,
+            backend=constants.VECTOR_BACKEND,
+            operation=operation,
+        )
+        with self._lock:
+            self._samples[operation].append(seconds)
+            self._counts[operation] += 1
+            should_log = self._counts[operation] % self.log_interval == 0
+        if should_log:
+            summary = self.summary(operation)
+            logger.info(
+                f"Vector store {operation} latency over last {summary['samples']} calls: "
+                f"p50 {summary['p50'] * 1000:.1f} ms, p99 {summary['p99'] * 1000:.1f} ms."
+            )
+
+    def summary(self, operation):
+        """Get p50 and p99 of the recent samples"""
+        with self._lock:
+            samples = sorted(self._samples[operation])
+        if not samples:
+            return {"samples": 0, "p50": 0.0, "p99": 0.0}
+        return {
+            "samples": len(samples),
+            "p50": percentile(samples, 50),
+            "p99": percentile(samples, 99),
+        }
+
+    @contextmanager
+    def timer(self, operation):
+        """Time the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(operation, time.perf_counter() - start)
+
+
+def percentile(sorted_samples, percent):
+    """Get the nearest rank percentile of sorted samples"""
+    rank = max(0, int(round(percent / 100 * len(sorted_samples))) - 1)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+
+latency = LatencyTracker()
+
+
+class ChromaVectorStore:
+    """Chroma persistent collection, embedding length recorded in collection metadata
+
+    It has no close method, the collection stays loaded in the chroma client
+    shared by every handle of the path, within CHROMA_MEMORY_LIMIT_BYTES.
+    """
+
+    def __init__(self, path, name, embedding_length):
+        import chromadb
+        from chromadb.config import Settings
+
+        settings = Settings()
+        if constants.CHROMA_MEMORY_LIMIT_BYTES:
+            # Unused collections are unloaded least recently used first
+            settings = Settings(
+                chroma_segment_cache_policy="LRU",
+                chroma_memory_limit_bytes=constants.CHROMA_MEMORY_LIMIT_BYTES,
+            )
+        self.client = chromadb.PersistentClient(path, settings=settings)
+        # Passing metadata to get_or_create_collection overwrites it on an existing
+        # collection, so it is only recorded when missing
+        self.collection = self.client.get_or_create_collection(
+            name=name, embedding_function=None
+        )
+        metadata = self.collection.metadata or {}
+        if "embedding_length" not in metadata:
+            self.collection.modify(
+                metadata={**metadata, "embedding_length": embedding_length}
+            )
+            metadata["embedding_length"] = embedding_length
+        self.embedding_length = int(metadata["embedding_length"])
+
+    def count(self):
+        """Count stored vectors"""
+        return self.collection.count()
+
+    def get(self, offset=0, limit=None, ids=None, where=None):
+        """Get ids and metadatas of stored vectors, optionally of the ids matching where"""
+        return self.collection.get(
+            ids=None if ids is None else list(ids),
+            where=where or None,
+            offset=offset,
+            limit=limit,
+            include=["metadatas"],
+        )
+
+    def existing(self, ids):
+        """Get the subset of ids that are stored"""
+        return set(self.collection.get(ids=list(ids), include=[])["ids"])
+
+    def upsert(self, ids, embeddings, metadatas):
+        """Add or update vectors"""
+        self.collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+
+    def update(self, ids, metadatas):
+        """Replace the metadatas of stored vectors"""
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids):
+        """Delete vectors"""
+        self.collection.delete(ids=ids)
+
+    def query(self, query_embeddings, n_results, include, where=None):
+        """Find the nearest vectors of every query matching the metadata where filter"""
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=include,
+            where=where or None,
+        )
+
+    def drop(self):
+        """Delete the collection"""
+        self.client.delete_collection(self.collection.name)
+
+
+def numpy_vector_store(path, name, embedding_length):
+    """Open the NumPy backend, imported on demand"""
+    from lib.numpy_store import NumpyVectorStore
+
+    return NumpyVectorStore(
+        path,
+        name,
+        dtype=constants.NUMPY_VECTOR_DTYPE,
+        metric=constants.NUMPY_VECTOR_METRIC,
+        dimension=embedding_length,
+    )
+
+
+BACKENDS = {"chroma": ChromaVectorStore, "numpy": numpy_vector_store}
+
+_warmed_up = set()
+_stores = handles.HandleCache("vector store", on_evict=_warmed_up.discard)
+_lock = threading.Lock()
+_active = {"mtime": None, "names": {}}
+
+
+def load_active_collections():
+    """Get collection names swapped in by migrations, keyed by configured name"""
+    try:
+        mtime = os.path.getmtime(constants.ACTIVE_COLLECTIONS_PATH)
+    except OSError:
+        return {}
+    if mtime != _active["mtime"]:
+        with open(constants.ACTIVE_COLLECTIONS_PATH, encoding="utf-8") as f:
+            _active["names"] = json.load(f)
+        _active["mtime"] = mtime
+    return _active["names"]
+
+
+def active_collection_name(name=None):
+    """Get the collection currently serving the configured collection name"""
+    name = name or constants.COLLECTION_NAME
+    return load_active_collections().get(name, name)
+
+
+def set_active_collection(target, name=None):
+    """Atomically point the configured collection name to the target collection"""
+    name = name or constants.COLLECTION_NAME
+    names = {**load_active_collections(), name: target}
+    path = constants.ACTIVE_COLLECTIONS_PATH
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(names, f)
+    os.replace(f"{path}.tmp", path)
+    logger.info(f"Collection {name} is now served by {target}.")
+
+
+def get_store(backend=None, path=None, name=None, embedding_length=None):
+    """Get vector store handle, shared across sessions
+
+    Handles are opened on first use, least recently used and idle handles
+    are closed, see handles.HandleCache. The embedding length only applies
+    when the collection is created.
+    """
+    key = (
+        backend or constants.VECTOR_BACKEND,
+        path or constants.VECTOR_LOCATION,
+        name or active_collection_name(),
+    )
+
+    def open_store():
+        logger.info(f"Opening {key[0]} vector store {key[2]} at {key[1]}.")
+        return BACKENDS[key[0]](
+            key[1], key[2], embedding_length or constants.OUTPUT_EMBEDDING_LENGTH
+        )
+
+    return _stores.get(key, open_store)
+
+
+def collection_store(collection=None):
+    """Get the handle of the collection serving the configured collection name"""
+    return get_store(name=active_collection_name(collection))
+
+
+def forget_store(name, backend=None, path=None):
+    """Drop a cached vector store handle"""
+    key = (backend or constants.VECTOR_BACKEND, path or constants.VECTOR_LOCATION, name)
+    _stores.forget(key)
+
+
+def reset():
+    """Close cached vector store handles"""
+    _stores.clear()
+    with _lock:
+        _warmed_up.clear()
+        _active.update(mtime=None, names={})
+
+
+def warm_up(collection=None):
+    """Open the vector store and load its index before the first request"""
+    key = (
+        constants.VECTOR_BACKEND,
+        constants.VECTOR_LOCATION,
+        active_collection_name(collection),
+    )
+    if key in _warmed_up:
+        return
+    _warmed_up.add(key)
+    try:
+        with latency.timer("warm_up"):
+            store = collection_store(collection)
+            if store.count() > 0:
+                store.query(
+                    query_embeddings=[[0.0] * store.embedding_length],
+                    n_results=1,
+                    include=[],
+                )
+    except Exception as err:
+        logger.warning(f"Failed to warm up vector store: {err}")
+
+
+def embedding_length(collection=None):
+    """Get the embedding length of the active collection"""
+    return collection_store(collection).embedding_length
+
+
+def upsert(ids, embeddings, metadatas, collection=None):
+    """Add or update embeddings"""
+    with latency.timer("upsert"):
+        collection_store(collection).upsert(
+            ids=ids, embeddings=embeddings, metadatas=metadatas
+        )
+
+
+def get(ids=None, where=None, offset=0, limit=None, collection=None):
+    """Get ids and metadatas of stored embeddings"""
+    with latency.timer("get"):
+        return collection_store(collection).get(
+            offset=offset, limit=limit, ids=ids, where=where
+        )
+
+
+def existing(ids, collection=None):
+    """Get the subset of ids that have embeddings"""
+    with latency.timer("existing"):
+        return collection_store(collection).existing(ids)
+
+
+def update(ids, metadatas, collection=None):
+    """Replace metadatas of stored embeddings"""
+    with latency.timer("update"):
+        collection_store(collection).update(ids=ids, metadatas=metadatas)
+
+
+def delete(ids, collection=None):
+    """Delete embeddings"""
+    with latency.timer("delete"):
+        collection_store(collection).delete(ids=ids)
+
+
+def query(query_embeddings, n_results, include, where=None, collection=None):
+    """Query nearest embeddings, optionally of the metadata matching where"""
+    with latency.timer("query"):
+        return collection_store(collection).query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=include,
+            where=where,
+        )
@@ -3,12 +3,14 @@
 import streamlit as st
 
 from lib import constants
+from lib import streaming
 from lib import utils
 
 
 st.header("Image Reader 👀", divider=True)
 
 utils.setup_storage()
+namespace = utils.select_namespace()
 
 take_photo = st.sidebar.toggle("Use camera")
 if take_photo:
@@ -27,9 +29,17 @@ with prompt_window:
         model_id = st.selectbox(
             label="Select model:", index=0, options=constants.MODEL_IDS
         )
+        compare_with = st.multiselect(
+            label="Compare side by side with:", options=constants.MODEL_IDS
+        )
         system_prompt = st.text_area("System prompt:", constants.DEFAULT_SYSTEM_PROMPT)
         prompt = st.text_area("User prompt:", constants.DEFAULT_PROMPT)
         add_to_image_library = st.checkbox("Add to image library")
+        use_cache = st.checkbox(
+            "Use cached responses",
+            value=True,
+            help="Replay the saved answer to an identical request, untick to ask the model again.",
+        )
         submitted = st.form_submit_button("Submit")
 
 with image_window:
@@ -41,19 +51,48 @@ if submitted:
         st.sidebar.warning(
             "No images are chosen, but I will do it for you anyway in case thats what you want."
         )
-    response = ""
-    with response_window:
-        with st.spinner("Reading..."):
-            stream = utils.read_images_with_response_stream(
-                model_id, system_prompt, images, prompt
-            )
-            for token in stream:
-                if token == "message_start":
-                    break
-        for token in stream:
-            response += token
-            st.write(response.replace("$", "\$"))
+    model_ids = [model_id] + [other for other in compare_with if other != model_id]
+    with response_window.container():
+        if len(model_ids) > 1:
+            records = []
+            columns = st.columns(len(model_ids))
+            for column, compared_model_id in zip(columns, model_ids):
+                column.caption(compared_model_id)
+            with st.spinner("Reading..."):
+                texts = streaming.render_side_by_side(
+                    {
+                        compared_model_id: column.container()
+                        for column, compared_model_id in zip(columns, model_ids)
+                    },
+                    utils.compare_models_with_response_stream(
+                        model_ids,
+                        system_prompt,
+                        images,
+                        prompt,
+                        on_finish=records.append,
+                        use_cache=use_cache,
+                    ),
+                )
+            response = texts.get(model_id, "")
+            st.table(streaming.summary_rows(records))
+        else:
+            with st.spinner("Reading..."):
+                stream = utils.read_images_with_response_stream(
+                    model_id, system_prompt, images, prompt, use_cache=use_cache
+                )
+                for token in stream:
+                    if token == "message_start":
+                        break
+            renderer = streaming.StreamRenderer(st.container())
+            response = renderer.render(streaming.coalesce(stream))
         if images and images != [None] and add_to_image_library:
             print(images)
             print(type(images))
-            utils.add_images_to_library(images)
+            # A response about several images describes none of them alone, those
+            # are left to the caption job
+            caption = utils.strip_response_footer(response) if len(images) == 1 else ""
+            utils.add_images_to_library(
+                images,
+                describe=(lambda _: {"caption": caption, "tags": []}) if caption else None,
+                namespace=namespace,
+            )
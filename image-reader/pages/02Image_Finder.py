@@ -1,16 +1,18 @@
 """Image Finder"""
 
 import os
-import base64
+import time
 
 import streamlit as st
 
 from lib import constants
+from lib import streaming
 from lib import utils
 
 st.header("Image Finder 🔎", divider=True)
 
 utils.setup_storage()
+namespace = utils.select_namespace()
 
 image_window = st.empty()
 
@@ -21,41 +23,86 @@ source_window = st.sidebar.empty()
 with source_window:
     with st.form("image", clear_on_submit=False, border=False):
         query = st.text_input("Search by text")
-        n_results = st.slider("Max number of results:", 1, 5, 1, 1)
+        n_results = st.slider(
+            "Max number of results:", 1, constants.MAX_N_RESULTS, 1, 1
+        )
+        hybrid = st.checkbox(
+            "Match captions and tags",
+            value=True,
+            help="Fuse keyword matches on Claude captions and tags with vector similarity.",
+        )
+        captioned_only = st.checkbox("Only captioned images")
+        added_within_days = st.number_input(
+            "Added within days, 0 for any time:", min_value=0, value=0, step=1
+        )
+        search_in = st.multiselect(
+            "Search namespaces:", options=utils.list_namespaces(), default=[namespace]
+        ) or [namespace]
         submitted = st.form_submit_button("Search")
 
 if image:
     st.sidebar.image(image)
 
 
-found_images = None
+where = {}
+if captioned_only:
+    where["captioned"] = True
+if added_within_days:
+    where["added_at"] = {"$gte": int(time.time()) - added_within_days * 24 * 60 * 60}
+if len(where) > 1:
+    where = {"$and": [{key: value} for key, value in where.items()]}
+
+
+def show(found_image, label, found_in):
+    """Show thumbnail, caption and match details of a found image"""
+    st.image(utils.get_thumbnail(found_image[1], found_in))
+    description = utils.get_caption(found_image[0], found_in)
+    if description:
+        st.caption(streaming.escape(description["caption"]))
+    st.write(
+        f"Namespace: {found_in}, Name: {found_image[0]}, Path: {found_image[1]}, "
+        f"{label}: {found_image[2]}"
+    )
+
+
+search_namespace = search_in[0]
+found_results = None
 if submitted:
     with st.spinner("Searching..."):
         if query and image:
             st.sidebar.warning("Search by text or image not both.")
-        elif query:
-            found_images = utils.find_similar_image(
-                query_texts=[query], n_results=n_results
-            )
-        elif image:
-            base64_encoded_image = base64.b64encode(image.getvalue()).decode("utf-8")
-            payload = utils.format_content_for_titan_mm_embed(
-                base64_encoded_image=base64_encoded_image
-            )
-            image_embedding = utils.generate_embeddings(payload)["embedding"]
-            found_images = utils.find_similar_image(
-                query_embeddings=[image_embedding], n_results=n_results
+        elif (query or image) and len(search_in) > 1:
+            found_results = utils.search_namespaces(
+                query or image.getvalue(), search_in, n_results, where=where, hybrid=hybrid
             )
+        elif query and hybrid:
+            found_results = [
+                (*found_image, search_namespace)
+                for found_image in utils.hybrid_search(
+                    query, n_results, where=where, namespace=search_namespace
+                )
+            ]
+        elif query or image:
+            found_results = [
+                (*found_image, search_namespace)
+                for found_image in utils.find_similar_image(
+                    query_embeddings=[
+                        utils.embed_query(
+                            query or image.getvalue(), namespace=search_namespace
+                        )
+                    ],
+                    n_results=n_results,
+                    where=where,
+                    namespace=search_namespace,
+                )
+            ]
         else:
             st.sidebar.warning("Search by text or image.")
 
 
-if found_images is not None:
-    if found_images:
-        for found_image in found_images:
-            st.image(found_image[1])
-            st.write(
-                f"Name: {found_image[0]}, Path: {found_image[1]}, Distance: {found_image[2]}"
-            )
-    else:
+if found_results is not None:
+    label = "Score" if query and hybrid else "Distance"
+    for found_image in found_results:
+        show(found_image, label, found_image[3])
+    if not found_results:
         st.write("No similar images are found!")
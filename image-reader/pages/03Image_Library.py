@@ -1,23 +1,28 @@
 """Image Library"""
 
-import os
-
 import streamlit as st
 from streamlit_image_select import image_select
 
 from lib import constants
+from lib import reconciler
 from lib import utils
 
 st.header("Image Library 📚", divider=True)
 
 utils.setup_storage()
+namespace = utils.select_namespace()
 
 source_window = st.sidebar.empty()
 st.sidebar.divider()
 preview_window = st.sidebar.empty()
+
+filter_column, sort_column, page_column = st.columns([2, 1, 1])
+name_filter = filter_column.text_input("Filter by name:")
+sort_by, descending = constants.LIBRARY_SORT_OPTIONS[
+    sort_column.selectbox("Sort by:", options=constants.LIBRARY_SORT_OPTIONS.keys())
+]
 images_window = st.empty()
 
-images_in_library = utils.get_images_in_library()
 selected_image = None
 
 with source_window:
@@ -29,16 +34,60 @@ with source_window:
 
 if images and add_submitted:
     with st.spinner("Adding images..."):
-        utils.add_images_to_library(images)
-    images_in_library = utils.get_images_in_library()
+        added = utils.add_images_to_library(images, namespace=namespace)
+    if added < len(images):
+        st.sidebar.info(f"{len(images) - added} images are already in the library.")
+
+total_images = utils.count_images_in_library(
+    name_filter=name_filter, namespace=namespace
+)
+total_pages = max(1, -(-total_images // constants.LIBRARY_PAGE_SIZE))
+page = page_column.number_input(
+    "Page:", min_value=1, max_value=total_pages, value=1, step=1
+)
+page_column.caption(f"{total_images} images in {total_pages} pages")
+entries_in_library = utils.list_library_images(
+    offset=(page - 1) * constants.LIBRARY_PAGE_SIZE,
+    limit=constants.LIBRARY_PAGE_SIZE,
+    sort_by=sort_by,
+    descending=descending,
+    name_filter=name_filter,
+    namespace=namespace,
+)
+images_in_library = [entry["path"] for entry in entries_in_library]
+
+if st.sidebar.button(
+    "Reconcile with vector store",
+    help="Embed images missing from search and drop search entries of missing files.",
+):
+    with st.spinner("Reconciling..."):
+        report = reconciler.reconcile(namespace)
+    if report["error"]:
+        st.sidebar.error(report["error"])
+    st.sidebar.caption(
+        f"{report['embedded']} embedded, {report['orphaned']} orphaned and "
+        f"{report['moved']} moved vectors fixed, {report['files']} files."
+    )
+
+cache_stats = utils.get_embedding_cache_stats()
+st.sidebar.caption(
+    f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+    f"{cache_stats['size']} cached."
+)
 
 with images_window:
     if images_in_library:
-        selected_image = image_select(
+        selected_index = image_select(
             label="Click image to preview:",
-            images=images_in_library,
-            captions=[image.split("/")[-1] for image in images_in_library],
+            images=[
+                utils.get_thumbnail(image, namespace) for image in images_in_library
+            ],
+            captions=[
+                entry["original_name"] or entry["name"] for entry in entries_in_library
+            ],
+            return_value="index",
         )
+        selected_image = images_in_library[selected_index]
 
 with preview_window:
     if images_in_library:
@@ -47,6 +96,5 @@ with preview_window:
             delete_submitted = st.form_submit_button("Delete from image library")
 
 if selected_image is not None and delete_submitted:
-    utils.delete_image_from_library(selected_image)
-    images_in_library = utils.get_images_in_library()
+    utils.delete_image_from_library(selected_image, namespace)
     st.rerun()
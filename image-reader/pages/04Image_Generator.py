@@ -1,61 +1,115 @@
 """Image Generator"""
 
-import io
-import base64
-
 import streamlit as st
 
 from lib import constants
+from lib import generation
 from lib import utils
 
 st.header("Image Generator 🖨️", divider=True)
 
 utils.setup_storage()
+namespace = utils.select_namespace()
 
-images = None
+GRID_COLUMNS = 3
 
 if "generated_images" not in st.session_state.keys():
     st.session_state["generated_images"] = None
+if "generated_captions" not in st.session_state.keys():
+    st.session_state["generated_captions"] = None
 
 
-prompt_window = st.sidebar.empty()
-images_window = st.empty()
+def parse_values(text, cast, low, high):
+    """Parse comma separated values within the range"""
+    values = [cast(value) for value in text.split(",") if value.strip()]
+    for value in values:
+        if not low <= value <= high:
+            raise ValueError(f"{value} is not between {low} and {high}")
+    return values
+
+
+def caption(params, cached):
+    """Describe the parameters of a generated image"""
+    source = " (cached)" if cached else ""
+    return (
+        f"seed {params['seed']}, cfg {params['cfg_scale']}, "
+        f"{params['width']}x{params['height']}{source}"
+    )
 
 
+prompt_window = st.sidebar.empty()
+
 with prompt_window:
     with st.form("prompt", clear_on_submit=False, border=False):
         prompt = st.text_area("User prompt:")
-        image_size = st.selectbox("Width, Height", options=constants.IMAGE_SIZE)
-        cfg_scale = st.slider("CfgScale (randomness)", 1.1, 10.0, 8.0, 0.1, "%f")
-        seed = st.slider("Seed (noise setting)", 0, 2147483646, 0, 1)
+        image_sizes = st.multiselect(
+            "Width, Height", options=constants.IMAGE_SIZE, default=[constants.IMAGE_SIZE[2]]
+        )
+        cfg_scales = st.text_input(
+            "CfgScale (randomness), comma separated, 1.1 to 10.0", str(constants.CFG_SCALE)
+        )
+        seeds = st.text_input(
+            "Seed (noise setting), comma separated, 0 to 2147483646", str(constants.SEED)
+        )
         image_numbers = st.select_slider(
             "Image numbers", options=constants.IMAGE_NUMBERS
         )
+        embed_now = st.checkbox(
+            "Embed while generating", value=True, help="Save to library without waiting"
+        )
         submitted = st.form_submit_button("Generate")
 
 
-with images_window:
-    if prompt and submitted:
-        with st.spinner("Generating images..."):
-            image_settings = ()
-            base64_encoded_images = utils.generate_images(
-                prompt=prompt,
-                number_of_images=image_numbers,
-                cfg_scale=cfg_scale,
-                width=image_size[0],
-                height=image_size[1],
-                seed=seed,
+if prompt and submitted:
+    try:
+        grid = generation.parameter_grid(
+            seeds=parse_values(seeds, int, 0, 2147483646),
+            cfg_scales=parse_values(cfg_scales, float, 1.1, 10.0),
+            sizes=image_sizes,
+            number_of_images=image_numbers,
+        )
+    except ValueError as err:
+        st.error(f"Invalid parameters: {err}")
+        grid = []
+    if grid:
+        columns = st.columns(GRID_COLUMNS)
+        slots = [columns[idx % GRID_COLUMNS].empty() for idx in range(len(grid))]
+        results = [None] * len(grid)
+        progress = st.progress(0.0, f"Generating {len(grid)} image sets...")
+        generated = utils.generate_image_grid(
+            prompt, grid, embed=embed_now, namespace=namespace
+        )
+        for done, (idx, params, images, cached) in enumerate(generated, start=1):
+            results[idx] = (params, images, cached)
+            slots[idx].image(
+                [image.getvalue() for image in images],
+                caption=[caption(params, cached)] * len(images),
             )
-            images = [
-                io.BytesIO(base64.b64decode(image)) for image in base64_encoded_images
-            ]
-            st.session_state["generated_images"] = images
-    with st.form("generated_image", clear_on_submit=False, border=False):
-        if st.session_state["generated_images"] is not None:
-            st.image(st.session_state["generated_images"])
-        add_to_image_library = st.form_submit_button("Add to image library")
+            progress.progress(done / len(grid), f"Generated {done}/{len(grid)} image sets.")
+        progress.empty()
+        unique_images = {
+            image.name: (image, caption(params, cached))
+            for params, images, cached in results
+            for image in images
+        }
+        st.session_state["generated_images"] = [
+            image for image, _ in unique_images.values()
+        ]
+        st.session_state["generated_captions"] = [
+            image_caption for _, image_caption in unique_images.values()
+        ]
+elif st.session_state["generated_images"] is not None:
+    st.image(
+        [image.getvalue() for image in st.session_state["generated_images"]],
+        caption=st.session_state["generated_captions"],
+    )
+
+with st.form("generated_image", clear_on_submit=False, border=False):
+    add_to_image_library = st.form_submit_button("Add to image library")
 
 if st.session_state["generated_images"] is not None:
     if add_to_image_library:
         with st.spinner("Saving images..."):
-            utils.add_images_to_library(st.session_state["generated_images"])
+            utils.add_images_to_library(
+                st.session_state["generated_images"], namespace=namespace
+            )
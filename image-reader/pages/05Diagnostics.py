@@ -0,0 +1,70 @@
+"""Diagnostics"""
+
+import streamlit as st
+
+from lib import constants
+from lib import metrics
+from lib import reconciler
+from lib import streaming
+from lib import utils
+
+st.header("Diagnostics 🩺", divider=True)
+
+utils.setup_storage()
+
+snapshot = metrics.snapshot()
+
+st.caption(
+    f"Uptime {snapshot['uptime_seconds'] / 60:.0f} minutes. "
+    f"Prometheus metrics on port {constants.METRICS_PORT} at /metrics, "
+    f"JSON dump every {constants.METRICS_DUMP_INTERVAL} seconds to {constants.METRICS_DUMP_PATH}."
+)
+
+if st.button("Refresh"):
+    st.rerun()
+
+st.subheader("Timers")
+st.dataframe(
+    [
+        {
+            "name": timer["name"],
+            **timer["labels"],
+            "count": timer["count"],
+            "total s": round(timer["sum"], 3),
+            "p50 ms": round(timer["quantiles"]["0.5"] * 1000, 1),
+            "p90 ms": round(timer["quantiles"]["0.9"] * 1000, 1),
+            "p99 ms": round(timer["quantiles"]["0.99"] * 1000, 1),
+        }
+        for timer in snapshot["timers"]
+    ],
+    use_container_width=True,
+)
+
+st.subheader("Counters")
+st.dataframe(
+    [
+        {"name": counter["name"], **counter["labels"], "value": counter["value"]}
+        for counter in snapshot["counters"]
+    ],
+    use_container_width=True,
+)
+
+st.subheader("Recent responses")
+st.dataframe(
+    list(reversed(streaming.load_metrics(limit=50))), use_container_width=True
+)
+
+st.subheader("Library reconciliation")
+st.dataframe(
+    [
+        {key: value for key, value in report.items() if key != "index"}
+        for report in reconciler.last_reports().values()
+    ],
+    use_container_width=True,
+)
+
+st.subheader("Embedding cache")
+st.json(utils.get_embedding_cache_stats())
+
+st.subheader("Response cache")
+st.json(utils.get_response_cache_stats())
@@ -0,0 +1,67 @@
+"""Tests of the image preprocessing before sending images to Claude 3
+
+Run from the image-reader directory: python -m pytest tests
+"""
+
+import io
+
+from PIL import Image
+
+from lib import constants
+from lib import image_processing
+
+
+def rotated_jpeg(width, height, orientation=6):
+    """Make a JPEG stored sideways, red on the left half and blue on the right
+
+    With orientation 6 the stored pixels are rotated 90 degrees clockwise
+    when displayed, so the red half ends up on top.
+    """
+    image = Image.new("RGB", (width, height), "blue")
+    image.paste("red", (0, 0, width // 2, height))
+    exif = Image.Exif()
+    exif[image_processing.ORIENTATION_TAG] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def open_sent(image_bytes):
+    """Open the prepared image bytes"""
+    image_bytes, _, stats = image_processing.prepare_image_for_claude(image_bytes)
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    return image, stats
+
+
+def assert_upright(image):
+    """Check the red half is on top, as the photo is displayed"""
+    width, height = image.size
+    top = image.convert("RGB").getpixel((width // 2, height // 4))
+    bottom = image.convert("RGB").getpixel((width // 2, height * 3 // 4))
+    assert top[0] > 200 and top[2] < 60
+    assert bottom[2] > 200 and bottom[0] < 60
+
+
+def test_small_rotated_image_is_sent_upright():
+    image, stats = open_sent(rotated_jpeg(400, 300))
+    assert image.size == (300, 400)
+    assert image.getexif().get(image_processing.ORIENTATION_TAG, 1) == 1
+    assert stats["tokens"] == image_processing.estimate_image_tokens(300, 400)
+    assert_upright(image)
+
+
+def test_large_rotated_image_is_resized_upright():
+    stored = (constants.CLAUDE_IMAGE_MAX_EDGE * 2, constants.CLAUDE_IMAGE_MAX_EDGE)
+    image, _ = open_sent(rotated_jpeg(*stored))
+    expected = image_processing.target_size(stored[1], stored[0])
+    assert image.size == expected
+    assert image.size[1] > image.size[0]
+    assert_upright(image)
+
+
+def test_upright_image_within_limits_is_sent_as_is():
+    image_bytes = rotated_jpeg(400, 300, orientation=1)
+    sent, media_type, _ = image_processing.prepare_image_for_claude(image_bytes)
+    assert sent == image_bytes
+    assert media_type == "image/jpeg"